@@ -5,6 +5,7 @@ class DbConfig(object):
     schema = 'public'
     user = 'postgres'
     password = 'secret'
+    replica_host = None # streaming replica serving read-only routes, None to read from host
 
 class CacheDbConfig(object):
     host = 'localhost'
@@ -30,6 +31,8 @@ class MinioConfig(object):
     bucket = ''
     access_key = ''
     secret_key = ''
+    public_host = None # host in presigned urls, if clients reach the backend at another host
+    region = None # region of the buckets, requested from host if None
 
 class MinioConfigScaled(MinioConfig):
     '''Scaled images'''
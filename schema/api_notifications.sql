@@ -0,0 +1,32 @@
+-- Notifications to the data API about changes of tables it keeps in memory.
+-- The API listens on the channel `api_invalidate`, the payload is the name of
+-- the changed table. Statement level triggers send one notification per
+-- statement, notifications of one transaction are delivered on commit.
+
+CREATE OR REPLACE FUNCTION notify_api_invalidate()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        PERFORM pg_notify('api_invalidate', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$;
+
+CREATE OR REPLACE TRIGGER deployments_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON deployments
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
+
+CREATE OR REPLACE TRIGGER nodes_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON nodes
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
+
+CREATE OR REPLACE TRIGGER storage_whitelist_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON storage_whitelist
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
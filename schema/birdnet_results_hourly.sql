@@ -0,0 +1,44 @@
+-- Hourly detection counts of birdnet_results_filtered per species, deployment
+-- and confidence band of 0.01 (band 90: 0.9 <= confidence < 0.91).
+-- Counts above a threshold are the sum over the bands from the threshold up.
+--
+-- The source is a materialized view, which can't back a continuous aggregate,
+-- so the rollup is a materialized view as well, refreshed together with its
+-- source by a timescaledb job.
+
+DROP MATERIALIZED VIEW IF EXISTS birdnet_results_hourly;
+
+CREATE MATERIALIZED VIEW birdnet_results_hourly AS
+SELECT
+    r.species,
+    r.deployment_id,
+    time_bucket('1 hour', r.detection_time) AS bucket,
+    floor(r.confidence::double precision * 100)::smallint AS confidence_band,
+    count(*) AS detections
+FROM birdnet_results_filtered r
+GROUP BY r.species, r.deployment_id, bucket, confidence_band;
+
+CREATE UNIQUE INDEX IF NOT EXISTS birdnet_results_hourly_key_idx
+    ON birdnet_results_hourly USING btree (species, deployment_id, bucket, confidence_band);
+CREATE INDEX IF NOT EXISTS birdnet_results_hourly_bucket_idx
+    ON birdnet_results_hourly USING btree (bucket);
+CREATE INDEX IF NOT EXISTS birdnet_results_hourly_deployment_bucket_idx
+    ON birdnet_results_hourly USING btree (deployment_id, bucket);
+
+GRANT SELECT ON birdnet_results_hourly TO mitwelten_internal;
+
+CREATE OR REPLACE PROCEDURE refresh_birdnet_results_hourly(job_id int, config jsonb)
+    LANGUAGE plpgsql
+    SET search_path FROM CURRENT
+    AS $$
+    BEGIN
+        REFRESH MATERIALIZED VIEW CONCURRENTLY birdnet_results_filtered;
+        REFRESH MATERIALIZED VIEW CONCURRENTLY birdnet_results_hourly;
+    END;
+    $$;
+
+SELECT add_job('refresh_birdnet_results_hourly', '1 hour')
+WHERE NOT EXISTS (
+    SELECT FROM timescaledb_information.jobs
+    WHERE proc_name = 'refresh_birdnet_results_hourly'
+);
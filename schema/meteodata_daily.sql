@@ -0,0 +1,39 @@
+-- Daily summaries of meteodata per station and parameter (cache database).
+-- Percentiles, mean and variance of arbitrary ranges are computed by merging
+-- the sketches of the days in range (timescaledb_toolkit), instead of sorting
+-- all values.
+--
+-- Run outside of a transaction (refresh_continuous_aggregate).
+
+CREATE EXTENSION IF NOT EXISTS timescaledb_toolkit;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.meteodata_daily
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    station_id,
+    param_id,
+    time_bucket('1 day', ts) AS bucket,
+    percentile_agg(value) AS pct,
+    stats_agg(value) AS stats,
+    min(value) AS minimum,
+    max(value) AS maximum,
+    min(ts) AS min_time,
+    max(ts) AS max_time
+FROM public.meteodata
+GROUP BY station_id, param_id, time_bucket('1 day', ts)
+WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS meteodata_daily_station_param_bucket_idx
+    ON public.meteodata_daily USING btree (station_id, param_id, bucket);
+
+SELECT add_continuous_aggregate_policy('public.meteodata_daily',
+    start_offset => INTERVAL '30 days', end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 day', if_not_exists => true);
+
+ALTER MATERIALIZED VIEW IF EXISTS public.meteodata_daily
+    OWNER TO mw_cache_admin;
+
+GRANT SELECT ON public.meteodata_daily TO
+    mw_cache;
+
+CALL refresh_continuous_aggregate('public.meteodata_daily', NULL, NULL);
@@ -0,0 +1,53 @@
+import sys
+import psycopg2 as pg
+import traceback
+
+sys.path.append('../../')
+import credentials as crd
+
+# If the migration is complete, do not run these migrations again.
+MIGRATION_COMPLETE = False
+
+def add_ancestor_keys(pg, SCHEMA):
+    '''
+    The generated column is computed for all existing records when it is
+    added (rewriting the table) and maintained by postgres on every insert
+    or update of the gbif loader.
+    '''
+    print('add ancestor_keys to gbif')
+    sql = f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+
+    ALTER TABLE gbif
+        ADD COLUMN IF NOT EXISTS ancestor_keys bigint[] GENERATED ALWAYS AS (array_remove(ARRAY[
+            speciesKey, genusKey, familyKey, orderKey, classKey, phylumKey, kingdomKey
+        ], NULL)) STORED;
+
+    CREATE INDEX IF NOT EXISTS gbif_ancestor_keys_idx
+        ON gbif USING gin (ancestor_keys);
+
+    ANALYZE gbif;
+    '''
+    c = pg.cursor()
+    c.execute(sql)
+
+def main():
+    SCHEMA = 'public'
+
+    connection = pg.connect(host=crd.db_cache.host,port=crd.db_cache.port,database=crd.db_cache.database,user=crd.db_cache.user,password=crd.db_cache.password)
+
+    try:
+        add_ancestor_keys(connection, SCHEMA)
+    except:
+        print(traceback.format_exc())
+        print('rolling back...')
+        connection.rollback()
+    else:
+        print('committing...')
+        connection.commit()
+
+if __name__ == '__main__':
+    if MIGRATION_COMPLETE:
+        print('not running migrations')
+        sys.exit(1)
+    main()
@@ -0,0 +1,256 @@
+import sys
+import psycopg2 as pg
+from tqdm import tqdm
+import traceback
+
+sys.path.append('../../')
+import credentials as crd
+
+# If the migration is complete, do not run these migrations again.
+MIGRATION_COMPLETE = False
+
+# number of result_ids updated per transaction
+CHUNK_SIZE = 100000
+
+def add_columns(pg, SCHEMA):
+    print('add detection_time, deployment_id to birdnet_results')
+    sql = f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+
+    ALTER TABLE birdnet_results
+        ADD COLUMN IF NOT EXISTS deployment_id integer,
+        ADD COLUMN IF NOT EXISTS detection_time timestamptz;
+
+    CREATE OR REPLACE FUNCTION birdnet_results_set_detection_time()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        SET search_path FROM CURRENT
+        AS $$
+        BEGIN
+            SELECT f.time + (NEW.time_start * interval '1 second'), f.deployment_id
+            INTO NEW.detection_time, NEW.deployment_id
+            FROM files_audio f
+            WHERE f.file_id = NEW.file_id;
+            RETURN NEW;
+        END;
+        $$;
+
+    CREATE OR REPLACE TRIGGER birdnet_results_detection_time
+        BEFORE INSERT OR UPDATE OF file_id, time_start
+        ON birdnet_results
+        FOR EACH ROW
+        EXECUTE FUNCTION birdnet_results_set_detection_time();
+
+    CREATE OR REPLACE FUNCTION files_audio_propagate_detection_time()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        SET search_path FROM CURRENT
+        AS $$
+        BEGIN
+            UPDATE birdnet_results r
+            SET detection_time = NEW.time + (r.time_start * interval '1 second'),
+                deployment_id = NEW.deployment_id
+            WHERE r.file_id = NEW.file_id;
+            RETURN NEW;
+        END;
+        $$;
+
+    CREATE OR REPLACE TRIGGER files_audio_detection_time
+        AFTER UPDATE OF time, deployment_id
+        ON files_audio
+        FOR EACH ROW
+        WHEN (OLD.time IS DISTINCT FROM NEW.time OR OLD.deployment_id IS DISTINCT FROM NEW.deployment_id)
+        EXECUTE FUNCTION files_audio_propagate_detection_time();
+    '''
+    c = pg.cursor()
+    c.execute(sql)
+    pg.commit()
+
+def backfill(pg, SCHEMA):
+    '''
+    Fill the new columns in ranges of result_id, committing each range
+    separately to keep locks and WAL volume of a single transaction small.
+    New results are filled by the trigger in the meantime.
+    '''
+    print('backfill detection_time, deployment_id')
+    c = pg.cursor()
+    c.execute(f'select min(result_id), max(result_id) from {SCHEMA}.birdnet_results')
+    id_min, id_max = c.fetchone()
+    if id_min is None:
+        return
+    for start in tqdm(range(id_min, id_max + 1, CHUNK_SIZE), ascii=True):
+        c.execute(f'''
+        update {SCHEMA}.birdnet_results r
+        set detection_time = f.time + (r.time_start * interval '1 second'),
+            deployment_id = f.deployment_id
+        from {SCHEMA}.files_audio f
+        where f.file_id = r.file_id
+        and r.result_id >= %s and r.result_id < %s
+        and r.detection_time is null
+        ''', (start, start + CHUNK_SIZE))
+        pg.commit()
+
+def finalize(pg, SCHEMA):
+    print('add constraints and indexes')
+    c = pg.cursor()
+    c.execute(f'select count(*) from {SCHEMA}.birdnet_results where detection_time is null')
+    missing = c.fetchone()[0]
+    if missing:
+        print(f'{missing} results without detection_time, not setting NOT NULL')
+    else:
+        c.execute(f'ALTER TABLE {SCHEMA}.birdnet_results ALTER COLUMN detection_time SET NOT NULL')
+    c.execute(f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+
+    CREATE INDEX IF NOT EXISTS birdnet_results_detection_time_idx
+        ON birdnet_results USING btree
+        (detection_time ASC NULLS LAST);
+
+    CREATE INDEX IF NOT EXISTS birdnet_results_species_detection_time_idx
+        ON birdnet_results USING btree
+        (species ASC NULLS LAST, detection_time ASC NULLS LAST);
+
+    CREATE INDEX IF NOT EXISTS birdnet_results_deployment_detection_time_idx
+        ON birdnet_results USING btree
+        (deployment_id ASC NULLS LAST, detection_time ASC NULLS LAST);
+
+    CREATE OR REPLACE VIEW birdnet_inferred_species
+        AS
+        SELECT o.species,
+            o.confidence,
+            o.detection_time AS time_start
+        FROM birdnet_results o;
+    ''')
+    pg.commit()
+
+def update_views(pg, SCHEMA):
+    '''
+    The materialized view birdnet_results_filtered selects `r.*` and has to be
+    recreated to include the new columns. The views of inferred species read
+    the detection time from birdnet_results instead of joining files_audio,
+    as in mitwelten_v2.sql.
+
+    The rollup birdnet_results_hourly depends on birdnet_results_filtered, if
+    it is installed it is dropped first and recreated afterwards.
+    '''
+    print('recreate birdnet_results_filtered')
+    with open('../birdnet_results_filtered.sql') as f:
+        matview = f.read()
+    c = pg.cursor()
+    c.execute(f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+    SELECT to_regclass('birdnet_results_hourly') IS NOT NULL;
+    ''')
+    has_rollup = c.fetchone()[0]
+    c.execute(f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+    DROP MATERIALIZED VIEW IF EXISTS birdnet_results_hourly;
+    DROP MATERIALIZED VIEW IF EXISTS birdnet_results_filtered;
+    {matview}
+    ''')
+    if has_rollup:
+        print('recreate birdnet_results_hourly')
+        with open('../birdnet_results_hourly.sql') as f:
+            rollup = f.read()
+        c.execute(f'''
+        SET SEARCH_PATH = "{SCHEMA}";
+        {rollup}
+        ''')
+
+    print('update birdnet_inferred_species, birdnet_inferred_species_file_taxonomy')
+    c.execute(f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+
+    CREATE OR REPLACE VIEW birdnet_inferred_species
+        AS
+        SELECT o.species,
+            o.confidence,
+            o.detection_time AS time_start
+        FROM birdnet_results o;
+
+    CREATE OR REPLACE VIEW birdnet_inferred_species_file_taxonomy
+        AS
+        SELECT r.species,
+            r.confidence,
+            d.location,
+            f.object_name,
+            f.time AS object_time,
+            r.time_start AS time_start_relative,
+            f.duration AS duration,
+            r.detection_time AS time_start,
+            d1.image_url,
+            d1.label_de  species_de,
+            d1.label_en  species_en,
+            d2.label_sci genus,
+            d3.label_sci "family",
+            d4.label_sci "order",
+            d5.label_sci "class",
+            d6.label_sci phylum,
+            d7.label_sci kingdom
+
+        FROM birdnet_results r
+
+        -- link file information
+        LEFT JOIN files_audio     f  ON r.file_id    = f.file_id
+
+        -- link to species label (scientific name in GBIF taxonomy)
+        LEFT JOIN taxonomy_data d1 ON r.species    = d1.label_sci
+
+        -- link to species tree (species key to GBIF taxonomy tree)
+        LEFT JOIN taxonomy_tree   t  ON d1.datum_id  = t.species_id
+
+        -- link taxonomy tree keys to scientific labels
+        LEFT JOIN taxonomy_data d2 ON t.genus_id   = d2.datum_id
+        LEFT JOIN taxonomy_data d3 ON t.family_id  = d3.datum_id
+        LEFT JOIN taxonomy_data d4 ON t.order_id   = d4.datum_id
+        LEFT JOIN taxonomy_data d5 ON t.class_id   = d5.datum_id
+        LEFT JOIN taxonomy_data d6 ON t.phylum_id  = d6.datum_id
+        LEFT JOIN taxonomy_data d7 ON t.kingdom_id = d7.datum_id
+
+        -- link location data
+        LEFT JOIN deployments     d ON f.deployment_id = d.deployment_id
+
+        -- make sure its a species
+        WHERE t.species_id IS NOT NULL;
+    ''')
+    pg.commit()
+
+def add_notifications(pg, SCHEMA):
+    '''
+    Triggers notifying the data API of changes of deployments, nodes and
+    storage_whitelist, which it keeps in memory
+    '''
+    print('add api notification triggers')
+    with open('../api_notifications.sql') as f:
+        notifications = f.read()
+    c = pg.cursor()
+    c.execute(f'''
+    SET SEARCH_PATH = "{SCHEMA}";
+    {notifications}
+    ''')
+    pg.commit()
+
+def main():
+    SCHEMA = 'prod'
+
+    connection = pg.connect(host=crd.db.host,port=crd.db.port,database=crd.db.database,user=crd.db.user,password=crd.db.password)
+
+    try:
+        add_columns(connection, SCHEMA)
+        backfill(connection, SCHEMA)
+        finalize(connection, SCHEMA)
+        update_views(connection, SCHEMA)
+        add_notifications(connection, SCHEMA)
+    except:
+        print(traceback.format_exc())
+        print('rolling back...')
+        connection.rollback()
+    else:
+        print('committing...')
+        connection.commit()
+
+if __name__ == '__main__':
+    if MIGRATION_COMPLETE:
+        print('not running migrations')
+        sys.exit(1)
+    main()
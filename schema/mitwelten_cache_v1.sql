@@ -1,5 +1,5 @@
 --
--- Mitwelten Cache Database - Schema V1.0
+-- Mitwelten Cache Database - Schema V1.1
 --
 
 BEGIN;
@@ -34,9 +34,17 @@ CREATE TABLE IF NOT EXISTS public.gbif
     --
     mediaType character varying(255),
     media jsonb,
+    --
+    ancestor_keys bigint[] GENERATED ALWAYS AS (array_remove(ARRAY[
+        speciesKey, genusKey, familyKey, orderKey, classKey, phylumKey, kingdomKey
+    ], NULL)) STORED,
     PRIMARY KEY ("key")
 );
 
+-- lookup of occurrences by any taxon above them
+CREATE INDEX gbif_ancestor_keys_idx
+ON public.gbif USING gin (ancestor_keys);
+
 CREATE TABLE public.station (
     station_id TEXT NOT NULL,
     station_name TEXT NOT NULL,
@@ -1,5 +1,5 @@
 --
--- Mitwelten Database - Schema V2.4
+-- Mitwelten Database - Schema V2.5
 --
 
 -- search/replace "dev" by target schema
@@ -81,6 +81,8 @@ CREATE TABLE IF NOT EXISTS birdnet_results
     time_end real NOT NULL,
     confidence real NOT NULL,
     species character varying(255) NOT NULL,
+    deployment_id integer,
+    detection_time timestamptz NOT NULL,
     PRIMARY KEY (result_id)
 );
 
@@ -647,6 +649,19 @@ CREATE INDEX IF NOT EXISTS birdnet_results_tasks_fk_index
     ON birdnet_results USING btree
     (task_id ASC NULLS LAST);
 
+-- time range queries on birdnet results
+CREATE INDEX IF NOT EXISTS birdnet_results_detection_time_idx
+    ON birdnet_results USING btree
+    (detection_time ASC NULLS LAST);
+
+CREATE INDEX IF NOT EXISTS birdnet_results_species_detection_time_idx
+    ON birdnet_results USING btree
+    (species ASC NULLS LAST, detection_time ASC NULLS LAST);
+
+CREATE INDEX IF NOT EXISTS birdnet_results_deployment_detection_time_idx
+    ON birdnet_results USING btree
+    (deployment_id ASC NULLS LAST, detection_time ASC NULLS LAST);
+
 -- fast lookup of duplicates
 CREATE INDEX IF NOT EXISTS files_audio_object_name_idx
     ON files_audio USING btree
@@ -706,13 +721,85 @@ CREATE OR REPLACE VIEW birdnet_input
         LEFT JOIN deployments d ON f.deployment_id = d.deployment_id
         LEFT JOIN nodes n ON d.node_id = n.node_id;
 
+-- absolute time and deployment of birdnet results, copied from files_audio
+CREATE OR REPLACE FUNCTION birdnet_results_set_detection_time()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path FROM CURRENT
+    AS $$
+    BEGIN
+        SELECT f.time + (NEW.time_start * interval '1 second'), f.deployment_id
+        INTO NEW.detection_time, NEW.deployment_id
+        FROM files_audio f
+        WHERE f.file_id = NEW.file_id;
+        RETURN NEW;
+    END;
+    $$;
+
+CREATE OR REPLACE TRIGGER birdnet_results_detection_time
+    BEFORE INSERT OR UPDATE OF file_id, time_start
+    ON birdnet_results
+    FOR EACH ROW
+    EXECUTE FUNCTION birdnet_results_set_detection_time();
+
+-- keep birdnet results in sync with corrections of audio file records
+CREATE OR REPLACE FUNCTION files_audio_propagate_detection_time()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path FROM CURRENT
+    AS $$
+    BEGIN
+        UPDATE birdnet_results r
+        SET detection_time = NEW.time + (r.time_start * interval '1 second'),
+            deployment_id = NEW.deployment_id
+        WHERE r.file_id = NEW.file_id;
+        RETURN NEW;
+    END;
+    $$;
+
+CREATE OR REPLACE TRIGGER files_audio_detection_time
+    AFTER UPDATE OF time, deployment_id
+    ON files_audio
+    FOR EACH ROW
+    WHEN (OLD.time IS DISTINCT FROM NEW.time OR OLD.deployment_id IS DISTINCT FROM NEW.deployment_id)
+    EXECUTE FUNCTION files_audio_propagate_detection_time();
+
+-- notifications to the data API about changes of the tables it keeps in memory,
+-- as in api_notifications.sql
+CREATE OR REPLACE FUNCTION notify_api_invalidate()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        PERFORM pg_notify('api_invalidate', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$;
+
+CREATE OR REPLACE TRIGGER deployments_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON deployments
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
+
+CREATE OR REPLACE TRIGGER nodes_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON nodes
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
+
+CREATE OR REPLACE TRIGGER storage_whitelist_notify_api
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON storage_whitelist
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_api_invalidate();
+
 CREATE OR REPLACE VIEW birdnet_inferred_species
     AS
     SELECT o.species,
         o.confidence,
-        f.time + ((o.time_start || ' seconds')::interval) AS time_start
-    FROM birdnet_results o
-    LEFT JOIN files_audio f ON o.file_id = f.file_id;
+        o.detection_time AS time_start
+    FROM birdnet_results o;
 
 CREATE OR REPLACE VIEW birdnet_inferred_species_day
     AS
@@ -730,7 +817,7 @@ CREATE OR REPLACE VIEW birdnet_inferred_species_file_taxonomy
         f.time AS object_time,
         r.time_start AS time_start_relative,
         f.duration AS duration,
-        f.time + ((r.time_start || ' seconds')::interval) AS time_start,
+        r.detection_time AS time_start,
         d1.image_url,
         d1.label_de  species_de,
         d1.label_en  species_en,
@@ -0,0 +1,70 @@
+-- Hourly detection counts of pollinators per class, deployment and
+-- confidence band of 0.01 (band 90: 0.9 <= confidence < 0.91), by the time of
+-- the image they were detected in.
+-- Counts above a threshold are the sum over the bands from the threshold up.
+--
+-- pollinators is not a hypertable and gets its time from files_image, so the
+-- rollup is a materialized view refreshed by a timescaledb job.
+--
+-- The data API reads pollinators with the time and deployment of their image
+-- from pollinators_timed, refreshed by the same job before the rollup, so
+-- queries answered from either view see the same detections (lagging behind
+-- pollinators by up to an hour, like birdnet_results_filtered).
+
+DROP MATERIALIZED VIEW IF EXISTS pollinators_hourly;
+DROP MATERIALIZED VIEW IF EXISTS pollinators_timed;
+
+CREATE MATERIALIZED VIEW pollinators_timed AS
+SELECT
+    p.pollinator_id,
+    p.class,
+    p.confidence,
+    i.deployment_id,
+    i.time
+FROM pollinators p
+LEFT JOIN image_results ir ON p.result_id = ir.result_id
+LEFT JOIN files_image i ON ir.file_id = i.file_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS pollinators_timed_pollinator_id_idx
+    ON pollinators_timed USING btree (pollinator_id);
+CREATE INDEX IF NOT EXISTS pollinators_timed_time_idx
+    ON pollinators_timed USING btree (time);
+CREATE INDEX IF NOT EXISTS pollinators_timed_deployment_time_idx
+    ON pollinators_timed USING btree (deployment_id, time);
+
+GRANT SELECT ON pollinators_timed TO mitwelten_internal;
+
+CREATE MATERIALIZED VIEW pollinators_hourly AS
+SELECT
+    p.class,
+    p.deployment_id,
+    time_bucket('1 hour', p.time) AS bucket,
+    floor(p.confidence::double precision * 100)::smallint AS confidence_band,
+    count(*) AS detections
+FROM pollinators_timed p
+GROUP BY p.class, p.deployment_id, bucket, confidence_band;
+
+CREATE UNIQUE INDEX IF NOT EXISTS pollinators_hourly_key_idx
+    ON pollinators_hourly USING btree (class, deployment_id, bucket, confidence_band);
+CREATE INDEX IF NOT EXISTS pollinators_hourly_bucket_idx
+    ON pollinators_hourly USING btree (bucket);
+CREATE INDEX IF NOT EXISTS pollinators_hourly_deployment_bucket_idx
+    ON pollinators_hourly USING btree (deployment_id, bucket);
+
+GRANT SELECT ON pollinators_hourly TO mitwelten_internal;
+
+CREATE OR REPLACE PROCEDURE refresh_pollinators_hourly(job_id int, config jsonb)
+    LANGUAGE plpgsql
+    SET search_path FROM CURRENT
+    AS $$
+    BEGIN
+        REFRESH MATERIALIZED VIEW CONCURRENTLY pollinators_timed;
+        REFRESH MATERIALIZED VIEW CONCURRENTLY pollinators_hourly;
+    END;
+    $$;
+
+SELECT add_job('refresh_pollinators_hourly', '1 hour')
+WHERE NOT EXISTS (
+    SELECT FROM timescaledb_information.jobs
+    WHERE proc_name = 'refresh_pollinators_hourly'
+);
@@ -0,0 +1,173 @@
+-- Continuous aggregates of sensordata_env and sensordata_pax at 10 minutes,
+-- 1 hour and 1 day per deployment. Each measurement is kept as sum, count,
+-- min, max and a percentile sketch (timescaledb_toolkit), the coarser
+-- aggregates are built on the finer ones.
+--
+-- Run outside of a transaction (refresh_continuous_aggregate), with
+-- SEARCH_PATH set to the target schema. Converting the tables to hypertables
+-- moves existing data into chunks and locks the tables while doing so.
+--
+-- The refresh policies only cover recent data. After importing older
+-- records, refresh the affected range manually, finest aggregate first:
+--   CALL refresh_continuous_aggregate('sensordata_env_10m', '2022-01-01', '2022-02-01');
+
+CREATE EXTENSION IF NOT EXISTS timescaledb_toolkit;
+
+SELECT create_hypertable('sensordata_env', 'time', migrate_data => true, if_not_exists => true);
+SELECT create_hypertable('sensordata_pax', 'time', migrate_data => true, if_not_exists => true);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_env_10m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('10 minutes', time) AS bucket,
+    sum(temperature) AS temperature_sum,
+    count(temperature) AS temperature_count,
+    min(temperature) AS temperature_min,
+    max(temperature) AS temperature_max,
+    percentile_agg(temperature) AS temperature_pct,
+    sum(humidity) AS humidity_sum,
+    count(humidity) AS humidity_count,
+    min(humidity) AS humidity_min,
+    max(humidity) AS humidity_max,
+    percentile_agg(humidity) AS humidity_pct,
+    sum(moisture) AS moisture_sum,
+    count(moisture) AS moisture_count,
+    min(moisture) AS moisture_min,
+    max(moisture) AS moisture_max,
+    percentile_agg(moisture) AS moisture_pct
+FROM sensordata_env
+GROUP BY deployment_id, time_bucket('10 minutes', time)
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_env_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('1 hour', bucket) AS bucket,
+    sum(temperature_sum) AS temperature_sum,
+    sum(temperature_count) AS temperature_count,
+    min(temperature_min) AS temperature_min,
+    max(temperature_max) AS temperature_max,
+    rollup(temperature_pct) AS temperature_pct,
+    sum(humidity_sum) AS humidity_sum,
+    sum(humidity_count) AS humidity_count,
+    min(humidity_min) AS humidity_min,
+    max(humidity_max) AS humidity_max,
+    rollup(humidity_pct) AS humidity_pct,
+    sum(moisture_sum) AS moisture_sum,
+    sum(moisture_count) AS moisture_count,
+    min(moisture_min) AS moisture_min,
+    max(moisture_max) AS moisture_max,
+    rollup(moisture_pct) AS moisture_pct
+FROM sensordata_env_10m
+GROUP BY deployment_id, time_bucket('1 hour', bucket)
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_env_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('1 day', bucket) AS bucket,
+    sum(temperature_sum) AS temperature_sum,
+    sum(temperature_count) AS temperature_count,
+    min(temperature_min) AS temperature_min,
+    max(temperature_max) AS temperature_max,
+    rollup(temperature_pct) AS temperature_pct,
+    sum(humidity_sum) AS humidity_sum,
+    sum(humidity_count) AS humidity_count,
+    min(humidity_min) AS humidity_min,
+    max(humidity_max) AS humidity_max,
+    rollup(humidity_pct) AS humidity_pct,
+    sum(moisture_sum) AS moisture_sum,
+    sum(moisture_count) AS moisture_count,
+    min(moisture_min) AS moisture_min,
+    max(moisture_max) AS moisture_max,
+    rollup(moisture_pct) AS moisture_pct
+FROM sensordata_env_1h
+GROUP BY deployment_id, time_bucket('1 day', bucket)
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_pax_10m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('10 minutes', time) AS bucket,
+    sum(pax) AS pax_sum,
+    count(pax) AS pax_count,
+    min(pax) AS pax_min,
+    max(pax) AS pax_max,
+    percentile_agg(pax) AS pax_pct
+FROM sensordata_pax
+GROUP BY deployment_id, time_bucket('10 minutes', time)
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_pax_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('1 hour', bucket) AS bucket,
+    sum(pax_sum) AS pax_sum,
+    sum(pax_count) AS pax_count,
+    min(pax_min) AS pax_min,
+    max(pax_max) AS pax_max,
+    rollup(pax_pct) AS pax_pct
+FROM sensordata_pax_10m
+GROUP BY deployment_id, time_bucket('1 hour', bucket)
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensordata_pax_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    deployment_id,
+    time_bucket('1 day', bucket) AS bucket,
+    sum(pax_sum) AS pax_sum,
+    sum(pax_count) AS pax_count,
+    min(pax_min) AS pax_min,
+    max(pax_max) AS pax_max,
+    rollup(pax_pct) AS pax_pct
+FROM sensordata_pax_1h
+GROUP BY deployment_id, time_bucket('1 day', bucket)
+WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS sensordata_env_10m_deployment_bucket_idx
+    ON sensordata_env_10m USING btree (deployment_id, bucket);
+CREATE INDEX IF NOT EXISTS sensordata_env_1h_deployment_bucket_idx
+    ON sensordata_env_1h USING btree (deployment_id, bucket);
+CREATE INDEX IF NOT EXISTS sensordata_env_1d_deployment_bucket_idx
+    ON sensordata_env_1d USING btree (deployment_id, bucket);
+CREATE INDEX IF NOT EXISTS sensordata_pax_10m_deployment_bucket_idx
+    ON sensordata_pax_10m USING btree (deployment_id, bucket);
+CREATE INDEX IF NOT EXISTS sensordata_pax_1h_deployment_bucket_idx
+    ON sensordata_pax_1h USING btree (deployment_id, bucket);
+CREATE INDEX IF NOT EXISTS sensordata_pax_1d_deployment_bucket_idx
+    ON sensordata_pax_1d USING btree (deployment_id, bucket);
+
+SELECT add_continuous_aggregate_policy('sensordata_env_10m',
+    start_offset => INTERVAL '3 days', end_offset => INTERVAL '10 minutes',
+    schedule_interval => INTERVAL '10 minutes', if_not_exists => true);
+SELECT add_continuous_aggregate_policy('sensordata_env_1h',
+    start_offset => INTERVAL '7 days', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '1 hour', if_not_exists => true);
+SELECT add_continuous_aggregate_policy('sensordata_env_1d',
+    start_offset => INTERVAL '30 days', end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 day', if_not_exists => true);
+SELECT add_continuous_aggregate_policy('sensordata_pax_10m',
+    start_offset => INTERVAL '3 days', end_offset => INTERVAL '10 minutes',
+    schedule_interval => INTERVAL '10 minutes', if_not_exists => true);
+SELECT add_continuous_aggregate_policy('sensordata_pax_1h',
+    start_offset => INTERVAL '7 days', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '1 hour', if_not_exists => true);
+SELECT add_continuous_aggregate_policy('sensordata_pax_1d',
+    start_offset => INTERVAL '30 days', end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 day', if_not_exists => true);
+
+GRANT SELECT ON sensordata_env_10m, sensordata_env_1h, sensordata_env_1d TO mitwelten_internal;
+GRANT SELECT ON sensordata_pax_10m, sensordata_pax_1h, sensordata_pax_1d TO mitwelten_internal;
+
+CALL refresh_continuous_aggregate('sensordata_env_10m', NULL, NULL);
+CALL refresh_continuous_aggregate('sensordata_env_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('sensordata_env_1d', NULL, NULL);
+CALL refresh_continuous_aggregate('sensordata_pax_10m', NULL, NULL);
+CALL refresh_continuous_aggregate('sensordata_pax_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('sensordata_pax_1d', NULL, NULL);
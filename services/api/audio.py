@@ -0,0 +1,227 @@
+import io
+import math
+import struct
+from os import path
+import wave
+from typing import TYPE_CHECKING, NamedTuple, Optional, Tuple
+
+from api.config import derived_prefix, spectrogram_dynamic_range, spectrogram_formats, spectrogram_max_duration, wav_header_size
+from api.storage import ObjectStorage, derived_response, storage
+
+from fastapi import HTTPException, Request, Response
+from minio.error import S3Error
+from starlette.concurrency import run_in_threadpool
+
+# numpy and PIL are imported when rendering, they are slow to load
+if TYPE_CHECKING:
+    import numpy as np
+
+# ------------------------------------------------------------------------------
+# AUDIO FILES
+# ------------------------------------------------------------------------------
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# SubFormat GUIDs of WAVE_FORMAT_EXTENSIBLE carry the format code in their
+# first two bytes, followed by this suffix
+KSDATAFORMAT_SUFFIX = b'\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+
+class WavFormat(NamedTuple):
+    # the SubFormat code for WAVE_FORMAT_EXTENSIBLE
+    format_tag: int
+    channels: int
+    sample_rate: int
+    block_align: int
+    bits_per_sample: int
+    data_offset: int
+    data_size: int
+
+    @property
+    def frames(self) -> int:
+        return self.data_size // self.block_align
+
+async def read_range(backend: ObjectStorage, object_name: str, offset: int, length: int) -> bytes:
+    response = await backend.get(object_name, offset=offset, length=length)
+    return await response.read()
+
+async def read_wav_format(backend: ObjectStorage, object_name: str, file_size: int) -> WavFormat:
+    '''
+    Read the format and the position of the samples of a RIFF/WAVE file by
+    walking its chunks with ranged reads of `wav_header_size` bytes, the
+    samples themselves are not read.
+
+    Raises ValueError if the file is not a WAV file, has no data chunk or
+    is WAVE_FORMAT_EXTENSIBLE with an unknown SubFormat.
+    '''
+    buffer = await read_range(backend, object_name, 0, wav_header_size)
+    buffer_offset = 0
+    if len(buffer) < 12 or buffer[0:4] != b'RIFF' or buffer[8:12] != b'WAVE':
+        raise ValueError('not a RIFF/WAVE file')
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= file_size:
+        if offset + 8 > buffer_offset + len(buffer):
+            buffer = await read_range(backend, object_name, offset, wav_header_size)
+            buffer_offset = offset
+        start = offset - buffer_offset
+        chunk_id, chunk_size = struct.unpack('<4sI', buffer[start:start + 8])
+        if chunk_id == b'fmt ':
+            if start + 8 + min(chunk_size, 40) > len(buffer):
+                buffer = await read_range(backend, object_name, offset, wav_header_size)
+                buffer_offset = offset
+                start = 0
+            fmt = struct.unpack('<HHIIHH', buffer[start + 8:start + 24])
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+                # the actual format is the SubFormat of the extension
+                if chunk_size < 40:
+                    raise ValueError('truncated WAVE_FORMAT_EXTENSIBLE fmt chunk')
+                sub_format = buffer[start + 32:start + 48]
+                if sub_format[2:] != KSDATAFORMAT_SUFFIX:
+                    raise ValueError('unsupported SubFormat')
+                fmt = (struct.unpack('<H', sub_format[:2])[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('data chunk before fmt chunk')
+            format_tag, channels, sample_rate, _, block_align, bits_per_sample = fmt
+            data_offset = offset + 8
+            # the size of the data chunk is not updated by some recorders if recording is interrupted
+            data_size = min(chunk_size, file_size - data_offset) if chunk_size else file_size - data_offset
+            return WavFormat(format_tag, channels, sample_rate, block_align, bits_per_sample, data_offset, data_size)
+        # chunks are padded to an even size
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError('no data chunk')
+
+def frame_range(wav: WavFormat, time_start: float, time_end: float, padding: float) -> Tuple[int, int]:
+    '''
+    First frame and number of frames of the window `time_start` - `time_end`
+    (seconds from the start of the recording) extended by `padding`
+    '''
+    first = max(0, math.floor((time_start - padding) * wav.sample_rate))
+    last = min(wav.frames, math.ceil((time_end + padding) * wav.sample_rate))
+    return first, max(0, last - first)
+
+async def read_window(
+        backend: ObjectStorage,
+        object_name: str,
+        file_size: int,
+        time_start: float,
+        time_end: float,
+        padding: float = 0
+    ) -> Tuple[WavFormat, bytes]:
+    '''
+    Read the samples of a window in a PCM WAV file in storage, reading only
+    the header and the range of the window.
+    '''
+    wav = await read_wav_format(backend, object_name, file_size)
+    if wav.format_tag != WAVE_FORMAT_PCM:
+        raise ValueError(f'unsupported format {wav.format_tag:#06x}')
+    first, count = frame_range(wav, time_start, time_end, padding)
+    samples = b''
+    if count:
+        samples = await read_range(backend, object_name, wav.data_offset + first * wav.block_align, count * wav.block_align)
+    return wav, samples
+
+def compose_wav(wav: WavFormat, samples: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as snippet:
+        snippet.setnchannels(wav.channels)
+        snippet.setsampwidth(wav.block_align // wav.channels)
+        snippet.setframerate(wav.sample_rate)
+        snippet.writeframes(samples)
+    return buffer.getvalue()
+
+def decode_samples(wav: WavFormat, samples: bytes) -> 'np.ndarray':
+    '''
+    Samples as float32 in [-1, 1), channels mixed down to mono
+    '''
+    import numpy as np
+    width = wav.block_align // wav.channels
+    count = len(samples) // wav.block_align * wav.channels
+    raw = np.frombuffer(samples, dtype=np.uint8, count=count * width)
+    if width == 1:
+        x = (raw.astype(np.float32) - 128) / 128
+    elif width == 3:
+        # sign extend little endian 24 bit samples to 32 bit
+        b = raw.reshape(-1, 3).astype(np.int32)
+        x = ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8).astype(np.float32) / 2**23
+    elif width in (2, 4):
+        x = raw.view(f'<i{width}').astype(np.float32) / 2**(8 * width - 1)
+    else:
+        raise ValueError(f'unsupported sample width {width}')
+    return x.reshape(-1, wav.channels).mean(axis=1)
+
+def render_spectrogram(
+        wav: WavFormat,
+        samples: bytes,
+        n_fft: int,
+        fmax: Optional[float] = None,
+        image_format: str = 'webp',
+        dynamic_range: float = spectrogram_dynamic_range
+    ) -> bytes:
+    '''
+    Render the magnitude spectrogram of the samples as greyscale image (dark
+    is loud), frequency from bottom to top up to `fmax`, one column per STFT
+    frame of `n_fft` samples with a hop of `n_fft / 4`.
+    '''
+    import numpy as np
+    from PIL import Image
+    x = decode_samples(wav, samples)
+    if len(x) < n_fft:
+        x = np.pad(x, (0, n_fft - len(x)))
+    frames = np.lib.stride_tricks.sliding_window_view(x, n_fft)[::n_fft // 4]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1))
+    if fmax is not None:
+        spectrum = spectrum[:, :int(fmax * n_fft / wav.sample_rate) + 1]
+    db = 20 * np.log10(spectrum + 1e-10)
+    db = np.clip(db, db.max() - dynamic_range, None)
+    pixels = 255 - (db - db.min()) / max(db.max() - db.min(), 1e-10) * 255
+    image = Image.fromarray(np.flipud(pixels.T).astype(np.uint8), 'L')
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper())
+    return buffer.getvalue()
+
+async def read_recording_window(object_name: str, file_size: int, time_start: float, time_end: float, padding: float = 0) -> Tuple[WavFormat, bytes]:
+    '''
+    Read a window of a recording in the audio bucket, as `read_window()`,
+    with errors raised as HTTPException
+    '''
+    try:
+        return await read_window(storage, object_name, file_size, time_start, time_end, padding)
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            raise HTTPException(status_code=404, detail='File not found')
+        raise e
+    except ValueError as e:
+        print(str(e))
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def spectrogram_response(
+        request: Request,
+        object_name: str,
+        file_size: int,
+        time_start: float,
+        time_end: float,
+        n_fft: int,
+        fmax: Optional[float],
+        image_format: str
+    ) -> Response:
+    '''
+    Spectrogram of the window `time_start` - `time_end` of the recording
+    `object_name`, cached in the scaled bucket by its parameters.
+    '''
+    if n_fft < 128 or n_fft > 8192 or n_fft & (n_fft - 1):
+        raise HTTPException(status_code=422, detail='n_fft must be a power of 2 from 128 to 8192')
+    if time_end <= time_start or time_end - time_start > spectrogram_max_duration:
+        raise HTTPException(status_code=422, detail=f'Window must be longer than 0 and at most {spectrogram_max_duration}s')
+
+    name = path.splitext(object_name)[0]
+    fmax_name = 'nyquist' if fmax is None else f'{fmax:g}'
+    spectrogram_name = f'{derived_prefix}/spectrogram/{name}_{round(time_start * 1000)}-{round(time_end * 1000)}ms_{n_fft}_{fmax_name}.{image_format}'
+
+    async def render():
+        wav, samples = await read_recording_window(object_name, file_size, time_start, time_end)
+        return await run_in_threadpool(render_spectrogram, wav, samples, n_fft, fmax, image_format)
+
+    return await derived_response(request, spectrogram_name, spectrogram_formats[image_format], render)
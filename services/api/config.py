@@ -1,4 +1,5 @@
 import sys
+from datetime import timedelta
 sys.path.append('../')
 
 import credentials as crd
@@ -12,3 +13,119 @@ supported_image_formats = {
 }
 
 thumbnail_size = (64, 64)
+
+# maximum number of files per call to /validate/{image,audio}/batch
+validation_batch_size = 1000
+
+# maximum number of measurements per call to /ingest/{pax,env}/batch
+ingest_batch_size = 10000
+
+# maximum size in bytes of request bodies to /ingest/, checked before they are
+# parsed (a batch of ingest_batch_size measurements is about 2 MiB of JSON)
+ingest_max_body_size = 4 * 1024**2
+
+# object storage: concurrent requests and pooled connections per backend,
+# size of the chunks streamed to clients
+storage_max_concurrency = 32
+storage_pool_size = 32
+storage_chunk_size = 64 * 1024
+
+# prefix of derived objects (snippets, renditions) cached in the scaled bucket
+derived_prefix = 'derived'
+
+# bytes read from the start of a WAV file to find its fmt and data chunks
+wav_header_size = 64 * 1024
+
+# audio before and after the window of a detection in audio snippets, seconds
+snippet_padding = 1.0
+snippet_max_padding = 10.0
+
+# spectrograms: default STFT size, range of magnitudes rendered (dB),
+# maximum duration of a window (seconds), image formats
+spectrogram_n_fft = 1024
+spectrogram_dynamic_range = 80
+spectrogram_max_duration = 60.0
+spectrogram_formats = {
+    'png':  'image/png',
+    'webp': 'image/webp',
+}
+
+# crops of pollinator and flower boxes: default and maximum edge length,
+# margin around the box (fraction of its size), webp quality
+crop_size = 256
+crop_max_size = 1024
+crop_margin = 0.1
+crop_quality = 85
+
+# delivery of media per route: 'proxy' streams through the API (through the
+# media cache, if enabled), 'redirect' answers with a presigned url of the
+# object. clients opt in to redirects with `?delivery=redirect`, switch a
+# route to 'redirect' only once all of its clients follow them
+media_delivery = {
+    'files':    'proxy',
+    'tv':       'proxy',
+    'walk':     'proxy',
+    'discover': 'proxy',
+}
+
+# validity of presigned urls, they are signed in windows of half of it,
+# so that clients can cache objects by url
+presigned_url_expiry = timedelta(minutes=10)
+
+# local cache of media objects proxied from the named storage backends,
+# disabled if media_cache_dir is None; total and per object size in bytes.
+# the directory must be specific to the process, not shared by workers
+media_cache_dir = None
+media_cache_size = 2 * 1024**3
+media_cache_max_object_size = 64 * 1024**2
+media_cache_backends = ('scaled', 'web')
+# the etags of cached objects are checked against storage at most every
+# media_stat_ttl seconds, for up to media_stat_entries objects
+media_stat_ttl = 30
+media_stat_entries = 10000
+
+# variants of images uploaded by the discover app, rendered in background
+# processes as (dimensions, format), in addition to the thumbnail.
+# mirrors image_types 1 and 2 in storage/type_definitions.py
+image_variants = [
+    ((1920, 1440), 'webp'),
+    ((640, 480),   'webp'),
+]
+variant_workers = 2
+variant_job_history = 1000
+# images waiting to be rendered, further uploads are left without variants
+# until their status is requested at /variants
+variant_queue_size = 100
+
+# size of the parts of multipart uploads to /files/uploads, all but the last
+# part have this size (at least 5 MiB, as required by S3)
+multipart_part_size = 16 * 1024**2
+
+# prefix of the sha256 of multipart uploads in progress, kept as objects in the
+# storage bucket (S3 doesn't list the metadata of uploads in progress), so an
+# upload is only resumed for the same content
+multipart_checksum_prefix = 'uploads'
+
+# queries taking longer than slow_query_threshold seconds are logged with
+# their parameters. If slow_query_explain is set, the plan of slow SELECTs is
+# captured with EXPLAIN (ANALYZE, BUFFERS) in the background, at most once
+# per fingerprint every slow_query_explain_interval seconds and limited to
+# slow_query_explain_timeout seconds
+slow_query_threshold = 1.0
+slow_query_explain = False
+slow_query_explain_interval = 600
+slow_query_explain_timeout = 30
+
+# connection pools: the database has a pool for writes and one for reads
+# (from the replica if crd.db.replica_host is set), see api.database;
+# statement timeouts in seconds
+db_pools = {
+    'database_write': {'min_size': 2, 'max_size': 10, 'statement_timeout': 30},
+    'database_read':  {'min_size': 5, 'max_size': 15, 'statement_timeout': 120},
+    'database_cache': {'min_size': 5, 'max_size': 10, 'statement_timeout': 120},
+}
+
+# verified access tokens cached (until they expire), minimum interval
+# between fetches of the signing keys of keycloak on unknown key IDs (seconds)
+token_cache_size = 10000
+jwks_refresh_interval = 60
@@ -1,25 +1,99 @@
+from contextvars import ContextVar
+
 import databases
 
-from api.config import crd
-
-database = databases.Database(
-    databases.DatabaseURL('postgresql://'),
-    host=crd.db.host,
-    port=crd.db.port,
-    user=crd.db.user,
-    password=crd.db.password,
-    database=crd.db.database,
-    min_size=5,
-    max_size=10
-)
+from api.config import crd, db_pools
+
+class Database(databases.Database):
+    '''
+    `databases.Database` with connections instrumented for metrics
+    (see `api.metrics`), the pool is named by `pool_name`
+    '''
+    SUPPORTED_BACKENDS = {**databases.Database.SUPPORTED_BACKENDS, 'postgresql': 'api.metrics:InstrumentedBackend'}
+
+def create_database(config, pool_name: str, host: str = None) -> Database:
+    pool = db_pools[pool_name]
+    return Database(
+        databases.DatabaseURL('postgresql://'),
+        host=host or config.host,
+        port=config.port,
+        user=config.user,
+        password=config.password,
+        database=config.database,
+        pool_name=pool_name,
+        min_size=pool['min_size'],
+        max_size=pool['max_size'],
+        server_settings={'statement_timeout': str(int(pool['statement_timeout'] * 1000))},
+    )
+
+# set for requests of read-only routes, see `read_only()`
+read_only_context: ContextVar[bool] = ContextVar('read_only', default=False)
+
+async def read_only():
+    '''
+    Dependency of routes that only read, routing their queries to the read
+    pool (the replica, if configured)
+    '''
+    token = read_only_context.set(True)
+    try:
+        yield
+    finally:
+        read_only_context.reset(token)
+
+class DatabaseRouter:
+    '''
+    Facade of the write and the read pool of a database, sized independently
+    so that analytical reads can't starve writes of connections.
+
+    Queries go to the read pool in requests of routes depending on
+    `read_only()`, all others (and background tasks) to the write pool.
+    '''
+
+    def __init__(self, write: Database, read: Database) -> None:
+        self.write = write
+        self.read = read
+
+    @property
+    def current(self) -> Database:
+        return self.read if read_only_context.get() else self.write
+
+    async def connect(self) -> None:
+        await self.write.connect()
+        await self.read.connect()
 
-database_cache = databases.Database(
-    databases.DatabaseURL('postgresql://'),
-    host=crd.db_cache.host,
-    port=crd.db_cache.port,
-    user=crd.db_cache.user,
-    password=crd.db_cache.password,
-    database=crd.db_cache.database,
-    min_size=5,
-    max_size=10
+    async def disconnect(self) -> None:
+        await self.write.disconnect()
+        await self.read.disconnect()
+
+    async def fetch_all(self, query, values: dict = None):
+        return await self.current.fetch_all(query, values)
+
+    async def fetch_one(self, query, values: dict = None):
+        return await self.current.fetch_one(query, values)
+
+    async def fetch_val(self, query, values: dict = None, column=0):
+        return await self.current.fetch_val(query, values, column)
+
+    async def execute(self, query, values: dict = None):
+        return await self.current.execute(query, values)
+
+    async def execute_many(self, query, values: list):
+        return await self.current.execute_many(query, values)
+
+    async def iterate(self, query, values: dict = None):
+        async for record in self.current.iterate(query, values):
+            yield record
+
+    def connection(self) -> databases.core.Connection:
+        return self.current.connection()
+
+    def transaction(self, **kwargs) -> databases.core.Transaction:
+        return self.current.transaction(**kwargs)
+
+database = DatabaseRouter(
+    write=create_database(crd.db, 'database_write'),
+    # reads from the streaming replica, if there is one
+    read=create_database(crd.db, 'database_read', getattr(crd.db, 'replica_host', None)),
 )
+
+database_cache = create_database(crd.db_cache, 'database_cache')
@@ -1,17 +1,24 @@
+import asyncio
+import re
 import secrets
+from collections import OrderedDict
 from datetime import timedelta
+from hashlib import sha256
 from itertools import filterfalse
-from typing import Optional
+from time import monotonic, time
+from typing import Dict, Optional, Tuple
 
-from api.config import crd
+from api.config import crd, jwks_refresh_interval, token_cache_size
 
-from jose.exceptions import ExpiredSignatureError
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
 from asyncpg.pgproto.types import Point as PgPoint
 from asyncpg.types import Range
 from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, OAuth2AuthorizationCodeBearer
 from keycloak import KeycloakOpenID
 from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.types import UserDefinedType
 
 keycloak_openid = KeycloakOpenID(
@@ -21,25 +28,91 @@ keycloak_openid = KeycloakOpenID(
     client_secret_key=crd.oidc.KC_CLIENT_SECRET,
 )
 
-crd.oidc.KC_PUBLIC_KEY = (
-    '-----BEGIN PUBLIC KEY-----\n'
-    + keycloak_openid.public_key()
-    + '\n-----END PUBLIC KEY-----'
-)
+class TokenVerifier:
+    '''
+    Verification of the access tokens of keycloak.
+
+    Tokens are verified with the signing keys of the realm (JWKS), selected by
+    the key ID in their header. The keys are fetched on startup and again
+    when a token is signed by an unknown key (after a key rotation), at most
+    every `refresh_interval` seconds.
+
+    The claims of verified tokens are kept in an LRU cache of `cache_size`
+    entries keyed by the hash of the token, until the token expires, so the
+    signature of a token is verified only once.
+    '''
+
+    def __init__(self, cache_size: int = token_cache_size, refresh_interval: float = jwks_refresh_interval) -> None:
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self.keys: Dict[str, dict] = {}
+        self.fetched_at = None
+        self.tokens: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+
+    async def load_keys(self) -> None:
+        certs = await run_in_threadpool(keycloak_openid.certs)
+        self.keys = {key['kid']: key for key in certs['keys'] if key.get('use', 'sig') == 'sig'}
+        self.fetched_at = monotonic()
+
+    async def load(self, retry_delay: float = 1, max_retry_delay: float = 60) -> None:
+        '''
+        Fetch the signing keys, retrying with increasing delay while keycloak
+        is not reachable. Tokens can't be verified until then.
+        '''
+        delay = retry_delay
+        while True:
+            try:
+                await self.load_keys()
+            except Exception as e:
+                print(f'keycloak signing keys: {e}, retrying in {delay}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_retry_delay)
+            else:
+                return
+
+    async def verify(self, token: str) -> dict:
+        '''
+        Claims of `token`, raises `JWTError` (`ExpiredSignatureError` for
+        expired tokens) if it is not valid
+        '''
+        digest = sha256(token.encode()).hexdigest()
+        entry = self.tokens.get(digest)
+        if entry is not None:
+            if entry[0] > time():
+                self.tokens.move_to_end(digest)
+                return entry[1]
+            del self.tokens[digest]
+
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid not in self.keys and (self.fetched_at is None or monotonic() - self.fetched_at >= self.refresh_interval):
+            await self.load_keys()
+        if kid not in self.keys:
+            raise JWTError(f'Unknown signing key {kid}')
+        key = self.keys[kid]
+        claims = jwt.decode(token, key, algorithms=[key.get('alg', 'RS256')], options={'verify_aud': False})
+
+        self.tokens[digest] = (claims.get('exp', 0), claims)
+        if len(self.tokens) > self.cache_size:
+            self.tokens.popitem(last=False)
+        return claims
+
+token_verifier = TokenVerifier()
 
 oauth2_scheme = OAuth2AuthorizationCodeBearer(
     authorizationUrl=f'{crd.oidc.KC_SERVER_URL}realms/{crd.oidc.KC_REALM_NAME}/protocol/openid-connect/auth',
     tokenUrl=f'{crd.oidc.KC_SERVER_URL}realms/{crd.oidc.KC_REALM_NAME}/protocol/openid-connect/token',
 )
 
-def get_user(token: str = Depends(oauth2_scheme)):
+# for routes that respond to anonymous requests as well
+optional_oauth2_scheme = OAuth2AuthorizationCodeBearer(
+    authorizationUrl=oauth2_scheme.model.flows.authorizationCode.authorizationUrl,
+    tokenUrl=oauth2_scheme.model.flows.authorizationCode.tokenUrl,
+    auto_error=False,
+)
+
+async def get_user(token: str = Depends(oauth2_scheme)) -> Optional[dict]:
     try:
-        auth = keycloak_openid.decode_token(
-            token,
-            key=crd.oidc.KC_PUBLIC_KEY,
-            options={'verify_signature': True, 'verify_aud': False, 'exp': True},
-        )
-        return auth
+        return await token_verifier.verify(token)
 
     except ExpiredSignatureError:
         raise HTTPException(
@@ -49,12 +122,42 @@ def get_user(token: str = Depends(oauth2_scheme)):
     except:
         return None
 
+class AuthContext:
+    '''
+    Identity of the user of a request, if authenticated
+    '''
+
+    def __init__(self, claims: Optional[dict] = None) -> None:
+        self.claims = claims or {}
+        self.sub: Optional[str] = self.claims.get('sub')
+        self.roles = frozenset(self.claims.get('realm_access', {}).get('roles', []))
+
+    @property
+    def authenticated(self) -> bool:
+        return bool(self.claims)
+
+    def has_role(self, role: str) -> bool:
+        return role in self.roles
+
+async def get_auth(token: Optional[str] = Depends(optional_oauth2_scheme)) -> AuthContext:
+    '''
+    Authentication of the request, decoded once per request and shared by
+    all dependencies of the route. Not authenticated without (valid) token.
+    '''
+    return AuthContext(await get_user(token) if token else None)
+
 class AuthenticationChecker:
     def __init__(self, required_roles: list = ['public']) -> None:
         self.required_roles = required_roles
-    def __call__(self, user: dict = Depends(get_user)) -> bool:
+    def __call__(self, auth: AuthContext = Depends(get_auth)) -> bool:
+        if not auth.authenticated:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail='Authentication failed',
+                headers={'WWW-Authenticate': 'Bearer'},
+            )
         for r_perm in self.required_roles:
-            if r_perm not in user['realm_access']['roles']:
+            if not auth.has_role(r_perm):
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail='Invalid Permissions',
@@ -63,11 +166,7 @@ class AuthenticationChecker:
 
 async def check_oid_authentication(token: str = Depends(oauth2_scheme)):
     try:
-        auth = keycloak_openid.decode_token(
-            token,
-            key=crd.oidc.KC_PUBLIC_KEY,
-            options={'verify_signature': True, 'verify_aud': False, 'exp': True},
-        )
+        auth = await token_verifier.verify(token)
         if 'internal' not in auth['realm_access']['roles']:
             raise
     except:
@@ -81,11 +180,7 @@ async def check_oid_authentication(token: str = Depends(oauth2_scheme)):
 
 async def check_oid_m2m_authentication(role, token: str = Depends(oauth2_scheme)):
     try:
-        auth = keycloak_openid.decode_token(
-            token,
-            key=crd.oidc.KC_PUBLIC_KEY,
-            options={'verify_signature': True, 'verify_aud': False, 'exp': True},
-        )
+        auth = await token_verifier.verify(token)
         if role == None or role not in auth['realm_access']['roles']:
             raise
     except:
@@ -134,6 +229,45 @@ def from_inclusive_range(period: Range) -> Range:
 def to_inclusive_range(period: Range) -> Range:
     return Range(period.lower, None if period.upper == None else period.upper + timedelta(days=1))
 
+bucket_width_units = {
+    'weeks': ('w', 'week', 'weeks'),
+    'days': ('d', 'day', 'days'),
+    'hours': ('h', 'hr', 'hour', 'hours'),
+    'minutes': ('m', 't', 'min', 'mins', 'minute', 'minutes'),
+    'seconds': ('s', 'sec', 'secs', 'second', 'seconds'),
+    'milliseconds': ('l', 'ms', 'milli', 'millis', 'millisecond', 'milliseconds'),
+}
+bucket_width_unit = {alias: unit for unit, aliases in bucket_width_units.items() for alias in aliases}
+bucket_width_component = re.compile(r'\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]+)')
+
+def parse_bucket_width(value: str) -> timedelta:
+    '''
+    Parse a bucket width of one or more components of a number and a unit,
+    such as `1d`, `6h`, `1h 30min` or `2W` (the units of pandas.to_timedelta
+    up to weeks, case-insensitive except for `M`, which is rejected as it
+    means months elsewhere), or `hh:mm:ss`
+    '''
+    text = value.strip()
+    width = timedelta()
+    try:
+        clock = re.fullmatch(r'(\d+):(\d{2}):(\d{2}(?:\.\d+)?)', text)
+        if clock:
+            width = timedelta(hours=int(clock[1]), minutes=int(clock[2]), seconds=float(clock[3]))
+        else:
+            position = 0
+            while position < len(text):
+                component = bucket_width_component.match(text, position)
+                if component is None or component[2] == 'M' or component[2].lower() not in bucket_width_unit:
+                    width = None
+                    break
+                width += timedelta(**{bucket_width_unit[component[2].lower()]: float(component[1])})
+                position = component.end()
+    except (OverflowError, ValueError):
+        width = None
+    if not width or width <= timedelta(0):
+        raise HTTPException(status_code=422, detail=f'Invalid bucket width: {value}')
+    return width
+
 class GeometryPoint(UserDefinedType):
 
     def get_col_spec(self):
@@ -176,6 +310,24 @@ def aggregation_mapper(aggregation, column_name):
         return None
     return mapping[aggregation].format(column_name)
 
+def rollup_aggregation_mapper(aggregation, column_name):
+    '''
+    Aggregation of the `_sum`, `_count`, `_min`, `_max` and `_pct` (percentile
+    sketch) columns of sensordata rollups
+    '''
+    mapping = {
+        'mean': 'sum({0}_sum)::double precision / nullif(sum({0}_count), 0) as value',
+        'sum': 'sum({0}_sum) as value',
+        'min': 'min({0}_min) as value',
+        'max': 'max({0}_max) as value',
+        'median': 'approx_percentile(0.5, rollup({0}_pct)) as value',
+        'q1': 'approx_percentile(0.25, rollup({0}_pct)) as value',
+        'q3': 'approx_percentile(0.75, rollup({0}_pct)) as value',
+    }
+    if not aggregation in mapping:
+        return None
+    return mapping[aggregation].format(column_name)
+
 def pollinator_class_mapper(pollinator_class):
     mapping = {
         'fliege': 5564,
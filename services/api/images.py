@@ -0,0 +1,46 @@
+import io
+import math
+from typing import Optional, Tuple
+
+from api.config import crop_margin, crop_quality
+
+# ------------------------------------------------------------------------------
+# IMAGE FILES
+# ------------------------------------------------------------------------------
+
+def crop_image(
+        content: bytes,
+        box: Tuple[int, int, int, int],
+        resolution: Optional[Tuple[int, int]],
+        size: int,
+        margin: float = crop_margin
+    ) -> bytes:
+    '''
+    Cut the box `x0, y0, x1, y1` (in pixels of the original `resolution`)
+    extended by `margin` out of an image and fit it into `size` x `size`,
+    encoded as WebP.
+
+    JPEG sources are decoded in draft mode at the smallest DCT scale that
+    keeps the box at least `size` pixels wide or high.
+    '''
+    from PIL import Image
+    image = Image.open(io.BytesIO(content))
+    width, height = resolution or image.size
+    x0, y0, x1, y1 = box
+    mx, my = (x1 - x0) * margin, (y1 - y0) * margin
+    x0, y0 = max(0, x0 - mx), max(0, y0 - my)
+    x1, y1 = min(width, x1 + mx), min(height, y1 + my)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError('empty box')
+
+    if image.format == 'JPEG':
+        scale = min(1, max(size / (x1 - x0), size / (y1 - y0)))
+        image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    sx, sy = image.width / width, image.height / height
+    crop = image.crop((math.floor(x0 * sx), math.floor(y0 * sy), math.ceil(x1 * sx), math.ceil(y1 * sy)))
+    crop.thumbnail((size, size))
+    if crop.mode not in ('RGB', 'RGBA'):
+        crop = crop.convert('RGB')
+    buffer = io.BytesIO()
+    crop.save(buffer, format='WEBP', quality=crop_quality)
+    return buffer.getvalue()
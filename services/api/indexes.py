@@ -0,0 +1,277 @@
+import asyncio
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from api.database import database
+from api.tables import deployments, nodes, storage_whitelist, taxonomy_data, taxonomy_tree
+
+from sqlalchemy.sql import func, select
+
+# ------------------------------------------------------------------------------
+# IN-MEMORY INDEXES
+# ------------------------------------------------------------------------------
+
+class TaxonomyIndex:
+    '''
+    Lookup of all species below a taxon of any rank.
+
+    `taxonomy_tree` and `taxonomy_data` are only ever changed by imports,
+    they are loaded once and the descendant species of every taxon key in the
+    tree are precomputed. The tables are checked for changes at most every
+    `refresh_interval` seconds, and reloaded if their fingerprint changed.
+    '''
+
+    rank_columns = ['species_id', 'genus_id', 'family_id', 'order_id', 'class_id', 'phylum_id', 'kingdom_id']
+
+    def __init__(self, refresh_interval: float = 60) -> None:
+        self.refresh_interval = refresh_interval
+        self.descendants: Dict[int, Tuple[int, ...]] = {}
+        self.labels: Dict[int, str] = {}
+        self.fingerprint = None
+        self.checked_at = None
+        self.lock = asyncio.Lock()
+
+    async def get_fingerprint(self):
+        query = select(
+            select(func.count()).select_from(taxonomy_tree).scalar_subquery().label('tree_count'),
+            select(func.count()).select_from(taxonomy_data).scalar_subquery().label('data_count'),
+            select(func.max(taxonomy_data.c.updated_at)).scalar_subquery().label('data_updated'),
+        )
+        result = await database.fetch_one(query)
+        return tuple(result._mapping.values())
+
+    async def load(self) -> None:
+        fingerprint = await self.get_fingerprint()
+        tree = await database.fetch_all(select(taxonomy_tree))
+        data = await database.fetch_all(select(taxonomy_data.c.datum_id, taxonomy_data.c.label_sci))
+
+        descendants = defaultdict(set)
+        for row in tree:
+            species_id = row['species_id']
+            if species_id is None:
+                continue
+            for column in self.rank_columns:
+                if row[column] is not None:
+                    descendants[row[column]].add(species_id)
+
+        self.descendants = {key: tuple(sorted(ids)) for key, ids in descendants.items()}
+        self.labels = {datum['datum_id']: datum['label_sci'] for datum in data}
+        self.fingerprint = fingerprint
+        self.checked_at = monotonic()
+
+    async def refresh(self) -> None:
+        '''
+        Reload the index if the taxonomy tables changed since the last check.
+        Requests arriving while a check is running use the current state.
+        '''
+        if self.checked_at is not None and monotonic() - self.checked_at < self.refresh_interval:
+            return
+        if self.lock.locked() and self.checked_at is not None:
+            return
+        async with self.lock:
+            if self.checked_at is not None and monotonic() - self.checked_at < self.refresh_interval:
+                return
+            if self.checked_at is None or await self.get_fingerprint() != self.fingerprint:
+                await self.load()
+            else:
+                self.checked_at = monotonic()
+
+    async def species_ids(self, identifier: int) -> List[int]:
+        '''
+        Species keys of the taxon `identifier` and all taxa below it
+        '''
+        await self.refresh()
+        return list(self.descendants.get(identifier, ()))
+
+    async def species_labels(self, identifier: int) -> List[str]:
+        '''
+        Scientific labels of the species below the taxon `identifier`,
+        as used in `birdnet_results.species`
+        '''
+        await self.refresh()
+        return [self.labels[i] for i in self.descendants.get(identifier, ()) if i in self.labels]
+
+taxonomy_index = TaxonomyIndex()
+
+class NotifiedIndex(ABC):
+    '''
+    Base of indexes of tables that notify changes (see `api.notifications`).
+
+    The index is marked stale when a notification arrives and reloaded on the
+    next lookup. The fingerprint of its tables is checked every
+    `refresh_interval` seconds while no listener is connected, and every
+    `verify_interval` seconds while listening, in case notifications are lost
+    (on a half-open connection, or with triggers dropped), reloading the index
+    if it changed.
+    '''
+
+    def __init__(self, refresh_interval: float = 60, verify_interval: float = 600) -> None:
+        self.refresh_interval = refresh_interval
+        self.verify_interval = verify_interval
+        self.fingerprint = None
+        self.checked_at = None
+        self.stale = True
+        self.listening = False
+        self.lock = asyncio.Lock()
+
+    @abstractmethod
+    async def get_fingerprint(self) -> tuple:
+        '''
+        Summary of the tables of the index, cheap to query, changing with
+        every change relevant to the index
+        '''
+
+    @abstractmethod
+    async def load(self) -> None:
+        '''
+        Load the index from the database
+        '''
+
+    def invalidate(self) -> None:
+        self.stale = True
+
+    def set_listening(self, listening: bool) -> None:
+        self.listening = listening
+
+    async def refresh(self) -> None:
+        '''
+        Reload the index if it has been invalidated, or if its fingerprint
+        changed when checked after `refresh_interval` (`verify_interval` while
+        changes are notified).
+        '''
+        def expired():
+            interval = self.verify_interval if self.listening else self.refresh_interval
+            return self.stale or self.checked_at is None or monotonic() - self.checked_at >= interval
+        if not expired():
+            return
+        async with self.lock:
+            if not expired():
+                return
+            # cleared before querying, a notification arriving during the load marks it stale again
+            stale, self.stale = self.stale, False
+            try:
+                fingerprint = await self.get_fingerprint()
+                if stale or self.checked_at is None or fingerprint != self.fingerprint:
+                    await self.load()
+                    self.fingerprint = fingerprint
+            except Exception:
+                self.stale = self.stale or stale
+                raise
+            self.checked_at = monotonic()
+
+class DeploymentIndex(NotifiedIndex):
+    '''
+    Lookup of the deployment of a node covering a point in time.
+
+    The periods of all deployments are loaded at once and sorted by their
+    start per node label and per serial number. The periods of a node don't
+    overlap, so the deployment covering a timestamp is found by a binary
+    search over the starts. Reloaded when `deployments` or `nodes` change.
+    '''
+
+    def __init__(self, refresh_interval: float = 60, verify_interval: float = 600) -> None:
+        super().__init__(refresh_interval, verify_interval)
+        self.by_label: Dict[str, Tuple[List[datetime], List[tuple]]] = {}
+        self.by_eui: Dict[str, Tuple[List[datetime], List[tuple]]] = {}
+
+    async def get_fingerprint(self) -> tuple:
+        row = func.concat_ws('|', deployments.c.deployment_id, deployments.c.period, nodes.c.node_label, nodes.c.serial_number)
+        query = select(func.count().label('count'), func.sum(func.hashtext(row)).label('hash')).\
+            select_from(deployments.join(nodes))
+        return tuple((await database.fetch_one(query))._mapping.values())
+
+    async def load(self) -> None:
+        query = select(nodes.c.node_label, nodes.c.serial_number, deployments.c.deployment_id,
+                func.lower(deployments.c.period).label('period_start'),
+                func.upper(deployments.c.period).label('period_end'),
+                func.lower_inc(deployments.c.period).label('start_inc'),
+                func.upper_inc(deployments.c.period).label('end_inc')).\
+            select_from(deployments.join(nodes))
+        by_label, by_eui = defaultdict(list), defaultdict(list)
+        for d in await database.fetch_all(query):
+            # unbounded starts sort first
+            start = d['period_start'] or datetime.min.replace(tzinfo=timezone.utc)
+            entry = (start, d['period_end'], d['start_inc'], d['end_inc'], d['deployment_id'])
+            by_label[d['node_label']].append(entry)
+            if d['serial_number'] is not None:
+                by_eui[d['serial_number']].append(entry)
+        self.by_label = {key: self.sort_periods(entries) for key, entries in by_label.items()}
+        self.by_eui = {key: self.sort_periods(entries) for key, entries in by_eui.items()}
+
+    @staticmethod
+    def sort_periods(entries: List[tuple]) -> Tuple[List[datetime], List[tuple]]:
+        entries = sorted(entries, key=lambda entry: entry[0])
+        return [entry[0] for entry in entries], entries
+
+    @staticmethod
+    def covers(entry: tuple, time: datetime) -> bool:
+        start, end, start_inc, end_inc, _ = entry
+        if time < start or (time == start and not start_inc):
+            return False
+        return end is None or time < end or (time == end and end_inc)
+
+    async def deployment_id(self, time: datetime, node_label: Optional[str] = None, serial_number: Optional[str] = None) -> Optional[int]:
+        '''
+        ID of the deployment of the node identified by `node_label`, or else
+        by `serial_number`, with a period covering `time`. Naive timestamps
+        are taken as UTC.
+        '''
+        await self.refresh()
+        if node_label is not None:
+            periods = self.by_label.get(node_label)
+        elif serial_number is not None:
+            periods = self.by_eui.get(serial_number)
+        else:
+            return None
+        if not periods:
+            return None
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=timezone.utc)
+        starts, entries = periods
+        i = bisect_right(starts, time)
+        # the previous period may end inclusively at an exclusive start
+        for entry in entries[max(i - 2, 0):i][::-1]:
+            if self.covers(entry, time):
+                return entry[4]
+        return None
+
+deployment_index = DeploymentIndex()
+
+class WhitelistIndex(NotifiedIndex):
+    '''
+    Lookup of object names in `storage_whitelist`, by exact name in a set and
+    by prefix with a binary search over the sorted names. Reloaded when
+    `storage_whitelist` changes.
+    '''
+
+    def __init__(self, refresh_interval: float = 60, verify_interval: float = 600) -> None:
+        super().__init__(refresh_interval, verify_interval)
+        self.names: frozenset = frozenset()
+        self.sorted_names: List[str] = []
+
+    async def get_fingerprint(self) -> tuple:
+        query = select(func.count().label('count'), func.sum(func.hashtext(storage_whitelist.c.object_name)).label('hash'))
+        return tuple((await database.fetch_one(query))._mapping.values())
+
+    async def load(self) -> None:
+        names = [r['object_name'] for r in await database.fetch_all(select(storage_whitelist.c.object_name))]
+        self.names = frozenset(names)
+        self.sorted_names = sorted(names)
+
+    async def contains(self, object_name: str) -> bool:
+        await self.refresh()
+        return object_name in self.names
+
+    async def contains_prefix(self, prefix: str) -> bool:
+        '''
+        Check if any whitelisted object name starts with `prefix`
+        '''
+        await self.refresh()
+        i = bisect_left(self.sorted_names, prefix)
+        return i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix)
+
+whitelist_index = WhitelistIndex()
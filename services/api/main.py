@@ -1,9 +1,17 @@
+import asyncio
+
 from api.database import database, database_cache
-from api.dependencies import crd
+from api.dependencies import crd, token_verifier
+from api.metrics import MetricsMiddleware, metrics_response
+from api.indexes import deployment_index, taxonomy_index, whitelist_index
+from api.mediacache import media_cache
+from api.notifications import listener
+from api.storage import check_buckets
+from api.variants import variant_jobs
 from api.routers import (
     birdnet, data, deployments, discover, geo, notes, ingest, minio, nodes, queue, tags,
     taxonomy, validators, walk, meteodata, pollinators, explore, gbif,
-    environment, statistics, auth, tv
+    environment, statistics, auth, tv, monitoring
 )
 
 from fastapi import Depends, FastAPI, Request, status
@@ -13,6 +21,7 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
 from redis import asyncio as aioredis
+from starlette.concurrency import run_in_threadpool
 
 tags_metadata = [
     {
@@ -82,6 +91,10 @@ tags_metadata = [
     {
         'name': 'statistics',
         'description': 'Statistics for image and audio files by deployment',
+    },
+    {
+        'name': 'monitoring',
+        'description': 'Statistics of the API',
     }
 ]
 
@@ -116,6 +129,8 @@ if crd.DEV == True:
         allow_headers=['*'],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth.router)
 app.include_router(birdnet.router)
 app.include_router(data.router)
@@ -138,6 +153,7 @@ app.include_router(explore.router)
 app.include_router(gbif.router)
 app.include_router(environment.router)
 app.include_router(statistics.router)
+app.include_router(monitoring.router)
 
 
 @app.exception_handler(RequestValidationError)
@@ -147,18 +163,42 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     content = {'status_code': 10422, 'message': exc_str, 'data': None}
     return JSONResponse(content=content, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
+background_tasks = []
+
 @app.on_event('startup')
 async def startup():
     await database.connect()
     await database_cache.connect()
+    await taxonomy_index.load()
+    listener.register('deployments', deployment_index.invalidate)
+    listener.register('nodes', deployment_index.invalidate)
+    listener.register('storage_whitelist', whitelist_index.invalidate)
+    listener.on_state(deployment_index.set_listening)
+    listener.on_state(whitelist_index.set_listening)
+    await listener.start()
+    await deployment_index.refresh()
+    await whitelist_index.refresh()
+    await run_in_threadpool(media_cache.restore)
+    # external services are checked in the background, they may be unavailable
+    background_tasks.append(asyncio.create_task(token_verifier.load()))
+    background_tasks.append(asyncio.create_task(check_buckets()))
+    await variant_jobs.start()
     redis = RedisBackend(aioredis.from_url('redis://redis_cache'))
     FastAPICache.init(backend=redis, prefix='fastapi-cache')
 
 @app.on_event('shutdown')
 async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await listener.stop()
+    await variant_jobs.stop()
     await database.disconnect()
     await database_cache.disconnect()
 
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
 @app.get('/', include_in_schema=False)
 async def root():
     return { 'name': 'Mitwelten Data API', 'version': '3.0' }
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from collections import OrderedDict
+from hashlib import sha256
+from time import monotonic
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Optional, Tuple
+
+from api.config import media_cache_dir, media_cache_max_object_size, media_cache_size, media_stat_entries, media_stat_ttl
+
+# ------------------------------------------------------------------------------
+# MEDIA CACHE
+# ------------------------------------------------------------------------------
+
+class DiskCache:
+    '''
+    Cache of objects in files of `directory`, at most `max_size` bytes in
+    total, evicting the least recently used. Entries are keyed by bucket,
+    object name and etag, a changed object is cached under a new key and its
+    old entry ages out.
+
+    Concurrent misses of the same key are filled by a single download.
+    The cache is disabled if no directory is configured.
+
+    The index of the entries is kept in memory, the directory must not be
+    shared by several processes (e.g. uvicorn workers): each would evict
+    files the others still index, and remove their downloads in progress
+    when starting. Give each process its own directory.
+    '''
+
+    def __init__(self, directory: Optional[str], max_size: int, max_object_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.max_object_size = max_object_size
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.filling: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @staticmethod
+    def key(bucket: str, object_name: str, etag: str) -> str:
+        return sha256(f'{bucket}/{object_name}@{etag}'.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def restore(self) -> None:
+        '''
+        Index the entries left in the directory by a previous process, least
+        recently modified first, and remove incomplete downloads. Called on
+        startup, before serving requests.
+        '''
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.part'):
+                    os.unlink(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.size += size
+        self.evict()
+
+    def lookup(self, key: str) -> Optional[Tuple[BinaryIO, os.stat_result]]:
+        if key not in self.entries:
+            return None
+        entry = self.open(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def open(self, key: str) -> Optional[Tuple[BinaryIO, os.stat_result]]:
+        '''
+        Open the file of entry `key`, returning it with its stat. The open
+        file stays readable if the entry is evicted in the meantime. Entries
+        whose file is gone are dropped.
+        '''
+        try:
+            file = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            size = self.entries.pop(key, None)
+            if size is not None:
+                self.size -= size
+            return None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        return file, os.fstat(file.fileno())
+
+    async def fill(self, key: str, size: int, download: Callable[[str], Awaitable[None]]) -> Optional[str]:
+        '''
+        Download an object of `size` bytes into the cache with `download`,
+        which writes it to the path it is passed. Returns the path of the
+        entry, None if the object is not cached.
+        '''
+        if size > self.max_object_size:
+            return None
+        self.misses += 1
+        if key not in self.filling:
+            self.filling[key] = asyncio.create_task(self.download(key, download))
+        try:
+            return await asyncio.shield(self.filling[key])
+        except Exception as e:
+            print(f'media cache: {e}')
+            return None
+
+    async def download(self, key: str, download: Callable[[str], Awaitable[None]]) -> str:
+        path = self.path(key)
+        try:
+            await download(path + '.part')
+            os.replace(path + '.part', path)
+            size = os.path.getsize(path)
+            self.entries[key] = size
+            self.size += size
+            self.evict()
+            return path
+        finally:
+            self.filling.pop(key, None)
+            if os.path.exists(path + '.part'):
+                os.unlink(path + '.part')
+
+    def evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else None,
+            'evictions': self.evictions,
+        }
+
+class StatCache:
+    '''
+    Stats of recently requested objects, kept for `ttl` seconds, at most
+    `max_entries`, evicting the least recently used. Spares cache hits the
+    request to storage for the etag of the object.
+    '''
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Tuple[str, str], Tuple[float, Any]] = OrderedDict()
+
+    async def get(self, bucket: str, object_name: str, stat: Callable[[], Awaitable[Any]]) -> Any:
+        '''
+        Stat of `object_name` in `bucket`, requested with `stat` if it isn't
+        known or older than `ttl`
+        '''
+        key = (bucket, object_name)
+        entry = self.entries.get(key)
+        if entry is not None and monotonic() - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            return entry[1]
+        result = await stat()
+        self.entries[key] = (monotonic(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return result
+
+media_cache = DiskCache(media_cache_dir, media_cache_size, media_cache_max_object_size)
+media_stat_cache = StatCache(media_stat_ttl, media_stat_entries)
@@ -0,0 +1,251 @@
+import asyncio
+import re
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from hashlib import sha1
+from time import monotonic, perf_counter
+from typing import Dict, List, Optional
+
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api.config import slow_query_explain, slow_query_explain_interval, slow_query_explain_timeout, slow_query_threshold
+
+# ------------------------------------------------------------------------------
+# METRICS
+# ------------------------------------------------------------------------------
+
+request_duration = Histogram('api_request_duration_seconds', 'Duration of requests',
+    ['method', 'route', 'status'])
+requests_in_flight = Gauge('api_requests_in_flight', 'Requests being processed',
+    ['method', 'route'])
+
+pool_wait = Histogram('api_db_pool_wait_seconds', 'Time waited for a connection of the pool',
+    ['pool'], buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+pool_waiting = Gauge('api_db_pool_waiting', 'Tasks waiting for a connection of the pool', ['pool'])
+pool_size = Gauge('api_db_pool_size', 'Connections opened by the pool', ['pool'])
+pool_in_use = Gauge('api_db_pool_in_use', 'Connections of the pool checked out', ['pool'])
+pool_max_size = Gauge('api_db_pool_max_size', 'Maximum number of connections of the pool', ['pool'])
+
+query_duration = Histogram('api_db_query_duration_seconds', 'Duration of queries by fingerprint',
+    ['pool', 'fingerprint'])
+query_rows = Histogram('api_db_query_rows', 'Rows returned by queries by fingerprint',
+    ['pool', 'fingerprint'], buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000))
+
+# normalized statement of each fingerprint seen, the labels only carry the hash
+statements: Dict[str, str] = {}
+
+# route template of the request being processed, attached to its queries
+current_route: ContextVar[Optional[str]] = ContextVar('current_route', default=None)
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# ------------------------------------------------------------------------------
+# REQUESTS
+# ------------------------------------------------------------------------------
+
+def route_template(scope: Scope) -> str:
+    '''
+    Path template of the route matching the request, so that requests of
+    e.g. `/nodes/{node_id}` share their series. Unmatched paths are pooled.
+    '''
+    partial = None
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or 'unmatched'
+
+class MetricsMiddleware:
+    '''
+    Record the duration of HTTP requests by route template and status, and
+    the number of requests in flight
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        method = scope['method']
+        route = route_template(scope)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        in_flight = requests_in_flight.labels(method, route)
+        in_flight.inc()
+        token = current_route.set(route)
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            request_duration.labels(method, route, status).observe(perf_counter() - start)
+            in_flight.dec()
+            current_route.reset(token)
+
+# ------------------------------------------------------------------------------
+# DATABASE
+# ------------------------------------------------------------------------------
+
+@lru_cache(maxsize=4096)
+def fingerprint(query: str) -> str:
+    '''
+    Hash of `query` with literals and parameters replaced by `?`, lists of
+    them collapsed and whitespace normalized, so that executions of the same
+    statement with different values share a fingerprint.
+    '''
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', query)
+    normalized = re.sub(r'\$\d+|\b\d+(?:\.\d+)?\b', '?', normalized)
+    normalized = re.sub(r'\?(?:\s*,\s*\?)+', '?', normalized)
+    normalized = ' '.join(normalized.split())
+    key = sha1(normalized.encode()).hexdigest()[:16]
+    statements.setdefault(key, normalized)
+    return key
+
+class QueryLog:
+    '''
+    Statistics of the queries by fingerprint, for finding the slowest.
+
+    Queries slower than `slow_query_threshold` are logged with their
+    parameters and the route they were run for. With `slow_query_explain`,
+    the plan of slow SELECTs is captured by running them again with
+    `EXPLAIN (ANALYZE, BUFFERS)` in a read-only transaction, one at a time.
+    '''
+
+    def __init__(self) -> None:
+        self.queries: Dict[str, dict] = {}
+        self.explaining = None
+
+    def record(self, backend, query: str, args: list, duration: float, rows: Optional[int]) -> None:
+        key = fingerprint(query)
+        pool = backend.pool_name
+        route = current_route.get()
+        query_duration.labels(pool, key).observe(duration)
+        if rows is not None:
+            query_rows.labels(pool, key).observe(rows)
+
+        entry = self.queries.get(key)
+        if entry is None:
+            entry = self.queries[key] = {'fingerprint': key, 'pool': pool, 'statement': statements[key],
+                'calls': 0, 'total_time': 0., 'max_time': 0., 'rows': 0, 'routes': Counter(),
+                'plan': None, 'explained_at': None}
+        entry['calls'] += 1
+        entry['total_time'] += duration
+        entry['max_time'] = max(entry['max_time'], duration)
+        entry['rows'] += rows or 0
+        entry['routes'][route] += 1
+
+        if duration < slow_query_threshold:
+            return
+        params = repr(tuple(args))
+        if len(params) > 1000:
+            params = params[:1000] + '...'
+        print(f'slow query ({duration:.3f}s, {pool}, {route}): {" ".join(query.split())} {params}')
+        if slow_query_explain and self.explaining is None and query.lstrip()[:6].lower() == 'select' and \
+                (entry['explained_at'] is None or monotonic() - entry['explained_at'] >= slow_query_explain_interval):
+            entry['explained_at'] = monotonic()
+            self.explaining = asyncio.create_task(self.explain(backend, entry, query, args))
+
+    async def explain(self, backend, entry: dict, query: str, args: list) -> None:
+        try:
+            async with backend._pool.acquire() as connection:
+                async with connection.transaction(readonly=True):
+                    await connection.execute(f'SET LOCAL statement_timeout = {int(slow_query_explain_timeout * 1000)}')
+                    plan = await connection.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {query}', *args)
+            entry['plan'] = '\n'.join(row[0] for row in plan)
+        except Exception as e:
+            print(f'explain of query {entry["fingerprint"]} failed: {e}')
+        finally:
+            self.explaining = None
+
+    def top(self, limit: int, order_by: str = 'total') -> List[dict]:
+        '''
+        The `limit` slowest fingerprints by total, mean or max time
+        '''
+        keys = {
+            'total': lambda e: e['total_time'],
+            'mean': lambda e: e['total_time'] / e['calls'],
+            'max': lambda e: e['max_time'],
+        }
+        entries = sorted(self.queries.values(), key=keys[order_by], reverse=True)[:limit]
+        return [{**e, 'mean_time': e['total_time'] / e['calls'], 'mean_rows': e['rows'] / e['calls'],
+            'routes': [route for route, _ in e['routes'].most_common() if route is not None]} for e in entries]
+
+query_log = QueryLog()
+
+class InstrumentedConnection(PostgresConnection):
+    '''
+    Connection of the `databases` postgres backend, timing the checkout from
+    the pool and the queries
+    '''
+
+    async def acquire(self) -> None:
+        pool = self._database.pool_name
+        pool_waiting.labels(pool).inc()
+        start = perf_counter()
+        try:
+            await super().acquire()
+        finally:
+            pool_wait.labels(pool).observe(perf_counter() - start)
+            pool_waiting.labels(pool).dec()
+
+    def _compile(self, query):
+        # keep the statement, to be recorded once the query returns
+        compiled = super()._compile(query)
+        self.statement, self.args = compiled[0], compiled[1]
+        return compiled
+
+    async def timed(self, query, call, count):
+        start = perf_counter()
+        result = await call(query)
+        query_log.record(self._database, self.statement, self.args, perf_counter() - start, count(result))
+        return result
+
+    async def fetch_all(self, query):
+        return await self.timed(query, super().fetch_all, len)
+
+    async def fetch_one(self, query):
+        return await self.timed(query, super().fetch_one, lambda row: int(row is not None))
+
+    async def execute(self, query):
+        return await self.timed(query, super().execute, lambda result: None)
+
+    async def iterate(self, query):
+        rows = 0
+        start = perf_counter()
+        try:
+            async for row in super().iterate(query):
+                rows += 1
+                yield row
+        finally:
+            query_log.record(self._database, self.statement, self.args, perf_counter() - start, rows)
+
+class InstrumentedBackend(PostgresBackend):
+    '''
+    Postgres backend of `databases` with instrumented connections, the pool
+    is labelled `pool_name` in the metrics
+    '''
+
+    def __init__(self, database_url, pool_name: str = 'default', **options) -> None:
+        super().__init__(database_url, **options)
+        self.pool_name = pool_name
+        pool_size.labels(pool_name).set_function(lambda: self._pool.get_size() if self._pool else 0)
+        pool_in_use.labels(pool_name).set_function(
+            lambda: self._pool.get_size() - self._pool.get_idle_size() if self._pool else 0)
+        pool_max_size.labels(pool_name).set_function(lambda: self._pool.get_max_size() if self._pool else 0)
+
+    def connection(self) -> InstrumentedConnection:
+        return InstrumentedConnection(self, self._dialect)
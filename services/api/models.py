@@ -357,6 +357,15 @@ class EnvMeasurement(BaseModel):
     humidity: float
     moisture: float
 
+class IngestStatus(BaseModel):
+    '''
+    Status of a measurement in a batch ingest request
+    '''
+    index: int = Field(..., title='Position of the measurement in the request')
+    accepted: bool
+    deployment_id: Optional[int] = None
+    detail: Optional[str] = None
+
 class ApiResponse(BaseModel):
     code: Optional[int] = None
     type: Optional[str] = None
@@ -569,6 +578,57 @@ class PollinatorTypeEnum(str, Enum):
     schwebfliege = 'schwebfliege'
     wildbiene = 'wildbiene'
 
+class MultipartUploadRequest(BaseModel):
+    object_name: str
+    sha256: str = Field(..., regex='^[0-9a-f]{64}$')
+    size: PositiveInt
+
+class UploadPart(BaseModel):
+    part_number: int
+    size: int
+    etag: str
+
+class MultipartUpload(BaseModel):
+    object_name: str
+    upload_id: Optional[str] = Field(None, description='None if the object exists already')
+    etag: Optional[str] = Field(None, description='ETag of the object, if it exists already')
+    part_size: int
+    part_count: int
+    parts: List[UploadPart] = Field([], description='Parts uploaded so far')
+
+class MultipartCompleteRequest(BaseModel):
+    sha256: str = Field(..., regex='^[0-9a-f]{64}$')
+    size: PositiveInt = Field(..., description='Size of the object, as declared when starting the upload')
+
+class VariantJob(BaseModel):
+    object_name: str
+    status: str = Field(..., description='queued, running, done or failed')
+    variants: List[str]
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class DeliveryEnum(str, Enum):
+    proxy = 'proxy'
+    redirect = 'redirect'
+
+class QueryOrderEnum(str, Enum):
+    total = 'total'
+    mean = 'mean'
+    max = 'max'
+
+class QueryStatistics(BaseModel):
+    fingerprint: str
+    pool: str
+    statement: str = Field(..., description='Statement with literals and parameters replaced by ?')
+    calls: int
+    total_time: float = Field(..., description='Seconds')
+    mean_time: float = Field(..., description='Seconds')
+    max_time: float = Field(..., description='Seconds')
+    mean_rows: float
+    routes: List[str] = Field([], description='Routes running the query, most frequent first')
+    plan: Optional[str] = Field(None, description='EXPLAIN (ANALYZE, BUFFERS) of a slow execution')
+
 class AnnotationText(BaseModel):
     content:str
 
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Callable, Dict, List
+
+import asyncpg
+
+from api.config import crd
+
+# ------------------------------------------------------------------------------
+# DATABASE NOTIFICATIONS
+# ------------------------------------------------------------------------------
+
+class NotificationListener:
+    '''
+    Listen for notifications on `channel` on a dedicated connection (outside
+    of the pool) and call the handlers registered for the payload, the name
+    of the changed table (see `schema/api_notifications.sql`).
+
+    When the connection is lost, the handlers of all tables are called, as
+    notifications may have been missed, and the connection is reestablished
+    with increasing delay. The same goes for tables without the trigger
+    notifying their changes: the listener doesn't connect until all are
+    installed, the indexes poll for changes in the meantime.
+    '''
+
+    def __init__(self, channel: str = 'api_invalidate', retry_delay: float = 1, max_retry_delay: float = 60) -> None:
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.handlers: Dict[str, List[Callable[[], None]]] = {}
+        self.state_handlers: List[Callable[[bool], None]] = []
+        self.connection = None
+        self.task = None
+        self.closing = False
+
+    def register(self, table: str, handler: Callable[[], None]) -> None:
+        self.handlers.setdefault(table, []).append(handler)
+
+    def on_state(self, handler: Callable[[bool], None]) -> None:
+        '''
+        Register a handler called with True when listening, False when not
+        '''
+        self.state_handlers.append(handler)
+
+    def notify(self, connection, pid, channel, payload) -> None:
+        for handler in self.handlers.get(payload, []):
+            handler()
+
+    def set_state(self, listening: bool) -> None:
+        # notifications may have been missed while not listening
+        for handlers in self.handlers.values():
+            for handler in handlers:
+                handler()
+        for handler in self.state_handlers:
+            handler(listening)
+
+    async def missing_triggers(self, connection) -> List[str]:
+        '''
+        Tables with handlers but without a trigger notifying the channel
+        '''
+        rows = await connection.fetch('''
+            SELECT c.relname
+            FROM pg_trigger t
+            JOIN pg_class c ON c.oid = t.tgrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_proc p ON p.oid = t.tgfoid
+            WHERE n.nspname = $1 AND p.proname = 'notify_api_invalidate' AND t.tgenabled <> 'D'
+            ''', crd.db.schema)
+        return sorted(set(self.handlers) - {row['relname'] for row in rows})
+
+    def terminated(self, connection) -> None:
+        self.connection = None
+        self.set_state(False)
+        if not self.closing:
+            self.task = asyncio.create_task(self.connect())
+
+    async def connect(self) -> None:
+        delay = self.retry_delay
+        while not self.closing:
+            try:
+                connection = await asyncpg.connect(host=crd.db.host, port=crd.db.port,
+                    user=crd.db.user, password=crd.db.password, database=crd.db.database)
+                missing = await self.missing_triggers(connection)
+                if missing:
+                    await connection.close()
+                    raise RuntimeError(f'no notification triggers on {", ".join(missing)}, see schema/api_notifications.sql')
+                await connection.add_listener(self.channel, self.notify)
+                connection.add_termination_listener(self.terminated)
+            except Exception as e:
+                print(f'notification listener: {e}, retrying in {delay}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            else:
+                self.connection = connection
+                self.set_state(True)
+                return
+
+    async def start(self) -> None:
+        self.closing = False
+        self.task = asyncio.create_task(self.connect())
+
+    async def stop(self) -> None:
+        self.closing = True
+        if self.task is not None:
+            self.task.cancel()
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+listener = NotificationListener()
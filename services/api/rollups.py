@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+# ------------------------------------------------------------------------------
+# ROLLUPS
+# ------------------------------------------------------------------------------
+
+# width of the buckets in birdnet_results_hourly and pollinators_hourly
+rollup_width = timedelta(hours=1)
+
+# width of the confidence bands in birdnet_results_hourly and pollinators_hourly
+confidence_step = 0.01
+
+# continuous aggregates of sensordata_env and sensordata_pax, coarsest first
+sensordata_rollups = [
+    (timedelta(days=1), '1d'),
+    (timedelta(hours=1), '1h'),
+    (timedelta(minutes=10), '10m'),
+]
+
+# continuous aggregate of meteodata in the cache database
+meteodata_rollups = [
+    (timedelta(days=1), 'daily'),
+]
+
+# default origin of timescaledb time_bucket()
+bucket_origin = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+def is_aligned(t: datetime, width: timedelta = rollup_width) -> bool:
+    '''
+    Check if `t` is on a bucket boundary of `width`
+    '''
+    origin = bucket_origin if t.tzinfo else bucket_origin.replace(tzinfo=None)
+    return (t - origin) % width == timedelta(0)
+
+def floor_bucket(t: datetime, width: timedelta = rollup_width) -> datetime:
+    '''
+    Start of the bucket of `width` containing `t`
+    '''
+    origin = bucket_origin if t.tzinfo else bucket_origin.replace(tzinfo=None)
+    return origin + ((t - origin) // width) * width
+
+def ceil_bucket(t: datetime, width: timedelta = rollup_width) -> datetime:
+    '''
+    First bucket boundary of `width` at or after `t`
+    '''
+    start = floor_bucket(t, width)
+    return start if start == t else start + width
+
+def covers_rollup(bucket_width: timedelta, width: timedelta = rollup_width) -> bool:
+    '''
+    Check if buckets of `bucket_width` are composed of whole rollup buckets
+    '''
+    return bucket_width >= width and bucket_width % width == timedelta(0)
+
+def rollup_bounds(
+        time_from: Optional[datetime],
+        time_to: Optional[datetime],
+        width: timedelta = rollup_width
+    ) -> Optional[Tuple[Optional[datetime], Optional[datetime]]]:
+    '''
+    Translate the inclusive range `time_from` - `time_to` into an inclusive
+    start and an exclusive end of rollup buckets, None if the range doesn't
+    consist of whole buckets.
+
+    `time_from` has to be on a bucket boundary, `time_to` one millisecond
+    before it (as in `2022-08-31T23:59:59.999Z`). A `time_to` on a boundary
+    includes the first instant of the next bucket, which the rollup can't
+    answer.
+    '''
+    if time_from and not is_aligned(time_from, width):
+        return None
+    if time_to:
+        time_to = time_to + timedelta(milliseconds=1)
+        if not is_aligned(time_to, width):
+            return None
+    return time_from, time_to
+
+def confidence_band(conf: float) -> Optional[int]:
+    '''
+    Index of the lowest confidence band included by the threshold `conf`,
+    None if `conf` is not on a band boundary.
+    '''
+    band = round(conf / confidence_step)
+    if abs(band * confidence_step - conf) > 1e-9:
+        return None
+    return band
+
+def select_rollup(
+        bucket_width: timedelta,
+        time_from: Optional[datetime],
+        time_to: Optional[datetime],
+        rollups = sensordata_rollups
+    ) -> Optional[Tuple[str, Tuple[Optional[datetime], Optional[datetime]]]]:
+    '''
+    Pick the coarsest rollup whose buckets compose buckets of `bucket_width`
+    and the range `time_from` - `time_to`. Returns the suffix of the rollup
+    and the bounds as translated by `rollup_bounds()`, None if no rollup fits.
+    '''
+    for width, suffix in rollups:
+        if not covers_rollup(bucket_width, width):
+            continue
+        bounds = rollup_bounds(time_from, time_to, width)
+        if bounds is not None:
+            return suffix, bounds
+    return None
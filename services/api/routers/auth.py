@@ -1,6 +1,6 @@
-from api.dependencies import AuthenticationChecker, get_user, crd
+from api.dependencies import AuthContext, AuthenticationChecker, crd, get_auth
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends
 
 router = APIRouter(tags=['auth'])
 
@@ -9,9 +9,8 @@ router = APIRouter(tags=['auth'])
 # ------------------------------------------------------------------------------
 
 @router.get('/login', dependencies=[Depends(AuthenticationChecker(required_roles=['public']))], tags=['authentication'])
-async def login(request: Request):
-    auth_header = request.headers.get('authorization')
-    return get_user(auth_header.split('Bearer ')[1])
+async def login(auth: AuthContext = Depends(get_auth)):
+    return auth.claims
 
 @router.get('/auth/storage', dependencies=[Depends(AuthenticationChecker(required_roles=['internal']))], tags=['authentication'])
 async def get_storage_auth():
@@ -1,17 +1,22 @@
 from datetime import date, datetime, timedelta
 from typing import List, Optional
 
-from api.database import database
+from api.audio import compose_wav, read_recording_window, spectrogram_response
+from api.config import derived_prefix, snippet_max_padding, snippet_padding, spectrogram_formats, spectrogram_n_fft
+from api.database import database, read_only
+from api.dependencies import check_oid_authentication, parse_bucket_width
+from api.indexes import taxonomy_index
 from api.models import Result, ResultFull, ResultsGrouped, TimeSeriesResult, DetectionLocationResult, Point
+from api.rollups import confidence_band, covers_rollup, rollup_bounds
+from api.storage import derived_response
 from api.tables import birdnet_results, birdnet_results_file_taxonomy, birdnet_species, birdnet_species_day, taxonomy_data
 
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.sql import and_, desc, func, select, text, bindparam
-from pandas import to_timedelta
 
 import credentials as crd
 
-router = APIRouter(tags=['inference'])
+router = APIRouter(tags=['inference'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # BIRDNET RESULTS
@@ -105,36 +110,48 @@ async def detection_dates_by_id(
     deployment_ids:List[int] = Query(default=None),
     distinctspecies: bool = False,
     ) -> TimeSeriesResult:
-    time_from_condition = "AND (f.time + interval '1 second' * r.time_start) >= :time_from" if time_from else ""
-    time_to_condition = "AND (f.time + interval '1 second' * r.time_start) <= :time_to" if time_to else ""
-    distinct_arg = "DISTINCT" if distinctspecies else ""
-    deployment_filter = "AND f.deployment_id in :deployment_ids" if deployment_ids else ""
-    query = text(
-    f"""
-    SELECT time_bucket(:bucket_width, (f.time + interval '1 second' * r.time_start)) AS bucket,
-    count({distinct_arg} r.species) as detections
-    from birdnet_results_filtered r
-    left join {crd.db.schema}.files_audio f on f.file_id = r.file_id
-    where r.confidence >= :conf
-    and r.species in (
-        select s.label_sci from {crd.db.schema}.taxonomy_data s where datum_id in (
-            select species_id from {crd.db.schema}.taxonomy_tree
-            where species_id = :identifier
-            or genus_id = :identifier
-            or family_id = :identifier
-            or order_id = :identifier
-            or class_id = :identifier
-            or phylum_id = :identifier
-            or kingdom_id = :identifier
-            )
-        )
-    {deployment_filter}
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY bucket
-    ORDER BY bucket
-    """
-    ).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(),conf=conf, identifier=identifier)
+    species = await taxonomy_index.species_labels(identifier)
+    bucket_width = parse_bucket_width(bucket_width)
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
+    deployment_filter = "AND r.deployment_id in :deployment_ids" if deployment_ids else ""
+    if bounds is not None and band is not None and covers_rollup(bucket_width):
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND r.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND r.bucket < :time_to" if time_to else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, r.bucket) AS bucket,
+        {'count(DISTINCT r.species)' if distinctspecies else 'sum(r.detections)::bigint'} as detections
+        from {crd.db.schema}.birdnet_results_hourly r
+        where r.confidence_band >= :band
+        and r.species = ANY(:species)
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY 1
+        ORDER BY 1
+        """
+        ).bindparams(bucket_width=bucket_width, band=band, species=species)
+    else:
+        time_from_condition = "AND r.detection_time >= :time_from" if time_from else ""
+        time_to_condition = "AND r.detection_time <= :time_to" if time_to else ""
+        distinct_arg = "DISTINCT" if distinctspecies else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, r.detection_time) AS bucket,
+        count({distinct_arg} r.species) as detections
+        from birdnet_results_filtered r
+        where r.confidence >= :conf
+        and r.species = ANY(:species)
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY bucket
+        ORDER BY bucket
+        """
+        ).bindparams(bucket_width=bucket_width, conf=conf, species=species)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -157,38 +174,51 @@ async def detection_locations_by_id(
     distinctspecies: bool = False,
     deployment_ids:List[int] = Query(default=None),
     ) -> List[DetectionLocationResult]:
-    time_from_condition = "AND (f.time + interval '1 second' * r.time_start) >= :time_from" if time_from else ""
-    time_to_condition = "AND (f.time + interval '1 second' * r.time_start) <= :time_to" if time_to else ""
-    distinct_arg = "DISTINCT" if distinctspecies else ""
-    deployment_filter = "AND f.deployment_id in :deployment_ids" if deployment_ids else ""
-    query = text(
-    f"""
-    SELECT
-    d.location,
-    d.deployment_id,
-    count({distinct_arg} r.species) as detections
-    from birdnet_results_filtered r
-    left join {crd.db.schema}.files_audio f on f.file_id = r.file_id
-    left join {crd.db.schema}.deployments d on f.deployment_id = d.deployment_id
-    where r.confidence >= :conf
-    and r.species in (
-        select s.label_sci from {crd.db.schema}.taxonomy_data s where datum_id in (
-            select species_id from {crd.db.schema}.taxonomy_tree
-            where species_id = :identifier
-            or genus_id = :identifier
-            or family_id = :identifier
-            or order_id = :identifier
-            or class_id = :identifier
-            or phylum_id = :identifier
-            or kingdom_id = :identifier
-            )
-        )
-    {deployment_filter}
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY d.deployment_id
-    """
-    ).bindparams(conf=conf, identifier=identifier)
+    species = await taxonomy_index.species_labels(identifier)
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
+    deployment_filter = "AND r.deployment_id in :deployment_ids" if deployment_ids else ""
+    if bounds is not None and band is not None:
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND r.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND r.bucket < :time_to" if time_to else ""
+        query = text(
+        f"""
+        SELECT
+        d.location,
+        d.deployment_id,
+        {'count(DISTINCT r.species)' if distinctspecies else 'sum(r.detections)::bigint'} as detections
+        from {crd.db.schema}.birdnet_results_hourly r
+        left join {crd.db.schema}.deployments d on r.deployment_id = d.deployment_id
+        where r.confidence_band >= :band
+        and r.species = ANY(:species)
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY d.deployment_id
+        """
+        ).bindparams(band=band, species=species)
+    else:
+        time_from_condition = "AND r.detection_time >= :time_from" if time_from else ""
+        time_to_condition = "AND r.detection_time <= :time_to" if time_to else ""
+        distinct_arg = "DISTINCT" if distinctspecies else ""
+        query = text(
+        f"""
+        SELECT
+        d.location,
+        d.deployment_id,
+        count({distinct_arg} r.species) as detections
+        from birdnet_results_filtered r
+        left join {crd.db.schema}.deployments d on r.deployment_id = d.deployment_id
+        where r.confidence >= :conf
+        and r.species = ANY(:species)
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY d.deployment_id
+        """
+        ).bindparams(conf=conf, species=species)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -215,32 +245,20 @@ async def detection_count(
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
     ):
-    time_from_condition = "AND (f.time + interval '1 second' * r.time_start) >= :time_from" if time_from else ""
-    time_to_condition = "AND (f.time + interval '1 second' * r.time_start) <= :time_to" if time_to else ""
+    species = await taxonomy_index.species_labels(identifier)
+    time_from_condition = "AND r.detection_time >= :time_from" if time_from else ""
+    time_to_condition = "AND r.detection_time <= :time_to" if time_to else ""
     query = text(
     f"""
     SELECT
     count(r.species) as detections
     from birdnet_results_filtered r
-    left join {crd.db.schema}.files_audio f on f.file_id = r.file_id
-    left join {crd.db.schema}.deployments d on f.deployment_id = d.deployment_id
     where r.confidence >= :conf
-    and r.species in (
-        select s.label_sci from {crd.db.schema}.taxonomy_data s where datum_id in (
-            select species_id from {crd.db.schema}.taxonomy_tree
-            where species_id = :identifier
-            or genus_id = :identifier
-            or family_id = :identifier
-            or order_id = :identifier
-            or class_id = :identifier
-            or phylum_id = :identifier
-            or kingdom_id = :identifier
-            )
-        )
+    and r.species = ANY(:species)
     {time_from_condition}
     {time_to_condition}
     """
-    ).bindparams(conf=conf, identifier=identifier)
+    ).bindparams(conf=conf, species=species)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -259,36 +277,25 @@ async def detection_time_of_day(
     distinctspecies: bool = False,
     deployment_ids:List[int] = Query(default=None),
 ):
-    time_from_condition = "AND (f.time + interval '1 second' * r.time_start) >= :time_from" if time_from else ""
-    time_to_condition = "AND (f.time + interval '1 second' * r.time_start) <= :time_to" if time_to else ""
-    deployment_filter = "AND f.deployment_id in :deployment_ids" if deployment_ids else ""
+    species = await taxonomy_index.species_labels(identifier)
+    time_from_condition = "AND r.detection_time >= :time_from" if time_from else ""
+    time_to_condition = "AND r.detection_time <= :time_to" if time_to else ""
+    deployment_filter = "AND r.deployment_id in :deployment_ids" if deployment_ids else ""
     if distinctspecies:
         query = text(f"""
         SELECT
-            EXTRACT (hour from (f.time + interval '1 second' * r.time_start))*60 as minute_of_day,
+            EXTRACT (hour from r.detection_time)*60 as minute_of_day,
             COUNT(DISTINCT r.species) AS detections
         FROM birdnet_results_filtered r
-        LEFT JOIN {crd.db.schema}.files_audio f ON f.file_id = r.file_id
         WHERE r.confidence >=  :conf
         {deployment_filter}
         {time_from_condition}
         {time_to_condition}
-        AND r.species IN (
-                SELECT s.label_sci FROM {crd.db.schema}.taxonomy_data s WHERE datum_id IN (
-                    SELECT species_id FROM {crd.db.schema}.taxonomy_tree
-                    WHERE species_id =  :identifier
-                    OR genus_id =  :identifier
-                    OR family_id =  :identifier
-                    OR order_id =  :identifier
-                    OR class_id =  :identifier
-                    OR phylum_id =  :identifier
-                    OR kingdom_id =  :identifier
-                )
-            )
+        AND r.species = ANY(:species)
         GROUP BY minute_of_day
         ORDER BY minute_of_day
         """
-        ).bindparams(identifier=identifier, conf = conf)
+        ).bindparams(species=species, conf = conf)
 
     else:
         query = text(
@@ -299,28 +306,16 @@ async def detection_time_of_day(
         FROM (
             SELECT
             histogram(
-                EXTRACT (hour from (f.time + interval '1 second' * r.time_start))*60 + EXTRACT (minute from (f.time + interval '1 second' * r.time_start)), 0, 24*60, (24*60)/:bucket_width_m) as minute_buckets
+                EXTRACT (hour from r.detection_time)*60 + EXTRACT (minute from r.detection_time), 0, 24*60, (24*60)/:bucket_width_m) as minute_buckets
             FROM birdnet_results_filtered r
-            LEFT JOIN {crd.db.schema}.files_audio f ON f.file_id = r.file_id
             WHERE r.confidence >=  :conf
-            AND r.species IN (
-                SELECT s.label_sci FROM {crd.db.schema}.taxonomy_data s WHERE datum_id IN (
-                    SELECT species_id FROM {crd.db.schema}.taxonomy_tree
-                    WHERE species_id =  :identifier
-                    OR genus_id =  :identifier
-                    OR family_id =  :identifier
-                    OR order_id =  :identifier
-                    OR class_id =  :identifier
-                    OR phylum_id =  :identifier
-                    OR kingdom_id =  :identifier
-                )
-            )
+            AND r.species = ANY(:species)
         {deployment_filter}
         {time_from_condition}
         {time_to_condition}
         ) hist
         """
-        ).bindparams(identifier=identifier, bucket_width_m = bucket_width_m, conf = conf)
+        ).bindparams(species=species, bucket_width_m = bucket_width_m, conf = conf)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -339,6 +334,7 @@ async def species_count_by_parent_taxon(
     conf: float = 0.9,
     limit: int = 20
     ):
+    species_ids = await taxonomy_index.species_ids(identifier)
     query = text(
     f"""
     SELECT
@@ -349,22 +345,13 @@ async def species_count_by_parent_taxon(
         count(r.species) as detections
     FROM {crd.db.schema}.taxonomy_data s
     left join birdnet_results_filtered r on r.species = s.label_sci
-    WHERE s.datum_id IN (
-        select species_id from {crd.db.schema}.taxonomy_tree
-                where species_id = :identifier
-                or genus_id = :identifier
-                or family_id = :identifier
-                or order_id = :identifier
-                or class_id = :identifier
-                or phylum_id = :identifier
-                or kingdom_id =:identifier
-        )
+    WHERE s.datum_id = ANY(:species_ids)
     AND r.confidence > :conf
     group by s.datum_id
     order by detections desc
     LIMIT :limit
     """
-    ).bindparams(conf=conf, identifier=identifier, limit=limit)
+    ).bindparams(conf=conf, species_ids=species_ids, limit=limit)
 
     results = await database.fetch_all(query)
     typed_results = [
@@ -387,28 +374,53 @@ async def get_detected_species_list(
     deployment_ids:List[int] = Query(default=None),
     limit: int = 1000,
     ):
-    time_from_condition = "AND (f.time + interval '1 second' * r.time_start) >= :time_from" if time_from else ""
-    time_to_condition = "AND (f.time + interval '1 second' * r.time_start) <= :time_to" if time_to else ""
-    deployment_filter = "AND f.deployment_id in :deployment_ids" if deployment_ids else ""
-    query = text(f"""
-        select
-            distinct(r.species),
-            count(r.species) as detections,
-            t.datum_id,
-            t.label_en,
-            t.label_de
-        from birdnet_results_filtered r
-        left join {crd.db.schema}.files_audio f on f.file_id = r.file_id
-        join {crd.db.schema}.taxonomy_data t on t.label_sci = r.species
-        where r.confidence >= :conf
-        {deployment_filter}
-        {time_from_condition}
-        {time_to_condition}
-        GROUP by r.species, t.datum_id
-        order by detections DESC
-        LIMIT :limit
-    """
-    ).bindparams(conf=conf, limit=limit)
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
+    deployment_filter = "AND r.deployment_id in :deployment_ids" if deployment_ids else ""
+    if bounds is not None and band is not None:
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND r.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND r.bucket < :time_to" if time_to else ""
+        query = text(f"""
+            select
+                r.species,
+                sum(r.detections)::bigint as detections,
+                t.datum_id,
+                t.label_en,
+                t.label_de
+            from {crd.db.schema}.birdnet_results_hourly r
+            join {crd.db.schema}.taxonomy_data t on t.label_sci = r.species
+            where r.confidence_band >= :band
+            {deployment_filter}
+            {time_from_condition}
+            {time_to_condition}
+            GROUP by r.species, t.datum_id
+            order by detections DESC
+            LIMIT :limit
+        """
+        ).bindparams(band=band, limit=limit)
+    else:
+        time_from_condition = "AND r.detection_time >= :time_from" if time_from else ""
+        time_to_condition = "AND r.detection_time <= :time_to" if time_to else ""
+        query = text(f"""
+            select
+                distinct(r.species),
+                count(r.species) as detections,
+                t.datum_id,
+                t.label_en,
+                t.label_de
+            from birdnet_results_filtered r
+            join {crd.db.schema}.taxonomy_data t on t.label_sci = r.species
+            where r.confidence >= :conf
+            {deployment_filter}
+            {time_from_condition}
+            {time_to_condition}
+            GROUP by r.species, t.datum_id
+            order by detections DESC
+            LIMIT :limit
+        """
+        ).bindparams(conf=conf, limit=limit)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -424,3 +436,59 @@ async def get_detected_species_list(
         count=r.detections
     ) for r in results]
     return typed_results
+
+async def get_result_file(result_id: int):
+    query = text(f'''
+    select f.object_name, f.file_size, r.time_start, r.time_end
+    from {crd.db.schema}.birdnet_results r
+    join {crd.db.schema}.files_audio f on f.file_id = r.file_id
+    where r.result_id = :result_id
+    ''').bindparams(result_id=result_id)
+    result = await database.fetch_one(query)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Result not found')
+    return result
+
+@router.get('/birds/results/{result_id}/audio', dependencies=[Depends(check_oid_authentication)], response_class=Response,
+    responses={200: {'content': {'audio/wav': {}}}})
+async def get_result_audio(
+    request: Request,
+    result_id: int,
+    padding: float = Query(snippet_padding, ge=0, le=snippet_max_padding, description='Seconds of audio before and after the detection')
+    ):
+    '''
+    ## Audio snippet of a detection
+
+    WAV file of the window of the detection `result_id` in its recording,
+    extended by `padding`. Only the header and the window are read from the
+    recording, the snippet is cached in storage.
+    '''
+    snippet_name = f'{derived_prefix}/birdnet/{result_id}_{round(padding * 1000)}ms.wav'
+
+    async def render():
+        result = await get_result_file(result_id)
+        wav, samples = await read_recording_window(result['object_name'], result['file_size'],
+            result['time_start'], result['time_end'], padding)
+        return compose_wav(wav, samples)
+
+    return await derived_response(request, snippet_name, 'audio/wav', render)
+
+@router.get('/birds/results/{result_id}/spectrogram', dependencies=[Depends(check_oid_authentication)], response_class=Response,
+    responses={200: {'content': {media_type: {} for media_type in spectrogram_formats.values()}}})
+async def get_result_spectrogram(
+    request: Request,
+    result_id: int,
+    padding: float = Query(snippet_padding, ge=0, le=snippet_max_padding, description='Seconds of audio before and after the detection'),
+    n_fft: int = Query(spectrogram_n_fft, description='STFT size, power of 2'),
+    fmax: Optional[float] = Query(None, gt=0, description='Highest frequency rendered, Hz'),
+    image_format: str = Query('webp', alias='format', regex=f'^({"|".join(spectrogram_formats)})$')
+    ):
+    '''
+    ## Spectrogram of a detection
+
+    Spectrogram of the window of the detection `result_id` in its recording,
+    extended by `padding`, computed from the window only and cached in storage.
+    '''
+    result = await get_result_file(result_id)
+    return await spectrogram_response(request, result['object_name'], result['file_size'],
+        max(0, result['time_start'] - padding), result['time_end'] + padding, n_fft, fmax, image_format)
@@ -1,18 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
-from api.database import database
+from api.database import database, read_only
 from api.models import DatumResponse, EnvDatum, PaxDatum, Point, EnvTypeEnum
 from api.tables import data_env, data_pax, deployments, nodes
-from api.dependencies import aggregation_mapper
+from api.dependencies import aggregation_mapper, rollup_aggregation_mapper, parse_bucket_width
+from api.rollups import select_rollup
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import conint, constr
 from sqlalchemy.sql import between, select,  text
-from pandas import to_timedelta
 import credentials as crd
 
-router = APIRouter(tags=['data'])
+router = APIRouter(tags=['data'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # DATA
@@ -72,18 +72,36 @@ async def get_pax_measurements(
     time_from: Optional[datetime] = Query(None, alias='from', example='2020-06-22T18:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-06-22T20:00:00.000Z'),
     bucket_width:str = "1d"):
-    time_from_condition = "AND time >= :time_from" if time_from else ""
-    time_to_condition = "AND time <= :time_to" if time_to else ""
-    query = text(f"""
-    SELECT time_bucket(:bucket_width, time) AS bucket,
-    AVG(pax) as pax
-    from {crd.db.schema}.sensordata_pax
-    where deployment_id = :deployment_id
-    {time_from_condition}
-    {time_to_condition}
-    group by bucket
-    order by bucket
-    """).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(), deployment_id=deployment_id)
+    bucket_width = parse_bucket_width(bucket_width)
+    rollup = select_rollup(bucket_width, time_from, time_to)
+    if rollup:
+        # answer from the coarsest fitting continuous aggregate
+        suffix, (time_from, time_to) = rollup
+        time_from_condition = "AND bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND bucket < :time_to" if time_to else ""
+        query = text(f"""
+        SELECT time_bucket(:bucket_width, bucket) AS bucket,
+        sum(pax_sum)::double precision / nullif(sum(pax_count), 0) as pax
+        from {crd.db.schema}.sensordata_pax_{suffix}
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by 1
+        order by 1
+        """).bindparams(bucket_width=bucket_width, deployment_id=deployment_id)
+    else:
+        time_from_condition = "AND time >= :time_from" if time_from else ""
+        time_to_condition = "AND time <= :time_to" if time_to else ""
+        query = text(f"""
+        SELECT time_bucket(:bucket_width, time) AS bucket,
+        AVG(pax) as pax
+        from {crd.db.schema}.sensordata_pax
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by bucket
+        order by bucket
+        """).bindparams(bucket_width=bucket_width, deployment_id=deployment_id)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -99,19 +117,37 @@ async def get_pax_measurements_time_of_day(
     time_from: Optional[datetime] = Query(None, alias='from', example='2020-06-22T18:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-06-22T20:00:00.000Z'),
     bucket_width_m:int = 20):
-    time_from_condition = "AND time >= :time_from" if time_from else ""
-    time_to_condition = "AND time <= :time_to" if time_to else ""
-    query = text(f"""
-    SELECT
-        FLOOR((EXTRACT(hour FROM time) * 60 + EXTRACT(minute FROM time)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
-        AVG(pax) as pax
-    FROM {crd.db.schema}.sensordata_pax
-    WHERE deployment_id = :deployment_id
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY minute_of_day
-    ORDER BY minute_of_day
-    """).bindparams(bucket_width_m=bucket_width_m, deployment_id=deployment_id)
+    rollup = select_rollup(timedelta(minutes=bucket_width_m), time_from, time_to)
+    if rollup:
+        # answer from the coarsest fitting continuous aggregate
+        suffix, (time_from, time_to) = rollup
+        time_from_condition = "AND bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND bucket < :time_to" if time_to else ""
+        query = text(f"""
+        SELECT
+            FLOOR((EXTRACT(hour FROM bucket) * 60 + EXTRACT(minute FROM bucket)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
+            sum(pax_sum)::double precision / nullif(sum(pax_count), 0) as pax
+        FROM {crd.db.schema}.sensordata_pax_{suffix}
+        WHERE deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY minute_of_day
+        ORDER BY minute_of_day
+        """).bindparams(bucket_width_m=bucket_width_m, deployment_id=deployment_id)
+    else:
+        time_from_condition = "AND time >= :time_from" if time_from else ""
+        time_to_condition = "AND time <= :time_to" if time_to else ""
+        query = text(f"""
+        SELECT
+            FLOOR((EXTRACT(hour FROM time) * 60 + EXTRACT(minute FROM time)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
+            AVG(pax) as pax
+        FROM {crd.db.schema}.sensordata_pax
+        WHERE deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY minute_of_day
+        ORDER BY minute_of_day
+        """).bindparams(bucket_width_m=bucket_width_m, deployment_id=deployment_id)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -171,22 +207,41 @@ async def get_env_measurements(
     bucket_width:str = "1d",
     time_from: Optional[datetime] = Query(None, alias='from', example='2020-06-22T18:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-06-22T20:00:00.000Z'),
+    exact: bool = False,
     ):
-    time_from_condition = "AND time >= :time_from" if time_from else ""
-    time_to_condition = "AND time <= :time_to" if time_to else ""
     aggregation_str = aggregation_mapper(aggregation=aggregation, column_name=measurement.value)
     if aggregation_str is None:
         raise HTTPException(status_code=400, detail='Invalid aggregation method: {}'.format(aggregation))
-    query = text(f"""
-    SELECT time_bucket(:bucket_width, time) AS bucket,
-    {aggregation_str}
-    from {crd.db.schema}.sensordata_env
-    where deployment_id = :deployment_id
-    {time_from_condition}
-    {time_to_condition}
-    group by bucket
-    order by bucket
-    """).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(), deployment_id=deployment_id)
+    bucket_width = parse_bucket_width(bucket_width)
+    rollup = None if exact else select_rollup(bucket_width, time_from, time_to)
+    if rollup:
+        # answer from the coarsest fitting continuous aggregate
+        suffix, (time_from, time_to) = rollup
+        time_from_condition = "AND bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND bucket < :time_to" if time_to else ""
+        query = text(f"""
+        SELECT time_bucket(:bucket_width, bucket) AS bucket,
+        {rollup_aggregation_mapper(aggregation=aggregation, column_name=measurement.value)}
+        from {crd.db.schema}.sensordata_env_{suffix}
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by 1
+        order by 1
+        """).bindparams(bucket_width=bucket_width, deployment_id=deployment_id)
+    else:
+        time_from_condition = "AND time >= :time_from" if time_from else ""
+        time_to_condition = "AND time <= :time_to" if time_to else ""
+        query = text(f"""
+        SELECT time_bucket(:bucket_width, time) AS bucket,
+        {aggregation_str}
+        from {crd.db.schema}.sensordata_env
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by bucket
+        order by bucket
+        """).bindparams(bucket_width=bucket_width, deployment_id=deployment_id)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -204,23 +259,42 @@ async def get_env_measurement_time_of_day(
     bucket_width_m:int = 30,
     time_from: Optional[datetime] = Query(None, alias='from', example='2020-06-22T18:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-06-22T20:00:00.000Z'),
+    exact: bool = False,
     ):
-    time_from_condition = "AND time >= :time_from" if time_from else ""
-    time_to_condition = "AND time <= :time_to" if time_to else ""
     aggregation_str = aggregation_mapper(aggregation=aggregation, column_name=measurement.value)
     if aggregation_str is None:
         raise HTTPException(status_code=400, detail='Invalid aggregation method: {}'.format(aggregation))
-    query = text(f"""
-    SELECT
-        FLOOR((EXTRACT(hour FROM time) * 60 + EXTRACT(minute FROM time)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
-        {aggregation_str}
-    from {crd.db.schema}.sensordata_env
-    where deployment_id = :deployment_id
-    {time_from_condition}
-    {time_to_condition}
-    group by minute_of_day
-    order by minute_of_day
-    """).bindparams(bucket_width_m = bucket_width_m, deployment_id=deployment_id)
+    rollup = None if exact else select_rollup(timedelta(minutes=bucket_width_m), time_from, time_to)
+    if rollup:
+        # answer from the coarsest fitting continuous aggregate
+        suffix, (time_from, time_to) = rollup
+        time_from_condition = "AND bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND bucket < :time_to" if time_to else ""
+        query = text(f"""
+        SELECT
+            FLOOR((EXTRACT(hour FROM bucket) * 60 + EXTRACT(minute FROM bucket)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
+            {rollup_aggregation_mapper(aggregation=aggregation, column_name=measurement.value)}
+        from {crd.db.schema}.sensordata_env_{suffix}
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by minute_of_day
+        order by minute_of_day
+        """).bindparams(bucket_width_m = bucket_width_m, deployment_id=deployment_id)
+    else:
+        time_from_condition = "AND time >= :time_from" if time_from else ""
+        time_to_condition = "AND time <= :time_to" if time_to else ""
+        query = text(f"""
+        SELECT
+            FLOOR((EXTRACT(hour FROM time) * 60 + EXTRACT(minute FROM time)) / :bucket_width_m) * :bucket_width_m as minute_of_day,
+            {aggregation_str}
+        from {crd.db.schema}.sensordata_env
+        where deployment_id = :deployment_id
+        {time_from_condition}
+        {time_to_condition}
+        group by minute_of_day
+        order by minute_of_day
+        """).bindparams(bucket_width_m = bucket_width_m, deployment_id=deployment_id)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -1,18 +1,19 @@
 import credentials as crd
 from datetime import datetime
-from fastapi import APIRouter, Query
-from pandas import to_timedelta
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.sql import select, text, func, between
 from typing import Optional
 
-from api.database import database
+from api.database import database, read_only
+from api.dependencies import parse_bucket_width
 from api.models import (
     BirdSpeciesCount,
     HotspotDataPollinatorsResponse,
 )
+from api.rollups import confidence_band, covers_rollup, rollup_bounds
 from api.tables import (files_image, mm_tags_deployments, pollinators, image_results)
 
-router = APIRouter(tags=['discover'])
+router = APIRouter(tags=['discover'], dependencies=[Depends(read_only)])
 
 
 @router.get('/discover/pollinators/heatmap/{deployment_id}', response_model=HotspotDataPollinatorsResponse)
@@ -53,35 +54,55 @@ async def get_stacked_bar(
     confidence: float = 0.9,
     limit_per_day: int = 3) -> list[BirdSpeciesCount]:
 
-    time_from_condition = "AND time >= :time_from" if time_from else ""
-    time_to_condition = "AND time <= :time_to" if time_to else ""
+    bucket_width = parse_bucket_width(bucket_width)
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(confidence)
+    use_rollup = bounds is not None and band is not None and covers_rollup(bucket_width)
+    if use_rollup:
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND br.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND br.bucket < :time_to" if time_to else ""
+        source = f"{crd.db.schema}.birdnet_results_hourly"
+        time_column = "br.bucket"
+        count_expression = "sum(br.detections)::bigint"
+        confidence_condition = "br.confidence_band >= :band"
+    else:
+        time_from_condition = "AND br.detection_time >= :time_from" if time_from else ""
+        time_to_condition = "AND br.detection_time <= :time_to" if time_to else ""
+        source = f"{crd.db.schema}.birdnet_results_filtered"
+        time_column = "br.detection_time"
+        count_expression = "count(*)"
+        confidence_condition = "br.confidence >= :confidence"
 
     query = text(f"""
     WITH ranked_results AS (
         SELECT
             br.species,
-            time_bucket(:bucket_width, time) AS bucket,
-            count(*),
-            ROW_NUMBER() OVER (PARTITION BY time_bucket(:bucket_width, time) ORDER BY count(*) DESC)
+            time_bucket(:bucket_width, {time_column}) AS bucket,
+            {count_expression} AS count,
+            ROW_NUMBER() OVER (PARTITION BY time_bucket(:bucket_width, {time_column}) ORDER BY {count_expression} DESC)
         FROM
-            {crd.db.schema}.files_audio AS audio
-            LEFT OUTER JOIN {crd.db.schema}.birdnet_results_filtered AS br ON audio.file_id = br.file_id
+            {source} AS br
         WHERE
-            audio.deployment_id = :deployment_id AND br.confidence > :confidence
+            br.deployment_id = :deployment_id AND {confidence_condition}
             {time_from_condition}
             {time_to_condition}
-        GROUP BY br.species, bucket
+        GROUP BY 1, 2
     )
     SELECT species, bucket, count
     FROM ranked_results
     WHERE row_number <= :limit_per_day
     ORDER BY bucket, count DESC
     """).bindparams(
-            bucket_width = to_timedelta(bucket_width).to_pytimedelta(),
+            bucket_width = bucket_width,
             deployment_id = deployment_id,
-            confidence = confidence,
             limit_per_day = limit_per_day)
 
+    if use_rollup:
+        query = query.bindparams(band = band)
+    else:
+        query = query.bindparams(confidence = confidence)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
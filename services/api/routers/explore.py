@@ -1,6 +1,6 @@
 from api.database import database
-from fastapi import APIRouter, Depends, Request, HTTPException, status
-from api.dependencies import get_user, AuthenticationChecker
+from fastapi import APIRouter, Depends, HTTPException, status
+from api.dependencies import AuthContext, AuthenticationChecker, get_auth
 from sqlalchemy.sql import select, text, insert, delete, and_, update
 from api.tables import user_collections, annotations, user_entity
 from api.models import AnnotationText, AnnotationContent, Annotation
@@ -16,16 +16,8 @@ router = APIRouter(tags=['explore'])
 # ------------------------------------------------------------------------------
 
 @router.get('/explore/collection')
-async def get_collection(request: Request, is_allowed: bool = Depends(AuthenticationChecker())):
-    auth_header = request.headers.get("authorization")
-    if auth_header is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Authentication failed',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-    user = get_user(auth_header.split("Bearer ")[1])
-    user_sub = user.get("sub")
+async def get_collection(auth: AuthContext = Depends(get_auth), is_allowed: bool = Depends(AuthenticationChecker())):
+    user_sub = auth.sub
     if user_sub is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,16 +32,8 @@ async def get_collection(request: Request, is_allowed: bool = Depends(Authentica
     return []
 
 @router.post('/explore/collection')
-async def post_collection(collection: List[dict], request: Request, is_allowed: bool = Depends(AuthenticationChecker())):
-    auth_header = request.headers.get("authorization")
-    if auth_header is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Authentication failed',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-    user = get_user(auth_header.split("Bearer ")[1])
-    user_sub = user.get("sub")
+async def post_collection(collection: List[dict], auth: AuthContext = Depends(get_auth), is_allowed: bool = Depends(AuthenticationChecker())):
+    user_sub = auth.sub
     if user_sub is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -126,17 +110,9 @@ async def get_annotation_by_id(annot_id: int, is_allowed: bool = Depends(Authent
     raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"There exists no annotation with id {annot_id}")
 
 @router.delete('/explore/annotations/{annot_id}')
-async def delete_annotation(annot_id: int, request: Request, is_allowed: bool = Depends(AuthenticationChecker())):
-    auth_header = request.headers.get("authorization")
-    if auth_header is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Authentication failed',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-    user = get_user(auth_header.split("Bearer ")[1])
-    if 'explore_admin' not in user['realm_access']['roles']:
-        user_sub = user.get("sub")
+async def delete_annotation(annot_id: int, auth: AuthContext = Depends(get_auth), is_allowed: bool = Depends(AuthenticationChecker())):
+    if not auth.has_role('explore_admin'):
+        user_sub = auth.sub
         if user_sub is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -167,16 +143,8 @@ async def delete_annotation(annot_id: int, request: Request, is_allowed: bool =
         return True
 
 @router.post('/explore/annotations')
-async def post_annotation(body: AnnotationContent, request: Request, is_allowed: bool = Depends(AuthenticationChecker())):
-    auth_header = request.headers.get("authorization")
-    if auth_header is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Authentication failed',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-    user = get_user(auth_header.split("Bearer ")[1])
-    user_sub = user.get("sub")
+async def post_annotation(body: AnnotationContent, auth: AuthContext = Depends(get_auth), is_allowed: bool = Depends(AuthenticationChecker())):
+    user_sub = auth.sub
     if user_sub is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -208,16 +176,8 @@ async def post_annotation(body: AnnotationContent, request: Request, is_allowed:
         return True
 
 @router.put('/explore/annotations/{annot_id}')
-async def post_annotation(annot_id: int,body: AnnotationText, request: Request, is_allowed: bool = Depends(AuthenticationChecker())):
-    auth_header = request.headers.get("authorization")
-    if auth_header is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Authentication failed',
-            headers={'WWW-Authenticate': 'Bearer'},
-        )
-    user = get_user(auth_header.split("Bearer ")[1])
-    user_sub = user.get("sub")
+async def post_annotation(annot_id: int,body: AnnotationText, auth: AuthContext = Depends(get_auth), is_allowed: bool = Depends(AuthenticationChecker())):
+    user_sub = auth.sub
     if user_sub is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,14 +1,14 @@
-from api.database import database_cache, database
-from fastapi import APIRouter, HTTPException, status, Query
+from api.database import database_cache, database, read_only
+from api.dependencies import parse_bucket_width
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from api.models import TimeSeriesResult, DetectionsByLocation, Point
 from sqlalchemy.sql import select, text, bindparam
 from datetime import date, datetime, timedelta
 import json
-from pandas import to_timedelta
 import credentials as crd
 
-router = APIRouter(tags=['gbif'])
+router = APIRouter(tags=['gbif'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # GBIF Occurrence Cache
@@ -28,22 +28,13 @@ async def gbif_detection_dates_by_id(
     SELECT time_bucket(:bucket_width, eventdate) AS bucket,
     count(key) as detections
     from {crd.db_cache.schema}.gbif
-    where (
-    speciesKey = :identifier
-    or speciesKey = :identifier
-    or genusKey = :identifier
-    or familyKey = :identifier
-    or orderKey = :identifier
-    or classKey = :identifier
-    or phylumKey = :identifier
-    or kingdomKey = :identifier
-    )
+    where ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
     {time_from_condition}
     {time_to_condition}
     GROUP BY bucket
     ORDER BY bucket
     """
-    ).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(), identifier=identifier)
+    ).bindparams(bucket_width=parse_bucket_width(bucket_width), identifier=identifier)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -70,16 +61,7 @@ async def gbif_detection_locations_by_id(
     decimallongitude as lon,
     count(key) as detections
     from {crd.db_cache.schema}.gbif
-    where (
-    speciesKey = :identifier
-    or speciesKey = :identifier
-    or genusKey = :identifier
-    or familyKey = :identifier
-    or orderKey = :identifier
-    or classKey = :identifier
-    or phylumKey = :identifier
-    or kingdomKey = :identifier
-    )
+    where ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
     {time_from_condition}
     {time_to_condition}
     GROUP BY decimallatitude, decimallongitude
@@ -114,16 +96,7 @@ async def gbif_detection_count(
     SELECT
     count(key) as detections
     from {crd.db_cache.schema}.gbif
-    where (
-    speciesKey = :identifier
-    or speciesKey = :identifier
-    or genusKey = :identifier
-    or familyKey = :identifier
-    or orderKey = :identifier
-    or classKey = :identifier
-    or phylumKey = :identifier
-    or kingdomKey = :identifier
-    )
+    where ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
     {time_from_condition}
     {time_to_condition}
     """
@@ -155,16 +128,7 @@ async def gbif_detection_time_of_day(
         histogram(
             EXTRACT (hour from eventdate)*60 + EXTRACT (minute from eventdate), 0, 24*60, (24*60)/:bucket_width_m) as minute_buckets
         FROM {crd.db_cache.schema}.gbif
-        WHERE (
-        speciesKey = :identifier
-        or speciesKey = :identifier
-        or genusKey = :identifier
-        or familyKey = :identifier
-        or orderKey = :identifier
-        or classKey = :identifier
-        or phylumKey = :identifier
-        or kingdomKey = :identifier
-        )
+        WHERE ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
         AND EXTRACT (hour from eventdate)*3600 + EXTRACT (minute from eventdate)*60+EXTRACT (SECOND from eventdate) >0
         {time_from_condition}
         {time_to_condition}
@@ -194,16 +158,7 @@ async def gbif_occurence_datasets(
     SELECT distinct(datasetkey) as datasetkey,
     max(datasetname) as datasetname
     from {crd.db_cache.schema}.gbif
-    where (
-    speciesKey = :identifier
-    or speciesKey = :identifier
-    or genusKey = :identifier
-    or familyKey = :identifier
-    or orderKey = :identifier
-    or classKey = :identifier
-    or phylumKey = :identifier
-    or kingdomKey = :identifier
-    )
+    where ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
     {time_from_condition}
     {time_to_condition}
     group by datasetkey
@@ -246,16 +201,7 @@ async def gbif_occurences_by_id(
         datasetname,
         datasetkey
     from {crd.db_cache.schema}.gbif
-    where (
-    speciesKey = :identifier
-    or speciesKey = :identifier
-    or genusKey = :identifier
-    or familyKey = :identifier
-    or orderKey = :identifier
-    or classKey = :identifier
-    or phylumKey = :identifier
-    or kingdomKey = :identifier
-    )
+    where ancestor_keys @> ARRAY[CAST(:identifier AS bigint)]
     {time_from_condition}
     {time_to_condition}
     {media_filter}
@@ -1,12 +1,11 @@
-import simplekml
 
-from api.database import database
+from api.database import database, read_only
 from api.tables import deployments, nodes
 
-from fastapi import APIRouter, Response
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.sql import LABEL_STYLE_TABLENAME_PLUS_COL, select, text
 
-router = APIRouter(tags=['kml'])
+router = APIRouter(tags=['kml'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # GEO DATA (KML export)
@@ -35,6 +34,7 @@ async def read_kml(fs: str):
         d['node'] = { c: r['n_'+c] for c in nodes.columns.keys() }
         records.append(d)
 
+    import simplekml
     kml = simplekml.Kml(name='Mitwelten Nodes')
     ext = simplekml.ExtendedData()
     ext.newdata('type', 'marker')
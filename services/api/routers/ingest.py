@@ -1,12 +1,49 @@
+from typing import Callable, List, Union
+
+from api.config import ingest_batch_size, ingest_max_body_size
 from api.database import database
 from api.dependencies import check_authentication, AuthenticationChecker
-from api.models import EnvMeasurement, ImageRequest, AudioRequest, PaxMeasurement
-from api.tables import files_image, files_audio, data_pax, data_env, deployments, nodes
-
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.sql import insert, select, and_, or_, text
-
-router = APIRouter(tags=['ingest'])
+from api.indexes import deployment_index
+from api.models import EnvMeasurement, ImageRequest, AudioRequest, IngestStatus, PaxMeasurement
+from api.tables import files_image, files_audio, data_pax, data_env
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy.sql import insert, select
+
+import credentials as crd
+
+class LimitedBodyRoute(APIRoute):
+    '''
+    Route rejecting request bodies of more than `ingest_max_body_size` bytes
+    with 413 before they are parsed, by `Content-Length` or, for chunked
+    bodies, while they are received.
+    '''
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request) -> Response:
+            too_large = HTTPException(status_code=413, detail=f'Request body exceeds {ingest_max_body_size} bytes')
+            try:
+                content_length = int(request.headers['content-length'])
+            except (KeyError, ValueError):
+                content_length = None
+            if content_length is not None and content_length > ingest_max_body_size:
+                raise too_large
+            received = 0
+            async def receive():
+                nonlocal received
+                message = await request.receive()
+                received += len(message.get('body', b''))
+                if received > ingest_max_body_size:
+                    raise too_large
+                return message
+            return await handler(Request(request.scope, receive))
+
+        return limited_handler
+
+router = APIRouter(tags=['ingest'], route_class=LimitedBodyRoute)
 
 # ------------------------------------------------------------------------------
 # DATA INPUT (INGEST)
@@ -66,21 +103,14 @@ async def ingest_pax(body: PaxMeasurement):
     transaction = await database.transaction()
 
     try:
-        if body.nodeLabel is not None:
-            node_id_subquery = select(nodes.c.node_id).filter(nodes.c.node_label == body.nodeLabel).scalar_subquery()
-        elif body.deviceEui is not None:
-            node_id_subquery = select(nodes.c.node_id).filter(nodes.c.serial_number == body.deviceEui).scalar_subquery()
-        else:
+        if body.nodeLabel is None and body.deviceEui is None:
             raise HTTPException(status_code=409, detail="Invalid Node Identifier")
-        deployment_id_subquery = select(deployments.c.deployment_id).filter(
-            and_(
-                deployments.c.node_id == node_id_subquery,
-                or_(text("upper(period) is NULL"), text("upper(period) >= now()"))
-            )
-        ).scalar_subquery()
+        deployment_id = await deployment_index.deployment_id(body.time, body.nodeLabel, body.deviceEui)
+        if deployment_id is None:
+            raise HTTPException(status_code=409, detail='No deployment of the node covers the time of the measurement')
         insert_stmt = insert(data_pax).values(
             time=body.time,
-            deployment_id=deployment_id_subquery,
+            deployment_id=deployment_id,
             pax=body.pax,
             voltage=body.voltage
         )
@@ -99,21 +129,14 @@ async def ingest_env(body: EnvMeasurement):
     transaction = await database.transaction()
 
     try:
-        if body.nodeLabel is not None:
-            node_id_subquery = select(nodes.c.node_id).filter(nodes.c.node_label == body.nodeLabel).scalar_subquery()
-        elif body.deviceEui is not None:
-            node_id_subquery = select(nodes.c.node_id).filter(nodes.c.serial_number == body.deviceEui).scalar_subquery()
-        else:
+        if body.nodeLabel is None and body.deviceEui is None:
             raise HTTPException(status_code=409, detail="Invalid Node Identifier")
-        deployment_id_subquery = select(deployments.c.deployment_id).filter(
-            and_(
-                deployments.c.node_id == node_id_subquery,
-                or_(text("upper(period) is NULL"), text("upper(period) >= now()"))
-            )
-        ).scalar_subquery()
+        deployment_id = await deployment_index.deployment_id(body.time, body.nodeLabel, body.deviceEui)
+        if deployment_id is None:
+            raise HTTPException(status_code=409, detail='No deployment of the node covers the time of the measurement')
         insert_stmt = insert(data_env).values(
             time=body.time,
-            deployment_id=deployment_id_subquery,
+            deployment_id=deployment_id,
             voltage=body.voltage,
             temperature=body.temperature,
             humidity=body.humidity,
@@ -129,3 +152,68 @@ async def ingest_env(body: EnvMeasurement):
     else:
         await transaction.commit()
 
+
+async def resolve_deployments(measurements: List[Union[PaxMeasurement, EnvMeasurement]]) -> List[IngestStatus]:
+    '''
+    Assign each measurement to the deployment of its node with a period
+    covering the time of the measurement.
+    '''
+    status = []
+    for index, m in enumerate(measurements):
+        if m.nodeLabel is None and m.deviceEui is None:
+            status.append(IngestStatus(index=index, accepted=False, detail='Invalid Node Identifier'))
+            continue
+        deployment_id = await deployment_index.deployment_id(m.time, m.nodeLabel, m.deviceEui)
+        if deployment_id is None:
+            status.append(IngestStatus(index=index, accepted=False, detail='No deployment of the node covers the time of the measurement'))
+        else:
+            status.append(IngestStatus(index=index, accepted=True, deployment_id=deployment_id))
+    return status
+
+async def copy_measurements(table: str, columns: List[str], records: List[tuple]) -> None:
+    '''
+    Write records with a binary COPY in one transaction
+    '''
+    async with database.connection() as connection:
+        async with connection.transaction():
+            await connection.raw_connection.copy_records_to_table(
+                table, schema_name=crd.db.schema, columns=columns, records=records)
+
+@router.post('/ingest/pax/batch', response_model=List[IngestStatus], dependencies=[Depends(check_authentication)])
+async def ingest_pax_batch(body: List[PaxMeasurement]) -> List[IngestStatus]:
+    '''
+    Insert a batch of pax measurements, returning the status of each
+    measurement. Measurements without a matching deployment are rejected,
+    the accepted ones are written in one transaction.
+    '''
+    if len(body) > ingest_batch_size:
+        raise HTTPException(status_code=413, detail=f'Batch exceeds {ingest_batch_size} measurements')
+    status = await resolve_deployments(body)
+    records = [(m.time, s.deployment_id, m.pax, m.voltage) for m, s in zip(body, status) if s.accepted]
+    if records:
+        try:
+            await copy_measurements('sensordata_pax', ['time', 'deployment_id', 'pax', 'voltage'], records)
+        except Exception as e:
+            print(str(e))
+            raise HTTPException(status_code=409, detail=str(e))
+    return status
+
+@router.post('/ingest/env/batch', response_model=List[IngestStatus], dependencies=[Depends(check_authentication)])
+async def ingest_env_batch(body: List[EnvMeasurement]) -> List[IngestStatus]:
+    '''
+    Insert a batch of env measurements, returning the status of each
+    measurement. Measurements without a matching deployment are rejected,
+    the accepted ones are written in one transaction.
+    '''
+    if len(body) > ingest_batch_size:
+        raise HTTPException(status_code=413, detail=f'Batch exceeds {ingest_batch_size} measurements')
+    status = await resolve_deployments(body)
+    records = [(m.time, s.deployment_id, m.voltage, m.temperature, m.humidity, m.moisture)
+        for m, s in zip(body, status) if s.accepted]
+    if records:
+        try:
+            await copy_measurements('sensordata_env', ['time', 'deployment_id', 'voltage', 'temperature', 'humidity', 'moisture'], records)
+        except Exception as e:
+            print(str(e))
+            raise HTTPException(status_code=409, detail=str(e))
+    return status
@@ -4,11 +4,11 @@ from typing import Optional, List
 from api.database import database_cache
 from api.tables import meteo_station, meteo_parameter, meteo_meteodata
 from api.models import MeteoStation, MeteoParameter, MeteoDataset, MeteoMeasurements, MeteoSummary, MeteoMeasurementTimeOfDay
-from api.dependencies import AuthenticationChecker
+from api.dependencies import AuthenticationChecker, parse_bucket_width
+from api.rollups import ceil_bucket, floor_bucket, meteodata_rollups, select_rollup
 
 from fastapi import APIRouter, HTTPException, Query, Depends
 from sqlalchemy.sql import between, select, and_, text
-from pandas import to_timedelta
 
 import credentials as crd
 
@@ -24,6 +24,17 @@ aggregation_mapping = {
         'q3': "percentile_cont(0.75) WITHIN GROUP (ORDER BY value) as value",
     }
 
+# aggregations of the daily summaries in meteodata_daily
+rollup_aggregation_mapping = {
+        'mean': 'average(rollup(stats)) as value',
+        'sum': 'sum(rollup(stats)) as value',
+        'min': 'min(minimum) as value',
+        'max': 'max(maximum) as value',
+        'median': "approx_percentile(0.5, rollup(pct)) as value",
+        'q1': "approx_percentile(0.25, rollup(pct)) as value",
+        'q3': "approx_percentile(0.75, rollup(pct)) as value",
+    }
+
 # ------------------------------------------------------------------------------
 # Meteodata
 # ------------------------------------------------------------------------------
@@ -105,26 +116,47 @@ async def get_measurements(
     aggregation:str = "mean",
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
+    exact: bool = False,
     is_allowed: bool = Depends(AuthenticationChecker())
 ) -> MeteoMeasurements:
     aggregation_str = aggregation_mapping.get(aggregation)
     if aggregation_str is None:
         raise HTTPException(status_code=422, detail=f'Invalid aggregation method: {aggregation}')
 
-    time_from_condition = "AND ts >= :time_from" if time_from else ""
-    time_to_condition = "AND ts <= :time_to" if time_to else ""
-    query = text(
-    f"""
-    SELECT time_bucket(:bucket_width, ts) AS time,
-    {aggregation_str}
-    FROM {crd.db_cache.schema}.meteodata
-    WHERE param_id = :param_id and station_id = :station_id
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY time
-    ORDER BY time
-    """
-    ).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(),param_id=param_id, station_id=station_id)
+    bucket_width = parse_bucket_width(bucket_width)
+    rollup = None if exact else select_rollup(bucket_width, time_from, time_to, meteodata_rollups)
+    if rollup:
+        # merge the daily summaries
+        suffix, (time_from, time_to) = rollup
+        time_from_condition = "AND bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND bucket < :time_to" if time_to else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, bucket) AS time,
+        {rollup_aggregation_mapping[aggregation]}
+        FROM {crd.db_cache.schema}.meteodata_{suffix}
+        WHERE param_id = :param_id and station_id = :station_id
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY 1
+        ORDER BY 1
+        """
+        ).bindparams(bucket_width=bucket_width,param_id=param_id, station_id=station_id)
+    else:
+        time_from_condition = "AND ts >= :time_from" if time_from else ""
+        time_to_condition = "AND ts <= :time_to" if time_to else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, ts) AS time,
+        {aggregation_str}
+        FROM {crd.db_cache.schema}.meteodata
+        WHERE param_id = :param_id and station_id = :station_id
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY time
+        ORDER BY time
+        """
+        ).bindparams(bucket_width=bucket_width,param_id=param_id, station_id=station_id)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -188,8 +220,64 @@ async def get_summary(
     param_id: str,
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
+    exact: bool = False,
     is_allowed: bool = Depends(AuthenticationChecker())
 ) -> MeteoSummary:
+    '''
+    Summary statistics of a parameter at a station. Percentiles, mean and
+    variance are merged from daily sketches (percentiles are approximate),
+    values of partial days at the range boundaries are read from the raw
+    records. Use `exact` to compute all statistics from the raw records.
+    '''
+    day = timedelta(days=1)
+    day_from = ceil_bucket(time_from, day) if time_from else None
+    day_to = floor_bucket(time_to, day) if time_to else None
+    if not exact and not (day_from and day_to and day_from >= day_to):
+        params = dict(param_id=param_id, station_id=station_id)
+        daily_from_condition = "AND bucket >= :day_from" if day_from else ""
+        daily_to_condition = "AND bucket < :day_to" if day_to else ""
+        parts = [f"""
+            SELECT pct, stats, minimum, maximum, min_time, max_time
+            FROM {crd.db_cache.schema}.meteodata_daily
+            WHERE param_id = :param_id and station_id = :station_id
+            {daily_from_condition}
+            {daily_to_condition}
+        """]
+        edge = f"""
+            SELECT percentile_agg(value), stats_agg(value), min(value), max(value), min(ts), max(ts)
+            FROM {crd.db_cache.schema}.meteodata
+            WHERE param_id = :param_id and station_id = :station_id
+        """
+        if day_from:
+            params['day_from'] = day_from
+        if time_from and time_from < day_from:
+            parts.append(edge + "    AND ts >= :time_from AND ts < :day_from")
+            params['time_from'] = time_from
+        if time_to:
+            parts.append(edge + "    AND ts >= :day_to AND ts <= :time_to")
+            params.update(day_to = day_to, time_to = time_to)
+        query = text(
+        f"""
+        WITH parts AS ({' UNION ALL '.join(parts)})
+        SELECT
+        max(maximum) as maximum,
+        min(minimum) as minimum,
+        average(rollup(stats)) as mean,
+        approx_percentile(0.5, rollup(pct)) as median,
+        approx_percentile(0.25, rollup(pct)) as q1,
+        approx_percentile(0.75, rollup(pct)) as q3,
+        max(maximum) - min(minimum) AS range,
+        variance(rollup(stats)) AS variance,
+        stddev(rollup(stats)) as stddev,
+        min(min_time) as min_time,
+        max(max_time) as max_time,
+        num_vals(rollup(stats))::bigint as count
+        FROM parts
+        """
+        ).bindparams(**params)
+        result = await database_cache.fetch_one(query)
+        return MeteoSummary(**result)
+
     time_from_condition = "AND ts >= :time_from" if time_from else ""
     time_to_condition = "AND ts <= :time_to" if time_to else ""
     query = text(
@@ -1,77 +1,37 @@
+import asyncio
 from os import path
+from typing import Optional
 
-from api.config import crd, supported_image_formats, thumbnail_size
+from api.audio import spectrogram_response
+from api.config import media_delivery, multipart_checksum_prefix, multipart_part_size, spectrogram_formats, spectrogram_n_fft, supported_image_formats
 from api.database import database
 from api.dependencies import check_oid_authentication, check_oid_m2m_authentication, AuthenticationChecker
+from api.indexes import whitelist_index
+from api.mediacache import media_cache
+from api.models import DeliveryEnum, MultipartCompleteRequest, MultipartUpload, MultipartUploadRequest, UploadPart, VariantJob
+from api.storage import media_response, storage, storage_scaled, storage_web
+from api.tables import files_audio, files_image
+from api.variants import variant_jobs
 
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response, UploadFile
 
-from minio import Minio
 from minio.error import S3Error
 
-from sqlalchemy.sql import text
+from sqlalchemy.sql import select
 from uuid import uuid4
-import json
-
-from PIL import Image
 import io
+import json
 
 router = APIRouter(tags=['storage'])
 
+delivery_query = Query(None, description='Stream the object through the API (proxy) or redirect to a presigned url (redirect), defaults per route')
+
 # ------------------------------------------------------------------------------
 # MINIO FILE IO
 # ------------------------------------------------------------------------------
 
-storage = Minio(
-    crd.minio.host,
-    access_key=crd.minio.access_key,
-    secret_key=crd.minio.secret_key,
-)
-bucket_exists = storage.bucket_exists(crd.minio.bucket)
-if not bucket_exists:
-    print(f'Bucket {crd.minio.bucket} does not exist.')
-
-storage_scaled = Minio(
-    crd.minio_scaled.host,
-    access_key=crd.minio_scaled.access_key,
-    secret_key=crd.minio_scaled.secret_key,
-)
-bucket_exists = storage_scaled.bucket_exists(crd.minio_scaled.bucket)
-if not bucket_exists:
-    print(f'Bucket {crd.minio_scaled.bucket} does not exist.')
-
-storage_web = Minio(
-    crd.minio_web.host,
-    access_key=crd.minio_web.access_key,
-    secret_key=crd.minio_web.secret_key,
-)
-bucket_exists = storage_web.bucket_exists(crd.minio_web.bucket)
-if not bucket_exists:
-    print(f'Bucket {crd.minio_web.bucket} does not exist.')
-
-def stream_minio_response(response):
-    try:
-        while True:
-            chunk = response.read(4096 * 16)
-            if not chunk:
-                break
-            yield chunk
-    finally:
-        response.close()
-        response.release_conn()
-
-def get_thumbnail_name(object_name: str, image_format: str):
-    '''
-    :param object_name: the name of the file including path and extension
-    :param image_format: the mime-type of the image
-    :return: standardized thumbnail file name
-    '''
-    name = object_name.rsplit('.', 1)[0]
-    return f'{name}_{thumbnail_size[0]}x{thumbnail_size[1]}.{image_format}'
-
 @router.get('/files/walk/{object_name:path}', summary='Whitelisted media resources from S3 storage for Walk App')
-async def get_walk_download(request: Request, object_name: str):
+async def get_walk_download(request: Request, object_name: str, delivery: Optional[DeliveryEnum] = delivery_query):
     '''
     ## Media resources for Walk App
 
@@ -79,39 +39,32 @@ async def get_walk_download(request: Request, object_name: str):
     '''
     if not object_name.startswith('walk/public'):
         try:
-            whitelisted = await database.fetch_one(text('select count(object_name) from prod.storage_whitelist where object_name = :object_name').\
-                bindparams(object_name=object_name))
-            if not whitelisted['count']:
+            if not await whitelist_index.contains(object_name):
                 raise HTTPException(status_code=401, detail='Access denied')
-            response = storage_scaled.get_object(crd.minio_scaled.bucket, path.splitext(object_name)[0] + '.webp')
-            return StreamingResponse(stream_minio_response(response), headers=response.headers)
+            return await media_response(request, storage_scaled, path.splitext(object_name)[0] + '.webp', delivery or media_delivery['walk'])
         except S3Error as e:
             if e.code == 'NoSuchKey':
                 raise HTTPException(status_code=404, detail='File not found')
     else:
         # walk/public/... is whitelisted, and on unscaled server/bucket
         try:
-            response = storage_web.get_object(crd.minio_web.bucket, object_name)
-            return StreamingResponse(stream_minio_response(response), headers=response.headers)
+            return await media_response(request, storage_web, object_name, delivery or media_delivery['walk'])
         except S3Error as e:
             if e.code == 'NoSuchKey':
                 raise HTTPException(status_code=404, detail='File not found')
 
 @router.get('/tv/file/{object_name:path}', summary='Media resources for TV App from S3 storage')
-async def get_tv_download(request: Request, object_name: str):
+async def get_tv_download(request: Request, object_name: str, delivery: Optional[DeliveryEnum] = delivery_query):
     try:
-        whitelisted = await database.fetch_one(text('select count(object_name) from prod.storage_whitelist where object_name like :object_name').\
-            bindparams(object_name=path.splitext(object_name)[0] + '%'))
-        if not whitelisted['count']:
+        if not await whitelist_index.contains_prefix(path.splitext(object_name)[0]):
             raise HTTPException(status_code=401, detail='Access denied')
-        response = storage_scaled.get_object(crd.minio_scaled.bucket, object_name)
-        return StreamingResponse(stream_minio_response(response), headers=response.headers)
+        return await media_response(request, storage_scaled, object_name, delivery or media_delivery['tv'])
     except S3Error as e:
         if e.code == 'NoSuchKey':
             raise HTTPException(status_code=404, detail='File not found')
 
 @router.get('/files/discover/{object_name:path}', summary='Media resources from S3 storage')
-async def get_discover_file(object_name: str):
+async def get_discover_file(request: Request, object_name: str, delivery: Optional[DeliveryEnum] = delivery_query):
     '''
     ## Media resources
 
@@ -119,24 +72,202 @@ async def get_discover_file(object_name: str):
     '''
     object_name = f'discover/{object_name}'
     try:
-        response = storage_web.get_object(crd.minio_web.bucket, object_name)
-        return StreamingResponse(stream_minio_response(response), headers=response.headers)
+        return await media_response(request, storage_web, object_name, delivery or media_delivery['discover'])
     except S3Error as e:
         if e.code == 'NoSuchKey':
             raise HTTPException(status_code=404, detail='File not found')
 
 
+@router.get('/spectrogram/{object_name:path}', dependencies=[Depends(check_oid_authentication)], response_class=Response,
+    responses={200: {'content': {media_type: {} for media_type in spectrogram_formats.values()}}}, summary='Spectrogram of an audio file')
+async def get_spectrogram(
+    request: Request,
+    object_name: str,
+    start: float = Query(0, ge=0, description='Start of the window, seconds from the start of the recording'),
+    end: float = Query(..., gt=0, description='End of the window, seconds from the start of the recording'),
+    n_fft: int = Query(spectrogram_n_fft, description='STFT size, power of 2'),
+    fmax: Optional[float] = Query(None, gt=0, description='Highest frequency rendered, Hz'),
+    image_format: str = Query('webp', alias='format', regex=f'^({"|".join(spectrogram_formats)})$')
+    ):
+    '''
+    ## Spectrogram of an audio file
+
+    Spectrogram of the window `start` - `end` of the audio file, computed from
+    the window only and cached in storage.
+    '''
+    file = await database.fetch_one(select(files_audio.c.file_size).where(files_audio.c.object_name == object_name))
+    if file is None:
+        raise HTTPException(status_code=404, detail='File not found')
+    return await spectrogram_response(request, object_name, file['file_size'], start, end, n_fft, fmax, image_format)
+
+# multipart uploads, registered before the object name routes of /files/
+
+async def get_upload_parts(object_name: str, upload_id: str) -> list:
+    try:
+        parts = await storage.list_parts(object_name, upload_id)
+    except S3Error as e:
+        if e.code == 'NoSuchUpload':
+            raise HTTPException(status_code=404, detail='Upload not found')
+        raise e
+    return [UploadPart(part_number=p.part_number, size=p.size, etag=p.etag) for p in parts]
+
+def checksum_name(upload_id: str) -> str:
+    return f'{multipart_checksum_prefix}/{upload_id}.sha256'
+
+async def create_upload(object_name: str, sha256: str) -> str:
+    upload_id = await storage.create_multipart_upload(object_name, {'sha256': sha256})
+    await storage.put(checksum_name(upload_id), io.BytesIO(sha256.encode()), length=len(sha256))
+    return upload_id
+
+async def upload_checksum(upload_id: str) -> Optional[str]:
+    try:
+        return (await (await storage.get(checksum_name(upload_id))).read()).decode()
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            return None
+        raise e
+
+async def abort_upload(object_name: str, upload_id: str) -> None:
+    await storage.abort_multipart_upload(object_name, upload_id)
+    await storage.remove(checksum_name(upload_id))
+
+@router.post('/files/uploads', response_model=MultipartUpload, dependencies=[Depends(check_oid_m2m_authentication)], summary='Start or resume a multipart upload')
+async def post_multipart_upload(body: MultipartUploadRequest):
+    '''
+    ## Multipart uploads
+
+    Start an upload of `object_name` in parts of `part_size` bytes (all but the
+    last part), which can be uploaded in parallel and in any order. If an upload
+    of `object_name` is in progress, it is resumed and the parts uploaded so far
+    are listed, so only the missing parts need to be sent. An upload in progress
+    of other content (a different `sha256`) is aborted and a new one started.
+
+    If the object exists already, its ETag is returned instead of an upload ID.
+    '''
+    part_count = -(-body.size // multipart_part_size)
+    try:
+        stat = await storage.stat(body.object_name)
+    except S3Error as e:
+        if e.code != 'NoSuchKey':
+            raise e
+    else:
+        return MultipartUpload(object_name=stat.object_name, etag=stat.etag, part_size=multipart_part_size, part_count=part_count)
+    upload_id = await storage.find_multipart_upload(body.object_name)
+    if upload_id is not None and await upload_checksum(upload_id) != body.sha256:
+        try:
+            await abort_upload(body.object_name, upload_id)
+        except S3Error as e:
+            if e.code != 'NoSuchUpload':
+                raise e
+        upload_id = None
+    if upload_id is None:
+        upload_id = await create_upload(body.object_name, body.sha256)
+        parts = []
+    else:
+        parts = await get_upload_parts(body.object_name, upload_id)
+    return MultipartUpload(object_name=body.object_name, upload_id=upload_id,
+        part_size=multipart_part_size, part_count=part_count, parts=parts)
+
+@router.put('/files/uploads/{upload_id}/parts/{part_number}', response_model=UploadPart, dependencies=[Depends(check_oid_m2m_authentication)], summary='Upload a part of a multipart upload')
+async def put_upload_part(request: Request, upload_id: str, object_name: str,
+        part_number: int = Path(..., ge=1, le=10000)):
+    '''
+    ## Multipart uploads
+
+    Upload part `part_number` (starting at 1) as request body, with its size in
+    the `Content-Length` header. A part that was uploaded before is replaced,
+    failed parts can be retried. The integrity of the part is checked by
+    storage if the `Content-MD5` header is set.
+    '''
+    try:
+        content_length = int(request.headers['content-length'])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=411, detail='Content-Length is required')
+    if content_length > multipart_part_size:
+        raise HTTPException(status_code=413, detail=f'Parts are limited to {multipart_part_size} bytes')
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > multipart_part_size:
+            raise HTTPException(status_code=413, detail=f'Parts are limited to {multipart_part_size} bytes')
+    try:
+        etag = await storage.upload_part(object_name, upload_id, part_number, bytes(data), request.headers.get('content-md5'))
+    except S3Error as e:
+        if e.code == 'NoSuchUpload':
+            raise HTTPException(status_code=404, detail='Upload not found')
+        if e.code in ('BadDigest', 'InvalidDigest'):
+            raise HTTPException(status_code=422, detail='Content-MD5 does not match the part')
+        if e.code == 'EntityTooLarge':
+            raise HTTPException(status_code=413, detail=f'Parts are limited to {multipart_part_size} bytes')
+        raise e
+    return UploadPart(part_number=part_number, size=len(data), etag=etag)
+
+@router.get('/files/uploads/{upload_id}', response_model=MultipartUpload, dependencies=[Depends(check_oid_m2m_authentication)], summary='Parts of a multipart upload')
+async def get_multipart_upload(upload_id: str, object_name: str):
+    parts = await get_upload_parts(object_name, upload_id)
+    return MultipartUpload(object_name=object_name, upload_id=upload_id,
+        part_size=multipart_part_size, part_count=len(parts), parts=parts)
+
+@router.post('/files/uploads/{upload_id}/complete', dependencies=[Depends(check_oid_m2m_authentication)], summary='Complete a multipart upload')
+async def post_multipart_complete(upload_id: str, object_name: str, body: MultipartCompleteRequest):
+    '''
+    ## Multipart uploads
+
+    Assemble the uploaded parts, which have to be numbered contiguously from 1,
+    all but the last of `part_size` bytes, adding up to `size`. The checksum
+    of the object is verified against the SHA256 of its record in
+    `files_audio` or `files_image`, if there is one, else against `sha256`.
+    The object is removed if the checksum doesn't match.
+    '''
+    part_count = -(-body.size // multipart_part_size)
+    try:
+        parts = await storage.list_parts(object_name, upload_id)
+        if [p.part_number for p in parts] != list(range(1, part_count + 1)):
+            raise HTTPException(status_code=409, detail=f'Upload of {body.size} bytes requires parts 1 to {part_count}')
+        invalid = [p.part_number for p in parts[:-1] if p.size != multipart_part_size]
+        if invalid:
+            raise HTTPException(status_code=409, detail=f'Parts {invalid} are not {multipart_part_size} bytes')
+        if sum(p.size for p in parts) != body.size:
+            raise HTTPException(status_code=409, detail=f'Parts do not add up to {body.size} bytes')
+        await storage.complete_multipart_upload(object_name, upload_id, parts)
+        await storage.remove(checksum_name(upload_id))
+    except S3Error as e:
+        if e.code == 'NoSuchUpload':
+            raise HTTPException(status_code=404, detail='Upload not found')
+        if e.code in ('EntityTooSmall', 'InvalidPart', 'InvalidPartOrder'):
+            raise HTTPException(status_code=409, detail=f'Parts can not be assembled: {e.message}')
+        raise e
+    expected = body.sha256
+    for table in (files_audio, files_image):
+        record = await database.fetch_one(select(table.c.sha256).where(table.c.object_name == object_name))
+        if record is not None:
+            expected = record['sha256']
+            break
+    if await storage.sha256(object_name) != expected:
+        await storage.remove(object_name)
+        raise HTTPException(status_code=409, detail='Checksum of the uploaded object does not match')
+    stat = await storage.stat(object_name)
+    return { 'object_name': stat.object_name, 'etag': stat.etag }
+
+@router.delete('/files/uploads/{upload_id}', dependencies=[Depends(check_oid_m2m_authentication)], summary='Abort a multipart upload')
+async def delete_multipart_upload(upload_id: str, object_name: str):
+    try:
+        await abort_upload(object_name, upload_id)
+    except S3Error as e:
+        if e.code == 'NoSuchUpload':
+            raise HTTPException(status_code=404, detail='Upload not found')
+        raise e
+
 # this will work for audio files, but not for images, as they were moved to another server
 @router.get('/files/{object_name:path}', dependencies=[Depends(check_oid_authentication)], summary='Media resources from S3 storage')
-async def get_download(object_name: str):
+async def get_download(request: Request, object_name: str, delivery: Optional[DeliveryEnum] = delivery_query):
     '''
     ## Media resources
 
     Requested media will be returned if request is authenticated and role is authorized for access.
     '''
     try:
-        response = storage.get_object(crd.minio.bucket, object_name)
-        return StreamingResponse(stream_minio_response(response), headers=response.headers)
+        return await media_response(request, storage, object_name, delivery or media_delivery['files'])
     except S3Error as e:
         if e.code == 'NoSuchKey':
             raise HTTPException(status_code=404, detail='File not found')
@@ -145,14 +276,14 @@ async def get_download(object_name: str):
 async def post_upload(file: UploadFile):
     # make sure object doesn't already exist
     try:
-        stat = storage.stat_object(crd.minio.bucket, file.filename)
+        stat = await storage.stat(file.filename)
     except S3Error as e:
         if e.code != 'NoSuchKey':
             raise e
     else:
         return { 'object_name': stat.object_name, 'etag': stat.etag }
     # upload
-    upload = storage.put_object(crd.minio.bucket, file.filename, file.file, length=-1, part_size=10*1024*1024)
+    upload = await storage.put(file.filename, file.file)
 
 @router.post('/files/discover', dependencies=[Depends(AuthenticationChecker(['internal']))])
 async def post_discover_upload(file: UploadFile):
@@ -166,7 +297,7 @@ async def post_discover_upload(file: UploadFile):
     object_name = f'discover/{uuid}/{file.filename}'
     # make sure object doesn't already exist
     try:
-        stat = storage_web.stat_object(crd.minio_web.bucket, object_name)
+        stat = await storage_web.stat(object_name)
     except S3Error as e:
         if e.code != 'NoSuchKey':
             raise e
@@ -174,34 +305,44 @@ async def post_discover_upload(file: UploadFile):
         return { 'object_name': stat.object_name, 'etag': stat.etag }
 
     # upload original size image
-    upload = storage_web.put_object(crd.minio_web.bucket, object_name, file.file, length=-1, part_size=10*1024*1024)
+    upload = await storage_web.put(object_name, file.file)
 
-    # if file is an image, create and upload thumbnail image
+    # if file is an image, render thumbnail and variants in the background
     if file.content_type in supported_image_formats:
-        file.file.seek(0)
-        image_format = supported_image_formats.get(file.content_type)
-
         try:
-            content = await file.read()
-            image = Image.open(io.BytesIO(content))
-            image.thumbnail(thumbnail_size)
-            buffer = io.BytesIO()
-            image.save(buffer, format=image_format)
-            buffer.seek(0)
-            thumbnail_name = get_thumbnail_name(object_name, image_format)
-            storage_web.put_object(crd.minio_web.bucket, thumbnail_name, buffer, length=-1, part_size=10*1024*1024)
-        except Exception:
-            # thumbnail is optional, no action required
-            pass
+            variant_jobs.submit(storage_web, object_name, supported_image_formats.get(file.content_type))
+        except asyncio.QueueFull:
+            print(f'variant queue full, variants of {object_name} are rendered when requested')
 
     return { 'object_name': upload.object_name, 'etag': upload.etag }
 
+@router.get('/variants/{object_name:path}', response_model=VariantJob, dependencies=[Depends(AuthenticationChecker(['internal']))], summary='Status of the variants of an uploaded image')
+async def get_variant_job(object_name: str):
+    '''
+    ## Image variants
+
+    Status of rendering the thumbnail and the scaled variants of an image
+    uploaded to `/files/discover`. Images without variants and without a job
+    (e.g. after a restart of the API) are submitted again.
+    '''
+    try:
+        job = await variant_jobs.status(storage_web, object_name)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail='Variant queue is full', headers={'Retry-After': '60'})
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return job
+
+@router.get('/storage/cache', dependencies=[Depends(check_oid_authentication)], summary='Statistics of the local media cache')
+async def get_cache_stats():
+    return media_cache.stats()
+
 @router.get('/walk/imagestack_s3/{walk_id}')
 async def get_imagestack_from_s3(walk_id):
     object_name = f'walk/public/{walk_id}.json'
     try:
-        resp = storage_web.get_object(crd.minio_web.bucket, object_name)
-        return json.loads(resp.data)
+        resp = await storage_web.get(object_name)
+        return json.loads(await resp.read())
     except:
         raise HTTPException(status_code=404, detail='File not found')
 
@@ -209,7 +350,7 @@ async def get_imagestack_from_s3(walk_id):
 async def get_imagestacks_from_s3():
     object_name = f'walk/public/'
     try:
-        resp = storage_web.list_objects(crd.minio_web.bucket, object_name)
+        resp = await storage_web.list(object_name)
         return list(
             map(lambda p: {'path': p.object_name, 'updated_at': p.last_modified},
                 filter(lambda o: path.splitext(o._object_name)[1] == '.json', resp)))
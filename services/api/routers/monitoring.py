@@ -0,0 +1,28 @@
+from typing import List
+
+from api.dependencies import AuthenticationChecker
+from api.metrics import query_log
+from api.models import QueryOrderEnum, QueryStatistics
+
+from fastapi import APIRouter, Depends, Query
+
+router = APIRouter(tags=['monitoring'])
+
+# ------------------------------------------------------------------------------
+# QUERY STATISTICS
+# ------------------------------------------------------------------------------
+
+@router.get('/monitoring/queries', response_model=List[QueryStatistics], dependencies=[Depends(AuthenticationChecker(['internal']))], summary='Slowest queries by fingerprint')
+async def get_slowest_queries(
+        limit: int = Query(20, ge=1, le=1000),
+        order_by: QueryOrderEnum = QueryOrderEnum.total
+    ):
+    '''
+    Statistics of the queries run since the start of the API, grouped by
+    fingerprint (the statement with literals and parameters replaced) and
+    ordered by their total, mean or maximum duration.
+
+    Queries slower than `slow_query_threshold` are logged, and if enabled,
+    the plan of one of their executions is included.
+    '''
+    return query_log.top(limit, order_by.value)
@@ -3,12 +3,12 @@ from typing import List, Optional
 from datetime import datetime
 
 from api.database import database
-from api.dependencies import unique_everseen, AuthenticationChecker, get_user
+from api.dependencies import unique_everseen, AuthContext, AuthenticationChecker, get_auth
 from api.models import ApiErrorResponse, Note, NoteResponse, PatchNote, Tag, File
 from api.tables import notes, files_note, mm_tags_notes, tags, user_entity
 
 from asyncpg import UniqueViolationError
-from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.sql import and_, between, select, text, func
 
 router = APIRouter(tags=['notes', 'discover'])
@@ -19,7 +19,7 @@ router = APIRouter(tags=['notes', 'discover'])
 
 @router.get('/notes', response_model=List[NoteResponse], response_model_exclude_none=True)
 async def list_notes(
-    request: Request,
+    auth: AuthContext = Depends(get_auth),
     time_from: Optional[datetime] = Query(None, alias='from', example='2022-06-22T18:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-06-22T20:00:00.000Z'),
 ) -> List[NoteResponse]:
@@ -30,12 +30,7 @@ async def list_notes(
     or unbounded ranges as a combination of `to` and `from` query parameters.
     '''
 
-    authenticated = False
-    auth_header = request.headers.get('authorization')
-    if auth_header:
-        user = get_user(auth_header.split('Bearer ')[1])
-        if user:
-            authenticated = 'public' in user['realm_access']['roles']
+    authenticated = auth.has_role('public')
 
     query = select(notes, notes.c.created_at.label('date'), tags.c.tag_id, tags.c.name.label('tag_name'),\
             files_note.c.file_id, files_note.c.object_name, files_note.c.name.label('file_name'), files_note.c.type.label('file_type'),\
@@ -70,7 +65,7 @@ async def list_notes(
 
 
 @router.post('/notes', dependencies=[Depends(AuthenticationChecker())], response_model=Note)
-async def add_note(body: Note, auth = Depends(get_user)) -> None:
+async def add_note(body: Note, auth: AuthContext = Depends(get_auth)) -> None:
     '''
     ## Add a new note
 
@@ -81,13 +76,13 @@ async def add_note(body: Note, auth = Depends(get_user)) -> None:
     by the user.
     '''
 
-    authorised = 'internal' in auth['realm_access']['roles']
+    authorised = auth.has_role('internal')
 
     query = notes.insert().values(
         title=body.title,
         description=body.description,
         type=body.note_type,
-        user_sub=auth.get('sub'),
+        user_sub=auth.sub,
         public=body.public if authorised else False, # only 'internal' can create public notes
         location=None if 'location' in body else text(f'point(:lat,:lon)').bindparams(lat=body.location.lat, lon=body.location.lon),
         created_at=body.date or func.now(),
@@ -96,16 +91,11 @@ async def add_note(body: Note, auth = Depends(get_user)) -> None:
     return await database.fetch_one(query)
 
 @router.get('/note/{note_id}', response_model=NoteResponse, responses={404: {'model': ApiErrorResponse}}, response_model_exclude_none=True)
-async def get_note_by_id(note_id: int, request: Request) -> NoteResponse:
+async def get_note_by_id(note_id: int, auth: AuthContext = Depends(get_auth)) -> NoteResponse:
     '''
     Find note by ID
     '''
-    authenticated = False
-    auth_header = request.headers.get('authorization')
-    if auth_header:
-        user = get_user(auth_header.split('Bearer ')[1])
-        if user:
-            authenticated = 'public' in user['realm_access']['roles']
+    authenticated = auth.has_role('public')
 
     query = select(notes, notes.c.created_at.label('date'), tags.c.tag_id, tags.c.name.label('tag_name'),
             files_note.c.file_id, files_note.c.name.label('file_name'), files_note.c.object_name, files_note.c.type.label('file_type'),
@@ -131,7 +121,7 @@ async def get_note_by_id(note_id: int, request: Request) -> NoteResponse:
         return e
 
 @router.patch('/note/{note_id}', response_model=Note, dependencies=[Depends(AuthenticationChecker())])
-async def update_note(note_id: int, body: PatchNote = ..., auth = Depends(get_user)) -> Note:
+async def update_note(note_id: int, body: PatchNote = ..., auth: AuthContext = Depends(get_auth)) -> Note:
     '''
     ## Updates a note
 
@@ -154,7 +144,7 @@ async def update_note(note_id: int, body: PatchNote = ..., auth = Depends(get_us
     del update_data['note_id']
 
     # only 'internal' can change public flag
-    if 'internal' not in auth['realm_access']['roles']:
+    if not auth.has_role('internal'):
         del update_data['public']
 
     # author can't be changed
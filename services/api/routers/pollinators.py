@@ -1,19 +1,24 @@
 from datetime import date, datetime, timedelta
 from typing import List, Optional
-from pandas import to_timedelta
 
 
-from api.database import database
+from api.config import crop_max_size, crop_size, derived_prefix
+from api.database import database, read_only
+from api.images import crop_image
 from api.models import PollinatorTypeEnum, TimeSeriesResult, Point, DetectionLocationResult
-from api.dependencies import pollinator_class_mapper
-from fastapi import APIRouter, Query
+from api.dependencies import pollinator_class_mapper, AuthenticationChecker, parse_bucket_width
+from api.rollups import confidence_band, covers_rollup, rollup_bounds
+from api.storage import derived_response, storage_scaled
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from minio.error import S3Error
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.sql import and_, desc, func, select, text, bindparam
 from sqlalchemy.types import ARRAY, INTEGER
 
 import credentials as crd
 
 
-router = APIRouter(tags=['pollinator'])
+router = APIRouter(tags=['pollinator'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # POLLINATOR RESULTS
@@ -29,26 +34,48 @@ async def detection_dates_by_class(
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
     ) -> TimeSeriesResult:
-    time_from_condition = "AND i.time >= :time_from" if time_from else ""
-    time_to_condition = "AND i.time <= :time_to" if time_to else ""
+    bucket_width = parse_bucket_width(bucket_width)
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
     pollinator_class_condition = "and p.class in :pollinator_classes" if pollinator_class is not None else ""
-    deployment_filter = "and i.deployment_id in :deployment_ids" if deployment_ids else ""
-    query = text(
-    f"""
-    SELECT time_bucket(:bucket_width, i.time) AS bucket,
-    count(p.class) as detections
-    from {crd.db.schema}.pollinators p
-    left join {crd.db.schema}.image_results ir ON p.result_id = ir.result_id
-    left join {crd.db.schema}.files_image i ON ir.file_id = i.file_id
-    where p.confidence >= :conf
-    {pollinator_class_condition}
-    {deployment_filter}
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY bucket
-    ORDER BY bucket
-    """
-    ).bindparams(bucket_width=to_timedelta(bucket_width).to_pytimedelta(),conf=conf)
+    if bounds is not None and band is not None and covers_rollup(bucket_width):
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND p.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND p.bucket < :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, p.bucket) AS bucket,
+        sum(p.detections)::bigint as detections
+        from {crd.db.schema}.pollinators_hourly p
+        where p.confidence_band >= :band
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY 1
+        ORDER BY 1
+        """
+        ).bindparams(bucket_width=bucket_width, band=band)
+    else:
+        time_from_condition = "AND p.time >= :time_from" if time_from else ""
+        time_to_condition = "AND p.time <= :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT time_bucket(:bucket_width, p.time) AS bucket,
+        count(p.class) as detections
+        from {crd.db.schema}.pollinators_timed p
+        where p.confidence >= :conf
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY bucket
+        ORDER BY bucket
+        """
+        ).bindparams(bucket_width=bucket_width, conf=conf)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -74,10 +101,10 @@ async def detection_time_of_day(
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
 ):
-    time_from_condition = "AND i.time >= :time_from" if time_from else ""
-    time_to_condition = "AND i.time <= :time_to" if time_to else ""
+    time_from_condition = "AND p.time >= :time_from" if time_from else ""
+    time_to_condition = "AND p.time <= :time_to" if time_to else ""
     pollinator_class_condition = "and p.class in :pollinator_classes" if pollinator_class is not None else ""
-    deployment_filter = "and i.deployment_id in :deployment_ids" if deployment_ids else ""
+    deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
     query = text(
     f"""
     SELECT
@@ -86,11 +113,9 @@ async def detection_time_of_day(
     FROM (
         SELECT
         histogram(
-            EXTRACT (hour from i.time)*60 + EXTRACT (minute from i.time), 0, 24*60, (24*60)/:bucket_width_m
+            EXTRACT (hour from p.time)*60 + EXTRACT (minute from p.time), 0, 24*60, (24*60)/:bucket_width_m
         ) as minute_buckets
-        from {crd.db.schema}.pollinators p
-        left join {crd.db.schema}.image_results ir ON p.result_id = ir.result_id
-        left join {crd.db.schema}.files_image i ON ir.file_id = i.file_id
+        from {crd.db.schema}.pollinators_timed p
         where p.confidence >= :conf
         {pollinator_class_condition}
         {deployment_filter}
@@ -122,30 +147,51 @@ async def detection_locations_by_id(
     time_from: Optional[datetime] = Query(None, alias='from', example='2021-09-01T00:00:00.000Z'),
     time_to: Optional[datetime] = Query(None, alias='to', example='2022-08-31T23:59:59.999Z'),
     ) -> List[DetectionLocationResult]:
-    time_from_condition = "AND i.time >= :time_from" if time_from else ""
-    time_to_condition = "AND i.time <= :time_to" if time_to else ""
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
     pollinator_class_condition = "and p.class in :pollinator_classes" if pollinator_class is not None else ""
-    deployment_filter = "and i.deployment_id in :deployment_ids" if deployment_ids else ""
-
-    query = text(
-    f"""
-    SELECT
-    d.location,
-    d.deployment_id,
-    count(p.class) as detections
-    from {crd.db.schema}.pollinators p
-    left join {crd.db.schema}.image_results ir ON p.result_id = ir.result_id
-    left join {crd.db.schema}.files_image i ON ir.file_id = i.file_id
-    left join {crd.db.schema}.deployments d on i.deployment_id = d.deployment_id
-    where p.confidence >= :conf
-    {pollinator_class_condition}
-    {deployment_filter}
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY d.deployment_id
-
-    """
-    ).bindparams(conf=conf)
+    if bounds is not None and band is not None:
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND p.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND p.bucket < :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT
+        d.location,
+        d.deployment_id,
+        sum(p.detections)::bigint as detections
+        from {crd.db.schema}.pollinators_hourly p
+        left join {crd.db.schema}.deployments d on p.deployment_id = d.deployment_id
+        where p.confidence_band >= :band
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY d.deployment_id
+        """
+        ).bindparams(band=band)
+    else:
+        time_from_condition = "AND p.time >= :time_from" if time_from else ""
+        time_to_condition = "AND p.time <= :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT
+        d.location,
+        d.deployment_id,
+        count(p.class) as detections
+        from {crd.db.schema}.pollinators_timed p
+        left join {crd.db.schema}.deployments d on p.deployment_id = d.deployment_id
+        where p.confidence >= :conf
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY d.deployment_id
+        """
+        ).bindparams(conf=conf)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -174,28 +220,51 @@ async def get_detected_species_list(
     pollinator_class:List[PollinatorTypeEnum] = Query(default=None),
     limit: int = 1000,
     ):
-    time_from_condition = "AND i.time >= :time_from" if time_from else ""
-    time_to_condition = "AND i.time <= :time_to" if time_to else ""
-    deployment_filter = "and i.deployment_id in :deployment_ids" if deployment_ids else ""
+    bounds = rollup_bounds(time_from, time_to)
+    band = confidence_band(conf)
     pollinator_class_condition = "and p.class in :pollinator_classes" if pollinator_class is not None else ""
-    query = text(
-    f"""
-    SELECT
-        distinct(p.class) as polli_class,
-        count(p.class) as detections
-    from {crd.db.schema}.pollinators p
-    left join {crd.db.schema}.image_results ir ON p.result_id = ir.result_id
-    left join {crd.db.schema}.files_image i ON ir.file_id = i.file_id
-    where p.confidence >= :conf
-    {pollinator_class_condition}
-    {deployment_filter}
-    {time_from_condition}
-    {time_to_condition}
-    GROUP BY p.class
-    order by detections desc
-    LIMIT :limit
-    """
-    ).bindparams(conf=conf, limit=limit)
+    if bounds is not None and band is not None:
+        # answer from hourly detection counts
+        time_from, time_to = bounds
+        time_from_condition = "AND p.bucket >= :time_from" if time_from else ""
+        time_to_condition = "AND p.bucket < :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT
+            p.class as polli_class,
+            sum(p.detections)::bigint as detections
+        from {crd.db.schema}.pollinators_hourly p
+        where p.confidence_band >= :band
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY p.class
+        order by detections desc
+        LIMIT :limit
+        """
+        ).bindparams(band=band, limit=limit)
+    else:
+        time_from_condition = "AND p.time >= :time_from" if time_from else ""
+        time_to_condition = "AND p.time <= :time_to" if time_to else ""
+        deployment_filter = "and p.deployment_id in :deployment_ids" if deployment_ids else ""
+        query = text(
+        f"""
+        SELECT
+            distinct(p.class) as polli_class,
+            count(p.class) as detections
+        from {crd.db.schema}.pollinators_timed p
+        where p.confidence >= :conf
+        {pollinator_class_condition}
+        {deployment_filter}
+        {time_from_condition}
+        {time_to_condition}
+        GROUP BY p.class
+        order by detections desc
+        LIMIT :limit
+        """
+        ).bindparams(conf=conf, limit=limit)
     if time_from:
         query = query.bindparams(time_from = time_from)
     if time_to:
@@ -236,3 +305,67 @@ async def get_latest_image_entries():
         {"deployment_id":r.deployment_id, "object_name":r.object_name,"time":r.time}
         for r in results
     ]
+
+async def crop_response(request: Request, kind: str, table: str, key: str, identifier: int, size: int) -> Response:
+    '''
+    Crop of the box `identifier` of `table` out of its image, cached in the
+    scaled bucket. The source is the image in the scaled bucket, in WebP if a
+    converted copy exists (as in `/tv/stack-selection/`).
+    '''
+    async def render():
+        query = text(f'''
+        select f.object_name, f.resolution, b.x0, b.y0, b.x1, b.y1,
+            (
+                select max(mfs.type)
+                from {crd.db.schema}.mm_files_image_storage mfs
+                join {crd.db.schema}.storage_backend sb on mfs.storage_id = sb.storage_id
+                where mfs.file_id = f.file_id and sb.priority = 1
+            ) as type
+        from {crd.db.schema}.{table} b
+        join {crd.db.schema}.image_results r on r.result_id = b.result_id
+        join {crd.db.schema}.files_image f on f.file_id = r.file_id
+        where b.{key} = :identifier
+        ''').bindparams(identifier=identifier)
+        result = await database.fetch_one(query)
+        if result is None:
+            raise HTTPException(status_code=404, detail=f'{kind.capitalize()} not found')
+        object_name = result['object_name']
+        if result['type'] == 1:
+            object_name = object_name.replace('.jpg', '.webp')
+        try:
+            source = await storage_scaled.get(object_name)
+            content = await source.read()
+        except S3Error as e:
+            if e.code == 'NoSuchKey':
+                raise HTTPException(status_code=404, detail='File not found')
+            raise e
+        box = (result['x0'], result['y0'], result['x1'], result['y1'])
+        try:
+            return await run_in_threadpool(crop_image, content, box, result['resolution'], size)
+        except ValueError as e:
+            print(str(e))
+            raise HTTPException(status_code=409, detail=str(e))
+
+    return await derived_response(request, f'{derived_prefix}/crop/{kind}/{identifier}_{size}.webp', 'image/webp', render)
+
+@router.get('/pollinators/{pollinator_id}/crop', dependencies=[Depends(AuthenticationChecker())], response_class=Response,
+    responses={200: {'content': {'image/webp': {}}}})
+async def get_pollinator_crop(request: Request, pollinator_id: int, size: int = Query(crop_size, ge=16, le=crop_max_size)):
+    '''
+    ## Image of a pollinator
+
+    The box of the pollinator cut out of its image, fit into `size` x `size`
+    pixels, as WebP.
+    '''
+    return await crop_response(request, 'pollinator', 'pollinators', 'pollinator_id', pollinator_id, size)
+
+@router.get('/flowers/{flower_id}/crop', dependencies=[Depends(AuthenticationChecker())], response_class=Response,
+    responses={200: {'content': {'image/webp': {}}}})
+async def get_flower_crop(request: Request, flower_id: int, size: int = Query(crop_size, ge=16, le=crop_max_size)):
+    '''
+    ## Image of a flower
+
+    The box of the flower cut out of its image, fit into `size` x `size`
+    pixels, as WebP.
+    '''
+    return await crop_response(request, 'flower', 'flowers', 'flower_id', flower_id, size)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from api.database import database
+from api.database import database, read_only
 from fastapi import APIRouter, Depends, Request, HTTPException, status, Query
 from api.dependencies import AuthenticationChecker
 from sqlalchemy.sql import select, text, bindparam
@@ -9,7 +9,7 @@ from typing import List
 from api.models import EnvironmentEntry, Point
 import credentials as crd
 
-router = APIRouter(tags=['statistics'])
+router = APIRouter(tags=['statistics'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # Measurement statistics for image and audio files
@@ -1,13 +1,13 @@
 from typing import List
 
-from api.database import database
+from api.database import database, read_only
 from api.models import Taxon, RankEnum
 from api.tables import taxonomy_data, taxonomy_tree
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from sqlalchemy.sql import select, text
 
-router = APIRouter(tags=['taxonomy'])
+router = APIRouter(tags=['taxonomy'], dependencies=[Depends(read_only)])
 
 # ------------------------------------------------------------------------------
 # TAXONOMY LOOKUP
@@ -1,22 +1,21 @@
 from typing import Optional
 from hashlib import md5
 
-from api.database import database
+from api.database import database, read_only
 from api.dependencies import to_inclusive_range
 from api.models import TimeStampRange
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi_cache.decorator import cache
 from fastapi_cache import FastAPICache
 from sqlalchemy.sql import text
-from astral.sun import sun
-from astral import LocationInfo
 
 import credentials as crd
 
-router = APIRouter(tags=['images', 'wildcam-tv'])
+router = APIRouter(tags=['images', 'wildcam-tv'], dependencies=[Depends(read_only)])
 
 def is_day(time, observer):
+    from astral.sun import sun
     s = sun(observer, date=time.date())
     return time >= s['sunrise'] and time < s['sunset']
 
@@ -87,6 +86,7 @@ async def get_stack_selection(
     if phase:
         result = await database.fetch_one(text(f'select location from {crd.db.schema}.deployments where deployment_id = :id').bindparams(id=deployment_id))
         coords = list(result['location'])
+        from astral import LocationInfo
         location = LocationInfo(latitude=coords[0], longitude=coords[1])
         if phase == 'day':
             records = [dict(r) for r in records if is_day(r['time'], location.observer)]
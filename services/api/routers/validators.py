@@ -1,12 +1,17 @@
-from api.config import crd
+from datetime import datetime, timezone
+from typing import List, Union
+
+from api.config import validation_batch_size
 from api.database import database
 from api.dependencies import to_inclusive_range, check_oid_authentication, AuthenticationChecker
+from api.indexes import deployment_index
 from api.models import DeploymentRequest, ValidationResult, NodeValidationRequest, Tag, ImageValidationResponse, ImageValidationRequest, AudioValidationResponse, AudioValidationRequest
-from api.tables import deployments, nodes, tags
+from api.tables import deployments, nodes, tags, files_image, files_audio
 
 from asyncpg.exceptions import ExclusionViolationError
-from fastapi import APIRouter, Depends
-from sqlalchemy.sql import select, text
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import Table
+from sqlalchemy.sql import bindparam, func, or_, select, text
 
 router = APIRouter(tags=['validators'])
 
@@ -68,69 +73,77 @@ async def validate_tag(body: Tag) -> ValidationResult:
     return True if r == None else False
 
 
+def compose_object_name(node_label: str, timestamp: datetime, extension: str) -> str:
+    '''
+    Object name of a file recorded by `node_label` at `timestamp`,
+    `{node_label}/{date}/{hour}/{node_label}_{timestamp}{extension}` in UTC.
+    Naive timestamps are taken as UTC.
+    '''
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return f"{node_label}/{timestamp:%Y-%m-%d/%H}/{node_label}_{timestamp:%Y-%m-%dT%H-%M-%SZ}{extension}"
+
+async def validate_files(table: Table, extension: str, files: List[Union[ImageValidationRequest, AudioValidationRequest]]) -> List[dict]:
+    '''
+    Check for each file if a record with the same sha256 hash and/or object
+    name exists, or if it duplicates a preceding file of the same batch, and
+    if the node that recorded it was deployed at the time of recording.
+    '''
+    object_names = [compose_object_name(f.node_label, f.timestamp, extension) for f in files]
+    duplicate_query = select(table.c.sha256, table.c.object_name).where(or_(
+        table.c.sha256 == func.any(bindparam('sha256s', value=list({f.sha256 for f in files}))),
+        table.c.object_name == func.any(bindparam('object_names', value=list(set(object_names))))
+    ))
+    existing = await database.fetch_all(duplicate_query)
+    hashes = {r['sha256'] for r in existing}
+    names = {r['object_name'] for r in existing}
+
+    results = []
+    for f, object_name in zip(files, object_names):
+        deployment_id = await deployment_index.deployment_id(f.timestamp, f.node_label)
+        results.append({
+            'hash_match': f.sha256 in hashes,
+            'object_name_match': object_name in names,
+            'object_name': object_name,
+            'deployment_id': deployment_id,
+            'node_deployed': deployment_id is not None
+        })
+        hashes.add(f.sha256)
+        names.add(object_name)
+    return results
+
 @router.post('/validate/image', dependencies=[Depends(check_oid_authentication)], response_model=ImageValidationResponse, tags=['ingest'])
 async def check_image(body: ImageValidationRequest) -> None:
+    '''
+    Check if a metadata record with the same sha256 hash and/or object name
+    exists, i.e. if this file has already been ingested, and report the
+    object name for the file.
 
-    duplicate_query = text(f'''
-    WITH n AS (
-        SELECT :sha256 as sha256,
-        :node_label ||'/'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD/HH24/') -- file_path (node_label, timestamp)
-        || :node_label ||'_'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD"T"HH24-MI-SS"Z"')||:extension -- file_name (node_label, timestamp, extension)
-        as object_name
-    )
-    SELECT f.sha256 = n.sha256 as hash_match,
-        f.object_name = n.object_name as object_name_match,
-        n.object_name as object_name
-    from {crd.db.schema}.files_image f, n
-    where (f.sha256 = n.sha256 or f.object_name = n.object_name)
-    ''').bindparams(sha256=body.sha256, node_label=body.node_label, timestamp=body.timestamp, extension='.jpg')
-
-    # print(str(query.compile(compile_kwargs={"literal_binds": True})))
-    duplicate_result = await database.fetch_one(duplicate_query)
-
-    object_name = None
-    if duplicate_result == None:
-        object_name_query = text('''
-        SELECT :node_label ||'/'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD/HH24/') -- file_path (node_label, timestamp)
-        || :node_label ||'_'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD"T"HH24-MI-SS"Z"')||:extension -- file_name (node_label, timestamp, extension)
-        as object_name
-        ''').bindparams(node_label=body.node_label, timestamp=body.timestamp, extension='.jpg')
-        object_name_result = await database.fetch_one(object_name_query)
-        object_name = object_name_result._mapping['object_name']
-    else:
-        object_name = duplicate_result._mapping['object_name']
+    Check if the node that recorded the file to be ingested is deployed at the
+    time of recording.
 
-    deployment_query = select(deployments.c.deployment_id).join(nodes).\
-        where(nodes.c.node_label == body.node_label, text('period @> :timestamp ::timestamptz').bindparams(timestamp=body.timestamp))
-    deployment_result = await database.fetch_one(deployment_query)
+    **IMPORTANT**: This function returns status 200 even if the validation
+    fails. The validation result is returned in the response body.
+    '''
+    return (await validate_files(files_image, '.jpg', [body]))[0]
 
-    if duplicate_result == None:
-        if deployment_result:
-            return { # no duplicate, deployed: validation passed
-                'hash_match': False, 'object_name_match': False, 'object_name': object_name,
-                **deployment_result._mapping, 'node_deployed': True }
-        else:
-            return { # no duplicate, NOT deployed: validation failed
-                'hash_match': False, 'object_name_match': False, 'object_name': object_name,
-                'deployment_id': None, 'node_deployed': False }
-    else:
-        if deployment_result:
-            return { # DUPLICATE, deployed: validation failed
-                **duplicate_result._mapping,
-                **deployment_result._mapping, 'node_deployed': True }
-        else:
-            return { # DUPLICATE, NOT deployed: validation failed
-                **duplicate_result._mapping,
-                'deployment_id': None, 'node_deployed': False }
+@router.post('/validate/image/batch', dependencies=[Depends(check_oid_authentication)], response_model=List[ImageValidationResponse], tags=['ingest'])
+async def check_image_batch(body: List[ImageValidationRequest]) -> None:
+    '''
+    Validate a batch of images as in `/validate/image`, the results are
+    returned in the order of the request. Files with the same sha256 hash or
+    object name as a preceding file in the batch are reported as duplicates.
+    '''
+    if len(body) > validation_batch_size:
+        raise HTTPException(status_code=413, detail=f'Batch exceeds {validation_batch_size} files')
+    return await validate_files(files_image, '.jpg', body)
 
 @router.post('/validate/audio', dependencies=[Depends(AuthenticationChecker())], response_model=AudioValidationResponse, tags=['ingest'])
 async def check_audio(body: AudioValidationRequest) -> None:
     '''
     Check if a metadata record with the same sha256 hash and/or object name
-    exists, i.e. if this file has already been ingested.
-
-    If the file has not been ingested, create a new object name for it, else
-    report the existing object name.
+    exists, i.e. if this file has already been ingested, and report the
+    object name for the file.
 
     Check if the node that recorded the file to be ingested is deployed at the
     time of recording.
@@ -138,58 +151,15 @@ async def check_audio(body: AudioValidationRequest) -> None:
     **IMPORTANT**: This function returns status 200 even if the validation
     fails. The validation result is returned in the response body.
     '''
+    return (await validate_files(files_audio, '.wav', [body]))[0]
 
-    duplicate_query = text(f'''
-    WITH n AS (
-        SELECT :sha256 as sha256,
-        :node_label ||'/'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD/HH24/') -- file_path (node_label, timestamp)
-        || :node_label ||'_'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD"T"HH24-MI-SS"Z"')||:extension -- file_name (node_label, timestamp, extension)
-        as object_name
-    )
-    SELECT f.sha256 = n.sha256 as hash_match,
-        f.object_name = n.object_name as object_name_match,
-        n.object_name as object_name
-    from {crd.db.schema}.files_audio f, n
-    where (f.sha256 = n.sha256 or f.object_name = n.object_name)
-    ''').bindparams(sha256=body.sha256, node_label=body.node_label, timestamp=body.timestamp, extension='.wav')
-
-    # print(str(query.compile(compile_kwargs={"literal_binds": True})))
-    duplicate_result = await database.fetch_one(duplicate_query)
-
-    object_name = None
-    if duplicate_result == None:
-        # create new object name
-        object_name_query = text('''
-        SELECT :node_label ||'/'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD/HH24/') -- file_path (node_label, timestamp)
-        || :node_label ||'_'||to_char(:timestamp at time zone 'UTC', 'YYYY-mm-DD"T"HH24-MI-SS"Z"')||:extension -- file_name (node_label, timestamp, extension)
-        as object_name
-        ''').bindparams(node_label=body.node_label, timestamp=body.timestamp, extension='.wav')
-        object_name_result = await database.fetch_one(object_name_query)
-        object_name = object_name_result._mapping['object_name']
-    else:
-        # report existing object name
-        object_name = duplicate_result._mapping['object_name']
-
-    # check if node is deployed at the time of recording
-    deployment_query = select(deployments.c.deployment_id).join(nodes).\
-        where(nodes.c.node_label == body.node_label, text('period @> :timestamp ::timestamptz').bindparams(timestamp=body.timestamp))
-    deployment_result = await database.fetch_one(deployment_query)
-
-    if duplicate_result == None:
-        if deployment_result:
-            return { # no duplicate, deployed: validation passed
-                'hash_match': False, 'object_name_match': False, 'object_name': object_name,
-                **deployment_result._mapping, 'node_deployed': True }
-        else:
-            return { # no duplicate, NOT deployed: validation failed
-                'hash_match': False, 'object_name_match': False, 'object_name': object_name,
-                'deployment_id': None, 'node_deployed': False }
-    else:
-        if deployment_result:
-            return { # DUPLICATE, deployed: validation failed
-                **duplicate_result._mapping,
-                **deployment_result._mapping, 'node_deployed': True }
-        else:
-            return { # DUPLICATE, NOT deployed: validation failed
-                **duplicate_result._mapping,
-                'deployment_id': None, 'node_deployed': False }
+@router.post('/validate/audio/batch', dependencies=[Depends(AuthenticationChecker())], response_model=List[AudioValidationResponse], tags=['ingest'])
+async def check_audio_batch(body: List[AudioValidationRequest]) -> None:
+    '''
+    Validate a batch of audio files as in `/validate/audio`, the results are
+    returned in the order of the request. Files with the same sha256 hash or
+    object name as a preceding file in the batch are reported as duplicates.
+    '''
+    if len(body) > validation_batch_size:
+        raise HTTPException(status_code=413, detail=f'Batch exceeds {validation_batch_size} files')
+    return await validate_files(files_audio, '.wav', body)
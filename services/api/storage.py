@@ -0,0 +1,437 @@
+import asyncio
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from hashlib import sha256
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, List, Optional
+
+import anyio
+import certifi
+import urllib3
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+from minio import Minio
+from minio.datatypes import Object, Part
+from minio.error import S3Error
+from starlette.types import Receive, Scope, Send
+
+from api.config import crd, media_cache_backends, presigned_url_expiry, storage_chunk_size, storage_max_concurrency, storage_pool_size
+from api.mediacache import media_cache, media_stat_cache
+
+# ------------------------------------------------------------------------------
+# OBJECT STORAGE
+# ------------------------------------------------------------------------------
+
+# shared by all backends, sized for each of them to run at its limit
+executor = ThreadPoolExecutor(max_workers=3 * storage_max_concurrency, thread_name_prefix='storage')
+
+class StorageObject:
+    '''
+    Response of a GET request to the object storage, the body is read in the
+    thread pool of its backend.
+    '''
+
+    def __init__(self, storage: 'ObjectStorage', response: urllib3.HTTPResponse) -> None:
+        self.storage = storage
+        self.response = response
+        self.headers = response.headers
+
+    async def read(self) -> bytes:
+        try:
+            return await self.storage.run(self.response.read)
+        finally:
+            self.close()
+
+    async def iter_chunks(self, chunk_size: int = storage_chunk_size) -> AsyncIterator[bytes]:
+        '''
+        Iterate over the body in chunks, the connection is released when the
+        iteration ends or is aborted (i.e. the client disconnected).
+        '''
+        try:
+            while True:
+                chunk = await self.storage.run(self.response.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.response.close()
+        self.response.release_conn()
+
+class ObjectStorage:
+    '''
+    Asynchronous access to a bucket of an S3 backend.
+
+    The blocking calls of the minio client are run in a shared thread pool,
+    at most `max_concurrency` at a time per backend. Each backend has its own
+    pool of `pool_size` connections.
+    '''
+
+    def __init__(self, name: str, config, max_concurrency: int = storage_max_concurrency, pool_size: int = storage_pool_size) -> None:
+        self.name = name
+        self.bucket = config.bucket
+        self.config = config
+        # region of the bucket, requested from the backend if not configured
+        self.region = getattr(config, 'region', None)
+        self.client = Minio(
+            config.host,
+            access_key=config.access_key,
+            secret_key=config.secret_key,
+            region=self.region,
+            # as the default client of minio, with a larger pool
+            http_client=urllib3.PoolManager(
+                maxsize=pool_size,
+                cert_reqs='CERT_REQUIRED',
+                ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+                timeout=urllib3.Timeout(connect=300, read=300),
+                retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+            ),
+        )
+        # presigned urls are signed for the host clients reach the backend at,
+        # with a client created on first use, see `get_presign_client()`
+        self.public_host = getattr(config, 'public_host', None)
+        self.presign_client = self.client if not self.public_host or self.public_host == config.host else None
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # calls currently running or waiting for a thread
+        self.in_flight = 0
+
+    async def run(self, fn, *args, **kwargs):
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
+            finally:
+                self.in_flight -= 1
+
+    async def bucket_exists(self) -> bool:
+        return await self.run(self.client.bucket_exists, self.bucket)
+
+    async def stat(self, object_name: str) -> Object:
+        return await self.run(self.client.stat_object, self.bucket, object_name)
+
+    async def get(self, object_name: str, offset: int = 0, length: int = 0, request_headers: Optional[dict] = None) -> StorageObject:
+        response = await self.run(self.client.get_object, self.bucket, object_name,
+            offset=offset, length=length, request_headers=request_headers)
+        return StorageObject(self, response)
+
+    async def put(self, object_name: str, data, length: int = -1, part_size: int = 10*1024*1024, **kwargs):
+        return await self.run(self.client.put_object, self.bucket, object_name, data,
+            length=length, part_size=part_size, **kwargs)
+
+    def get_presign_client(self) -> Minio:
+        '''
+        Client signing urls for the public host. It is given the region of the
+        bucket, looked up with the internal client if not configured, as
+        clients without a region request it from their host, which may not be
+        reachable from the API.
+        '''
+        if self.presign_client is None:
+            self.presign_client = Minio(
+                self.public_host,
+                access_key=self.config.access_key,
+                secret_key=self.config.secret_key,
+                region=self.region or self.client._get_region(self.bucket, None),
+            )
+        return self.presign_client
+
+    async def presign(self, object_name: str, expires=presigned_url_expiry) -> str:
+        '''
+        Presigned GET url of the object, valid for at least half of `expires`.
+        The url is stable within a window of half of `expires`.
+        '''
+        window = expires.total_seconds() / 2
+        now = datetime.now(timezone.utc).timestamp()
+        request_date = datetime.fromtimestamp(now - now % window, timezone.utc)
+        def sign():
+            return self.get_presign_client().presigned_get_object(self.bucket, object_name,
+                expires=expires, request_date=request_date)
+        return await self.run(sign)
+
+    def download(self, object_name: str, file_path: str) -> None:
+        '''
+        Write the object to `file_path`, blocking (see `run()`)
+        '''
+        response = self.client.get_object(self.bucket, object_name)
+        try:
+            with open(file_path, 'wb') as f:
+                for chunk in response.stream(storage_chunk_size):
+                    f.write(chunk)
+        finally:
+            response.close()
+            response.release_conn()
+
+    async def list(self, prefix: str) -> List[Object]:
+        return await self.run(lambda: list(self.client.list_objects(self.bucket, prefix)))
+
+    async def remove(self, object_name: str) -> None:
+        await self.run(self.client.remove_object, self.bucket, object_name)
+
+    def hash_object(self, object_name: str) -> str:
+        '''
+        sha256 of the content of the object, blocking (see `run()`)
+        '''
+        digest = sha256()
+        response = self.client.get_object(self.bucket, object_name)
+        try:
+            for chunk in response.stream(storage_chunk_size):
+                digest.update(chunk)
+        finally:
+            response.close()
+            response.release_conn()
+        return digest.hexdigest()
+
+    async def sha256(self, object_name: str) -> str:
+        return await self.run(self.hash_object, object_name)
+
+    # multipart uploads, with the S3 API methods of the minio client
+
+    async def find_multipart_upload(self, object_name: str) -> Optional[str]:
+        '''
+        ID of the latest multipart upload in progress for `object_name`
+        '''
+        def list_all():
+            uploads, key_marker, upload_id_marker = [], None, None
+            while True:
+                result = self.client._list_multipart_uploads(self.bucket, prefix=object_name,
+                    key_marker=key_marker, upload_id_marker=upload_id_marker)
+                uploads += [u for u in result.uploads if u.object_name == object_name]
+                if not result.is_truncated:
+                    return uploads
+                key_marker, upload_id_marker = result.next_key_marker, result.next_upload_id_marker
+        uploads = await self.run(list_all)
+        if not uploads:
+            return None
+        return max(uploads, key=lambda u: u.initiated_time).upload_id
+
+    async def create_multipart_upload(self, object_name: str, metadata: dict = {}) -> str:
+        headers = {'Content-Type': 'application/octet-stream'}
+        headers.update({f'x-amz-meta-{key}': value for key, value in metadata.items()})
+        return await self.run(self.client._create_multipart_upload, self.bucket, object_name, headers)
+
+    async def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes, content_md5: Optional[str] = None) -> str:
+        headers = {'Content-MD5': content_md5} if content_md5 else None
+        return await self.run(self.client._upload_part, self.bucket, object_name, data, headers, upload_id, part_number)
+
+    async def list_parts(self, object_name: str, upload_id: str) -> List[Part]:
+        def list_all():
+            parts, marker = [], None
+            while True:
+                result = self.client._list_parts(self.bucket, object_name, upload_id, part_number_marker=marker)
+                parts += result.parts
+                if not result.is_truncated:
+                    return parts
+                marker = result.next_part_number_marker
+        return await self.run(list_all)
+
+    async def complete_multipart_upload(self, object_name: str, upload_id: str, parts: List[Part]):
+        return await self.run(self.client._complete_multipart_upload, self.bucket, object_name, upload_id, parts)
+
+    async def abort_multipart_upload(self, object_name: str, upload_id: str) -> None:
+        await self.run(self.client._abort_multipart_upload, self.bucket, object_name, upload_id)
+
+storage = ObjectStorage('storage', crd.minio)
+storage_scaled = ObjectStorage('scaled', crd.minio_scaled)   # scaled images
+storage_web = ObjectStorage('web', crd.minio_web)            # web content
+
+backends = [storage, storage_scaled, storage_web]
+
+async def check_buckets() -> None:
+    for backend in backends:
+        try:
+            if not await backend.bucket_exists():
+                print(f'Bucket {backend.bucket} does not exist.')
+        except Exception as e:
+            print(f'Bucket {backend.bucket} not accessible: {e}')
+
+# ------------------------------------------------------------------------------
+# HTTP RESPONSES
+# ------------------------------------------------------------------------------
+
+range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def parse_range(header: Optional[str]) -> Optional[str]:
+    '''
+    Normalized single byte range of a `Range` header, None if the header is
+    absent, invalid or requests multiple ranges (served as a full response).
+    '''
+    if not header:
+        return None
+    match = range_pattern.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if start and end and int(start) > int(end):
+        return None
+    return f'bytes={start}-{end}'
+
+def etag_matches(header: str, etag: str) -> bool:
+    '''
+    Check if a list of entity tags (`If-None-Match`, `If-Range`) contains
+    `etag`, compared weakly
+    '''
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/').strip('"') == etag for tag in tags)
+
+def not_modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    # dates with a zone of -0000 are parsed as naive, HTTP dates are in GMT
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+def is_not_modified(headers, stat: Object) -> bool:
+    '''
+    Check if a conditional request can be answered with 304,
+    `If-None-Match` takes precedence over `If-Modified-Since`
+    '''
+    if 'if-none-match' in headers:
+        return etag_matches(headers['if-none-match'], stat.etag)
+    if 'if-modified-since' in headers:
+        return not_modified_since(headers['if-modified-since'], stat.last_modified)
+    return False
+
+def validator_headers(stat: Object) -> dict:
+    return {
+        'ETag': f'"{stat.etag}"',
+        'Last-Modified': formatdate(stat.last_modified.timestamp(), usegmt=True),
+        'Accept-Ranges': 'bytes',
+    }
+
+async def object_response(request: Request, backend: ObjectStorage, object_name: str) -> Response:
+    '''
+    Respond with the object `object_name`, with support for conditional
+    requests (`If-None-Match`, `If-Modified-Since`, answered with 304 without
+    reading the object) and single byte ranges (`Range`, `If-Range`, answered
+    with 206, or 416 if not satisfiable).
+
+    Raises S3Error if the object does not exist.
+    '''
+    headers = request.headers
+    byte_range = parse_range(headers.get('range'))
+
+    if any(h in headers for h in ('if-none-match', 'if-modified-since', 'if-range')):
+        stat = await backend.stat(object_name)
+        if is_not_modified(headers, stat):
+            return Response(status_code=304, headers=validator_headers(stat))
+        if byte_range and 'if-range' in headers:
+            if_range = headers['if-range']
+            if if_range.startswith(('"', 'W/')):
+                # weak tags never match for ranges
+                unchanged = not if_range.startswith('W/') and if_range.strip('"') == stat.etag
+            else:
+                unchanged = not_modified_since(if_range, stat.last_modified)
+            if not unchanged:
+                byte_range = None
+
+    try:
+        response = await backend.get(object_name, request_headers={'Range': byte_range} if byte_range else None)
+    except S3Error as e:
+        if e.code != 'InvalidRange':
+            raise e
+        stat = await backend.stat(object_name)
+        raise HTTPException(status_code=416, detail='Range not satisfiable',
+            headers={'Content-Range': f'bytes */{stat.size}', **validator_headers(stat)})
+    return StreamingResponse(response.iter_chunks(), status_code=response.response.status, headers=response.headers)
+
+async def media_response(request: Request, backend: ObjectStorage, object_name: str, delivery: str) -> Response:
+    '''
+    Respond with the object `object_name`, as a redirect to a presigned url if
+    `delivery` is 'redirect', or through `object_response()`, also if the url
+    can't be signed. The object is looked up before redirecting, so that a
+    missing object raises `S3Error` 'NoSuchKey' either way.
+    '''
+    if delivery == 'redirect':
+        await backend.stat(object_name)
+        try:
+            url = await backend.presign(object_name)
+        except Exception as e:
+            print(f'presigning {object_name} failed: {e}')
+        else:
+            return RedirectResponse(url, status_code=307, headers={'Cache-Control': 'no-store'})
+    if media_cache.enabled and backend.name in media_cache_backends:
+        return await cached_object_response(request, backend, object_name)
+    return await object_response(request, backend, object_name)
+
+class OpenFileResponse(FileResponse):
+    '''
+    `FileResponse` of a file opened beforehand, which is sent even if the
+    file is unlinked in the meantime (i.e. evicted from the media cache)
+    '''
+
+    def __init__(self, file: BinaryIO, stat_result: os.stat_result, **kwargs) -> None:
+        super().__init__(file.name, stat_result=stat_result, **kwargs)
+        self.file = file
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+            more_body = not self.send_header_only
+            while more_body:
+                chunk = await anyio.to_thread.run_sync(self.file.read, self.chunk_size)
+                more_body = len(chunk) == self.chunk_size
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+            if self.send_header_only:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+async def cached_object_response(request: Request, backend: ObjectStorage, object_name: str) -> Response:
+    '''
+    Respond with the object `object_name` from the local media cache, filling
+    it on a miss. Range requests and objects too large for the cache are
+    answered by `object_response()`.
+
+    The stat of the object is cached for `media_stat_ttl` seconds, changes of
+    objects are served once it expired.
+
+    Raises S3Error if the object does not exist.
+    '''
+    stat = await media_stat_cache.get(backend.bucket, object_name, lambda: backend.stat(object_name))
+    if is_not_modified(request.headers, stat):
+        return Response(status_code=304, headers=validator_headers(stat))
+    if 'range' in request.headers:
+        return await object_response(request, backend, object_name)
+
+    key = media_cache.key(backend.bucket, object_name, stat.etag)
+    entry = media_cache.lookup(key)
+    if entry is None and await media_cache.fill(key, stat.size,
+            lambda file_path: backend.run(backend.download, object_name, file_path)):
+        entry = media_cache.open(key)
+    if entry is None:
+        return await object_response(request, backend, object_name)
+    file, stat_result = entry
+    return OpenFileResponse(file, stat_result, media_type=stat.content_type, headers=validator_headers(stat))
+
+async def derived_response(request: Request, object_name: str, media_type: str, render: Callable[[], Awaitable[bytes]]) -> Response:
+    '''
+    Respond with the derived object `object_name` cached in the scaled bucket,
+    or render, cache and return it if it doesn't exist yet. Failing to cache
+    the object is not an error.
+    '''
+    try:
+        return await object_response(request, storage_scaled, object_name)
+    except S3Error as e:
+        if e.code != 'NoSuchKey':
+            raise e
+    content = await render()
+    try:
+        await storage_scaled.put(object_name, io.BytesIO(content), length=len(content), content_type=media_type)
+    except Exception as e:
+        print(str(e))
+    return Response(content=content, media_type=media_type)
@@ -32,7 +32,9 @@ birdnet_results = sqlalchemy.Table(
     sqlalchemy.Column('time_start',   sqlalchemy.REAL       , nullable=False),
     sqlalchemy.Column('time_end',     sqlalchemy.REAL       , nullable=False),
     sqlalchemy.Column('confidence',   sqlalchemy.REAL       , nullable=False),
-    sqlalchemy.Column('species',      sqlalchemy.String(255), nullable=False)
+    sqlalchemy.Column('species',      sqlalchemy.String(255), nullable=False),
+    sqlalchemy.Column('deployment_id', sqlalchemy.Integer   , nullable=True),
+    sqlalchemy.Column('detection_time', sqlalchemy.TIMESTAMP(timezone=True), nullable=False)
 )
 
 birdnet_species = sqlalchemy.Table(
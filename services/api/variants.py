@@ -0,0 +1,148 @@
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from api.config import image_variants, supported_image_formats, thumbnail_size, variant_job_history, variant_queue_size, variant_workers
+from api.storage import ObjectStorage
+
+# ------------------------------------------------------------------------------
+# IMAGE VARIANTS
+# ------------------------------------------------------------------------------
+
+def get_variant_name(object_name: str, dimensions: Tuple[int, int], image_format: str) -> str:
+    '''
+    :param object_name: the name of the file including path and extension
+    :param dimensions: the maximum width and height of the variant
+    :param image_format: the extension of the variant
+    :return: standardized variant file name
+    '''
+    name = object_name.rsplit('.', 1)[0]
+    return f'{name}_{dimensions[0]}x{dimensions[1]}.{image_format}'
+
+def get_thumbnail_name(object_name: str, image_format: str) -> str:
+    return get_variant_name(object_name, thumbnail_size, image_format)
+
+def variant_specs(object_name: str, image_format: str) -> List[Tuple[str, Tuple[int, int], str]]:
+    '''
+    Name, dimensions and format of the thumbnail and the variants of an image
+    '''
+    specs = [(get_thumbnail_name(object_name, image_format), thumbnail_size, image_format)]
+    specs += [(get_variant_name(object_name, dimensions, f), dimensions, f) for dimensions, f in image_variants]
+    return specs
+
+def render_variants(content: bytes, specs: List[Tuple[str, Tuple[int, int], str]]) -> Dict[str, bytes]:
+    '''
+    Decode the image once and encode it scaled down to each of `specs`,
+    run in a worker process
+    '''
+    from PIL import Image
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    variants = {}
+    for name, dimensions, image_format in specs:
+        variant = image.copy()
+        variant.thumbnail(dimensions, Image.Resampling.LANCZOS)
+        pil_format = Image.registered_extensions().get(f'.{image_format}', image_format.upper())
+        if pil_format == 'JPEG' and variant.mode not in ('RGB', 'L'):
+            variant = variant.convert('RGB')
+        buffer = io.BytesIO()
+        variant.save(buffer, format=pil_format)
+        variants[name] = buffer.getvalue()
+    return variants
+
+class VariantJobs:
+    '''
+    Queue of at most `queue_size` images to render variants of, processed by
+    `variant_workers` tasks, each rendering in a process of a shared pool.
+
+    The status of the last `variant_job_history` jobs is kept per API
+    process, older or unknown jobs are reported by the existence of their
+    variants in storage. Jobs lost to a restart of the API, or not queued
+    because the queue was full, are submitted again when their status is
+    requested and their variants are missing.
+    '''
+
+    def __init__(self, workers: int = variant_workers, history: int = variant_job_history, queue_size: int = variant_queue_size) -> None:
+        self.workers = workers
+        self.history = history
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs: OrderedDict[str, dict] = OrderedDict()
+        self.tasks: List[asyncio.Task] = []
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    async def start(self) -> None:
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def set_status(self, object_name: str, status: str, **fields) -> dict:
+        job = self.jobs.pop(object_name, {'object_name': object_name, 'created_at': datetime.now(timezone.utc)})
+        job.update(status=status, updated_at=datetime.now(timezone.utc), **fields)
+        self.jobs[object_name] = job
+        while len(self.jobs) > self.history:
+            self.jobs.popitem(last=False)
+        return job
+
+    def submit(self, backend: ObjectStorage, object_name: str, image_format: str) -> dict:
+        '''
+        Queue rendering the variants of `object_name`.
+
+        Raises asyncio.QueueFull if the queue is full, the job is not recorded.
+        '''
+        specs = variant_specs(object_name, image_format)
+        self.queue.put_nowait((backend, object_name, specs))
+        return self.set_status(object_name, 'queued', variants=[name for name, _, _ in specs], error=None)
+
+    async def work(self) -> None:
+        while True:
+            backend, object_name, specs = await self.queue.get()
+            try:
+                self.set_status(object_name, 'running')
+                content = await (await backend.get(object_name)).read()
+                variants = await asyncio.get_running_loop().run_in_executor(self.pool, render_variants, content, specs)
+                for name, data in variants.items():
+                    await backend.put(name, io.BytesIO(data), length=len(data))
+            except Exception as e:
+                print(f'rendering variants of {object_name} failed: {e}')
+                self.set_status(object_name, 'failed', error=str(e))
+            else:
+                self.set_status(object_name, 'done')
+            finally:
+                self.queue.task_done()
+
+    async def status(self, backend: ObjectStorage, object_name: str) -> Optional[dict]:
+        '''
+        Status of the job of `object_name`. If the job is unknown and the
+        variants (other than the thumbnail) don't exist, it is submitted again
+        if the image exists, None is returned otherwise.
+
+        Raises asyncio.QueueFull if the job can't be submitted.
+        '''
+        if object_name in self.jobs:
+            return self.jobs[object_name]
+        names = [get_variant_name(object_name, dimensions, f) for dimensions, f in image_variants]
+        try:
+            for name in names:
+                await backend.stat(name)
+        except Exception:
+            pass
+        else:
+            return {'object_name': object_name, 'status': 'done', 'variants': names, 'error': None}
+        try:
+            stat = await backend.stat(object_name)
+        except Exception:
+            return None
+        image_format = supported_image_formats.get(stat.content_type)
+        if image_format is None:
+            return None
+        return self.submit(backend, object_name, image_format)
+
+variant_jobs = VariantJobs()
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# the api package is imported from services/, as when running uvicorn, with
+# the credentials of the tests instead of ../credentials.py
+tests = Path(__file__).resolve().parent
+sys.path[:0] = [str(tests), str(tests.parent)]
+
+class FakeDatabase:
+    '''
+    Answers every query with `rows`, counting the queries, and fingerprint
+    queries with a hash of the rows
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+        self.fingerprints = 0
+
+    async def fetch_all(self, query, values=None):
+        self.queries += 1
+        return self.rows
+
+    async def fetch_one(self, query, values=None):
+        self.fingerprints += 1
+        return SimpleNamespace(_mapping={'count': len(self.rows), 'hash': hash(repr(self.rows))})
+
+@pytest.fixture
+def fake_database(monkeypatch):
+    '''
+    Replace the `database` of a module by a `FakeDatabase` of `rows`
+    '''
+    def install(module, rows):
+        database = FakeDatabase(rows)
+        monkeypatch.setattr(module, 'database', database)
+        return database
+    return install
@@ -0,0 +1,48 @@
+# credentials for the tests, which don't connect to any of the services
+
+class DbConfig(object):
+    host = 'localhost'
+    port = 5432
+    database = 'db'
+    schema = 'public'
+    user = 'postgres'
+    password = 'secret'
+    replica_host = None
+
+class CacheDbConfig(DbConfig):
+    pass
+
+class BasicAuth(object):
+    url = 'http://localhost:8080'
+    username = 'username'
+    password = 'password'
+
+class OidcConfig(object):
+    KC_SERVER_URL = 'https://identityprovider.tld/auth/'
+    KC_CLIENT_ID = 'client_id'
+    KC_REALM_NAME = 'realm'
+    KC_CLIENT_SECRET = 'secret'
+
+class MinioConfig(object):
+    host = 'localhost:9000'
+    bucket = 'storage'
+    access_key = 'access_key'
+    secret_key = 'secret_key'
+    public_host = None
+    region = None
+
+class MinioConfigScaled(MinioConfig):
+    bucket = 'scaled'
+
+class MinioConfigWeb(MinioConfig):
+    bucket = 'web'
+
+db = DbConfig()
+db_cache = CacheDbConfig()
+ba = BasicAuth()
+oidc = OidcConfig()
+minio = MinioConfig()
+minio_scaled = MinioConfigScaled()
+minio_web = MinioConfigWeb()
+
+DEV = False
@@ -0,0 +1,100 @@
+import asyncio
+import struct
+
+import pytest
+
+from api import audio
+from api.audio import KSDATAFORMAT_SUFFIX, WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_PCM, read_wav_format, read_window
+
+class Backend:
+    '''
+    Ranged reads of an object held in memory, counting the reads
+    '''
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.reads = 0
+
+    async def get(self, object_name, offset=0, length=0):
+        self.reads += 1
+        data = self.data[offset:offset + length]
+        class Response:
+            async def read(self):
+                return data
+        return Response()
+
+def fmt_chunk(format_tag=WAVE_FORMAT_PCM, channels=1, sample_rate=48000, bits=16, sub_format=None, suffix=KSDATAFORMAT_SUFFIX):
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', format_tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    if sub_format is not None:
+        fmt += struct.pack('<HHI', 22, bits, 4) + struct.pack('<H', sub_format) + suffix
+    return b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+
+def chunk(chunk_id: bytes, data: bytes, size=None):
+    padding = b'\0' if len(data) & 1 else b''
+    return chunk_id + struct.pack('<I', len(data) if size is None else size) + data + padding
+
+def wav(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def read_format(data: bytes, backend=None):
+    return asyncio.run(read_wav_format(backend or Backend(data), 'x.wav', len(data)))
+
+def test_pcm():
+    data = wav(fmt_chunk(channels=2), chunk(b'data', b'\1\2' * 200))
+    f = read_format(data)
+    assert (f.format_tag, f.channels, f.sample_rate, f.block_align, f.bits_per_sample) == (WAVE_FORMAT_PCM, 2, 48000, 4, 16)
+    assert (f.data_offset, f.data_size, f.frames) == (44, 400, 100)
+
+def test_chunks_before_data():
+    # odd sized chunks are padded
+    data = wav(chunk(b'LIST', b'abc'), fmt_chunk(), chunk(b'junk', b'\0' * 1001), chunk(b'data', b'\0' * 10))
+    f = read_format(data)
+    assert f.data_offset == len(data) - 10
+    assert f.data_size == 10
+
+def test_chunks_beyond_header(monkeypatch):
+    monkeypatch.setattr(audio, 'wav_header_size', 64)
+    backend = Backend(wav(fmt_chunk(), chunk(b'junk', b'\0' * 1000), chunk(b'data', b'\0' * 10)))
+    f = read_format(backend.data, backend)
+    assert f.data_size == 10
+    assert backend.reads == 2
+
+def test_unfinished_data_size():
+    data = wav(fmt_chunk(), chunk(b'data', b'\0' * 10, size=0))
+    assert read_format(data).data_size == 10
+    data = wav(fmt_chunk(), chunk(b'data', b'\0' * 10, size=1000))
+    assert read_format(data).data_size == 10
+
+def test_extensible_pcm():
+    data = wav(fmt_chunk(WAVE_FORMAT_EXTENSIBLE, sub_format=WAVE_FORMAT_PCM), chunk(b'data', b'\0' * 10))
+    f = read_format(data)
+    assert f.format_tag == WAVE_FORMAT_PCM
+    wav_format, samples = asyncio.run(read_window(Backend(data), 'x.wav', len(data), 0, 1))
+    assert samples == b'\0' * 10
+
+def test_extensible_float_rejected():
+    data = wav(fmt_chunk(WAVE_FORMAT_EXTENSIBLE, bits=32, sub_format=3), chunk(b'data', b'\0' * 8))
+    assert read_format(data).format_tag == 3
+    with pytest.raises(ValueError):
+        asyncio.run(read_window(Backend(data), 'x.wav', len(data), 0, 1))
+
+def test_extensible_unknown_sub_format():
+    data = wav(fmt_chunk(WAVE_FORMAT_EXTENSIBLE, sub_format=WAVE_FORMAT_PCM, suffix=b'\xff' * 14), chunk(b'data', b'\0' * 10))
+    with pytest.raises(ValueError, match='SubFormat'):
+        read_format(data)
+
+def test_extensible_truncated():
+    data = wav(fmt_chunk(WAVE_FORMAT_EXTENSIBLE), chunk(b'data', b'\0' * 10))
+    with pytest.raises(ValueError, match='truncated'):
+        read_format(data)
+
+@pytest.mark.parametrize('data', [
+    b'RIFF\0\0\0\0AVI LIST',
+    wav(fmt_chunk()),
+    wav(chunk(b'data', b'\0' * 10), fmt_chunk()),
+])
+def test_invalid(data):
+    with pytest.raises(ValueError):
+        read_format(data)
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import timedelta
+from time import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from api import dependencies
+from api.dependencies import TokenVerifier, parse_bucket_width
+
+@pytest.fixture(scope='module')
+def signing_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    public_key = jwk.construct(public_pem, 'RS256').to_dict()
+    public_key.update(kid='key-1', use='sig', alg='RS256')
+    return pem, public_key
+
+@pytest.fixture
+def certs(monkeypatch, signing_key):
+    '''
+    The JWKS of keycloak, counting the requests
+    '''
+    jwks = {'keys': [signing_key[1]]}
+    def get_certs():
+        jwks['fetches'] = jwks.get('fetches', 0) + 1
+        return jwks
+    monkeypatch.setattr(dependencies.keycloak_openid, 'certs', get_certs)
+    return jwks
+
+def token(signing_key, sub='user', expires_in=60, kid='key-1'):
+    claims = {'sub': sub, 'exp': int(time()) + expires_in, 'realm_access': {'roles': ['public']}}
+    return jwt.encode(claims, signing_key[0], algorithm='RS256', headers={'kid': kid})
+
+def test_verify(certs, signing_key):
+    verifier = TokenVerifier()
+    claims = asyncio.run(verifier.verify(token(signing_key)))
+    assert claims['sub'] == 'user'
+    assert claims['realm_access']['roles'] == ['public']
+    # the keys are fetched for the first token
+    assert certs['fetches'] == 1
+
+def test_verify_cached(certs, signing_key, monkeypatch):
+    verifier = TokenVerifier()
+    t = token(signing_key)
+    claims = asyncio.run(verifier.verify(t))
+    monkeypatch.setattr(dependencies.jwt, 'decode', None)
+    assert asyncio.run(verifier.verify(t)) == claims
+
+def test_verify_cache_size(certs, signing_key):
+    verifier = TokenVerifier(cache_size=2)
+    for sub in ('a', 'b', 'c'):
+        asyncio.run(verifier.verify(token(signing_key, sub)))
+    assert [claims['sub'] for _, claims in verifier.tokens.values()] == ['b', 'c']
+
+def test_verify_expired(certs, signing_key):
+    verifier = TokenVerifier()
+    with pytest.raises(ExpiredSignatureError):
+        asyncio.run(verifier.verify(token(signing_key, expires_in=-10)))
+
+def test_verify_expired_in_cache(certs, signing_key, monkeypatch):
+    verifier = TokenVerifier()
+    t = token(signing_key, expires_in=1)
+    asyncio.run(verifier.verify(t))
+    # once expired, the token is verified again (and rejected) instead of served from the cache
+    monkeypatch.setattr(dependencies, 'time', lambda: time() + 120)
+    def decode(*args, **kwargs):
+        raise ExpiredSignatureError('Signature has expired.')
+    monkeypatch.setattr(dependencies.jwt, 'decode', decode)
+    with pytest.raises(ExpiredSignatureError):
+        asyncio.run(verifier.verify(t))
+    assert not verifier.tokens
+
+def test_verify_invalid_signature(certs, signing_key):
+    verifier = TokenVerifier()
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    with pytest.raises(JWTError):
+        asyncio.run(verifier.verify(token((other_key, None))))
+
+def test_verify_unknown_key(certs, signing_key):
+    verifier = TokenVerifier(refresh_interval=60)
+    asyncio.run(verifier.verify(token(signing_key)))
+    # unknown keys are fetched at most every refresh_interval
+    for _ in range(2):
+        with pytest.raises(JWTError):
+            asyncio.run(verifier.verify(token(signing_key, kid='key-2')))
+    assert certs['fetches'] == 1
+
+def test_verify_rotated_key(certs, signing_key):
+    verifier = TokenVerifier(refresh_interval=0)
+    asyncio.run(verifier.verify(token(signing_key)))
+    certs['keys'] = [{**signing_key[1], 'kid': 'key-2'}]
+    assert asyncio.run(verifier.verify(token(signing_key, kid='key-2')))['sub'] == 'user'
+    assert certs['fetches'] == 2
+
+@pytest.mark.parametrize('value, width', [
+    ('1d', timedelta(days=1)),
+    ('6h', timedelta(hours=6)),
+    ('1h 30min', timedelta(hours=1, minutes=30)),
+    ('1h30m', timedelta(hours=1, minutes=30)),
+    ('2W', timedelta(weeks=2)),
+    ('15T', timedelta(minutes=15)),
+    ('1.5H', timedelta(hours=1, minutes=30)),
+    ('500ms', timedelta(milliseconds=500)),
+    (' 10 seconds ', timedelta(seconds=10)),
+    ('01:30:00', timedelta(hours=1, minutes=30)),
+    ('24:00:00.5', timedelta(days=1, milliseconds=500)),
+])
+def test_parse_bucket_width(value, width):
+    assert parse_bucket_width(value) == width
+
+@pytest.mark.parametrize('value', [
+    '', '0d', '1', 'd', '1x', '1 day and 1 hour', '1:30',
+    # months in pandas
+    '1M',
+    # too large for a timedelta
+    '99999999999d', '99999999999999999999:00:00', '1' + '0' * 400 + 's',
+])
+def test_parse_bucket_width_invalid(value):
+    with pytest.raises(HTTPException) as e:
+        parse_bucket_width(value)
+    assert e.value.status_code == 422
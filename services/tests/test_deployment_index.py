@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from api import indexes
+from api.indexes import DeploymentIndex
+
+utc = timezone.utc
+
+def deployment(deployment_id, node_label, start, end, start_inc=True, end_inc=False, serial_number=None):
+    return {'deployment_id': deployment_id, 'node_label': node_label, 'serial_number': serial_number,
+        'period_start': start, 'period_end': end, 'start_inc': start_inc, 'end_inc': end_inc}
+
+@pytest.fixture
+def deployments(fake_database):
+    return fake_database(indexes, [
+        deployment(1, '1234-5678', datetime(2022, 1, 1, tzinfo=utc), datetime(2022, 6, 1, tzinfo=utc), serial_number='eui-1'),
+        deployment(2, '1234-5678', datetime(2022, 6, 1, tzinfo=utc), None, serial_number='eui-1'),
+        deployment(3, '4321-8765', None, datetime(2022, 3, 1, tzinfo=utc), end_inc=True),
+        deployment(4, '4321-8765', datetime(2022, 3, 1, tzinfo=utc), datetime(2022, 4, 1, tzinfo=utc), start_inc=False),
+    ])
+
+def test_deployment_by_label(deployments):
+    index = DeploymentIndex()
+    lookup = lambda time: asyncio.run(index.deployment_id(time, node_label='1234-5678'))
+    assert lookup(datetime(2021, 12, 31, tzinfo=utc)) is None
+    assert lookup(datetime(2022, 1, 1, tzinfo=utc)) == 1
+    assert lookup(datetime(2022, 5, 31, 23, 59, tzinfo=utc)) == 1
+    assert lookup(datetime(2022, 6, 1, tzinfo=utc)) == 2
+    assert lookup(datetime(2030, 1, 1, tzinfo=utc)) == 2
+
+def test_deployment_by_serial_number(deployments):
+    index = DeploymentIndex()
+    assert asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc), serial_number='eui-1')) == 1
+    assert asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc), serial_number='eui-2')) is None
+    assert asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc))) is None
+
+def test_deployment_bounds(deployments):
+    index = DeploymentIndex()
+    lookup = lambda time: asyncio.run(index.deployment_id(time, node_label='4321-8765'))
+    # unbounded start
+    assert lookup(datetime(2000, 1, 1, tzinfo=utc)) == 3
+    # inclusive end of 3 at the exclusive start of 4
+    assert lookup(datetime(2022, 3, 1, tzinfo=utc)) == 3
+    assert lookup(datetime(2022, 3, 15, tzinfo=utc)) == 4
+    assert lookup(datetime(2022, 4, 1, tzinfo=utc)) is None
+
+def test_deployment_naive_time(deployments):
+    index = DeploymentIndex()
+    assert asyncio.run(index.deployment_id(datetime(2022, 6, 1), node_label='1234-5678')) == 2
+
+def test_deployment_reload(deployments):
+    index = DeploymentIndex()
+    index.set_listening(True)
+    lookup = lambda: asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc), node_label='1234-5678'))
+    assert lookup() == 1
+    assert lookup() == 1
+    assert deployments.queries == 1
+    deployments.rows = [deployment(5, '1234-5678', datetime(2022, 1, 1, tzinfo=utc), None)]
+    index.invalidate()
+    assert lookup() == 5
+    assert deployments.queries == 2
+
+def test_deployment_verify(deployments):
+    # changes are found by the fingerprint while listening, if notifications are lost
+    index = DeploymentIndex(verify_interval=0)
+    index.set_listening(True)
+    lookup = lambda: asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc), node_label='1234-5678'))
+    assert lookup() == 1
+    assert lookup() == 1
+    assert (deployments.queries, deployments.fingerprints) == (1, 2)
+    deployments.rows = [deployment(5, '1234-5678', datetime(2022, 1, 1, tzinfo=utc), None)]
+    assert lookup() == 5
+    assert deployments.queries == 2
+
+def test_deployment_poll(deployments):
+    index = DeploymentIndex(refresh_interval=0, verify_interval=600)
+    lookup = lambda: asyncio.run(index.deployment_id(datetime(2022, 2, 1, tzinfo=utc), node_label='1234-5678'))
+    assert lookup() == 1
+    deployments.rows = [deployment(5, '1234-5678', datetime(2022, 1, 1, tzinfo=utc), None)]
+    assert lookup() == 5
+    index.set_listening(True)
+    deployments.rows = []
+    assert lookup() == 5
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException, Request
+
+from api.routers import ingest
+
+batch = json.dumps([{'time': '2022-08-01T12:00:00Z', 'node_label': '1234-5678', 'pax': 1, 'voltage': 4.1}] * 10).encode()
+
+def post(path, chunks, headers):
+    '''
+    Call the handler of the ingest route `path` with a body of `chunks`,
+    returns the number of chunks received
+    '''
+    route = next(r for r in ingest.router.routes if r.path == path)
+    messages = [{'type': 'http.request', 'body': c, 'more_body': i < len(chunks) - 1} for i, c in enumerate(chunks)]
+    received = []
+    async def receive():
+        received.append(messages[len(received)])
+        return received[-1]
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'',
+        'headers': [(k.encode(), v.encode()) for k, v in headers.items()]}
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(route.get_route_handler()(Request(scope, receive)))
+    assert e.value.status_code == 413
+    return len(received)
+
+def test_body_too_large(monkeypatch):
+    monkeypatch.setattr(ingest, 'ingest_max_body_size', 100)
+    headers = {'content-type': 'application/json', 'content-length': str(len(batch))}
+    assert post('/ingest/pax/batch', [batch], headers) == 0
+
+def test_chunked_body_too_large(monkeypatch):
+    monkeypatch.setattr(ingest, 'ingest_max_body_size', 100)
+    chunks = [batch[i:i + 50] for i in range(0, len(batch), 50)]
+    assert post('/ingest/env/batch', chunks, {'content-type': 'application/json'}) == 3
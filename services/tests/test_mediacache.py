@@ -0,0 +1,111 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from api import storage
+from api.mediacache import DiskCache, StatCache
+
+data = os.urandom(200000)
+
+class Backend:
+    '''
+    Storage of a single object, counting the requests
+    '''
+    name = 'scaled'
+    bucket = 'scaled'
+
+    def __init__(self):
+        self.stats = 0
+        self.downloads = 0
+
+    async def stat(self, object_name):
+        self.stats += 1
+        return SimpleNamespace(etag='etag', size=len(data), content_type='image/webp',
+            last_modified=datetime(2022, 8, 1, tzinfo=timezone.utc))
+
+    async def run(self, fn, *args):
+        return fn(*args)
+
+    def download(self, object_name, file_path):
+        self.downloads += 1
+        with open(file_path, 'wb') as f:
+            f.write(data)
+
+def send(response) -> bytes:
+    messages = []
+    async def receive():
+        return {'type': 'http.request'}
+    async def collect(message):
+        messages.append(message)
+    asyncio.run(response({'type': 'http'}, receive, collect))
+    assert messages[0]['status'] == 200
+    return b''.join(m.get('body', b'') for m in messages[1:])
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = DiskCache(str(tmp_path), 10**6, 10**6)
+    monkeypatch.setattr(storage, 'media_cache', cache)
+    monkeypatch.setattr(storage, 'media_stat_cache', StatCache(60, 100))
+    return cache
+
+def request():
+    return SimpleNamespace(headers={})
+
+def test_restore(tmp_path):
+    (tmp_path / 'a').write_bytes(b'1' * 10)
+    (tmp_path / 'b.part').write_bytes(b'1' * 10)
+    cache = DiskCache(str(tmp_path), 100, 100)
+    # not indexed until restored on startup
+    assert not cache.entries
+    assert (tmp_path / 'b.part').exists()
+    cache.restore()
+    assert list(cache.entries) == ['a']
+    assert cache.size == 10
+    assert not (tmp_path / 'b.part').exists()
+
+def test_hit(cache):
+    backend = Backend()
+    assert send(asyncio.run(storage.cached_object_response(request(), backend, 'x.webp'))) == data
+    assert send(asyncio.run(storage.cached_object_response(request(), backend, 'x.webp'))) == data
+    assert (cache.misses, cache.hits, backend.downloads) == (1, 1, 1)
+    # the stat is cached as well
+    assert backend.stats == 1
+
+def test_evicted_after_lookup(cache):
+    backend = Backend()
+    send(asyncio.run(storage.cached_object_response(request(), backend, 'x.webp')))
+    response = asyncio.run(storage.cached_object_response(request(), backend, 'x.webp'))
+    cache.max_size = 0
+    cache.evict()
+    assert not os.listdir(cache.directory)
+    assert send(response) == data
+
+def test_missing_file(cache):
+    backend = Backend()
+    send(asyncio.run(storage.cached_object_response(request(), backend, 'x.webp')))
+    for name in os.listdir(cache.directory):
+        os.unlink(os.path.join(cache.directory, name))
+    assert cache.lookup(cache.key('scaled', 'x.webp', 'etag')) is None
+    assert (len(cache.entries), cache.size) == (0, 0)
+
+def test_stat_cache_ttl():
+    calls = []
+    async def stat():
+        calls.append(1)
+        return len(calls)
+    stats = StatCache(60, 2)
+    assert asyncio.run(stats.get('bucket', 'a', stat)) == 1
+    assert asyncio.run(stats.get('bucket', 'a', stat)) == 1
+    stats.ttl = 0
+    assert asyncio.run(stats.get('bucket', 'a', stat)) == 2
+
+def test_stat_cache_size():
+    async def stat():
+        return 'stat'
+    stats = StatCache(60, 2)
+    for name in 'abc':
+        asyncio.run(stats.get('bucket', name, stat))
+    assert list(stats.entries) == [('bucket', 'b'), ('bucket', 'c')]
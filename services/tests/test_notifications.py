@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from api import notifications
+from api.notifications import NotificationListener
+
+class Connection:
+    '''
+    asyncpg connection to a database with notification triggers on `tables`
+    '''
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.listening = False
+        self.closed = False
+
+    async def fetch(self, query, *args):
+        return [{'relname': table} for table in self.tables]
+
+    async def add_listener(self, channel, callback):
+        self.listening = True
+
+    def add_termination_listener(self, callback):
+        pass
+
+    async def close(self):
+        self.closed = True
+
+@pytest.fixture
+def connections(monkeypatch):
+    connections = []
+    async def connect(**kwargs):
+        connection = Connection(connections[0])
+        connections.append(connection)
+        return connection
+    monkeypatch.setattr(notifications.asyncpg, 'connect', connect)
+    return connections
+
+def listener_of(tables):
+    listener = NotificationListener(retry_delay=0.01)
+    states = []
+    listener.on_state(states.append)
+    for table in tables:
+        listener.register(table, lambda: None)
+    return listener, states
+
+def test_listen(connections):
+    connections.append(['deployments', 'nodes', 'storage_whitelist'])
+    listener, states = listener_of(['deployments', 'nodes'])
+    asyncio.run(listener.connect())
+    assert states == [True]
+    assert connections[1].listening
+
+def test_missing_triggers(connections):
+    # connects again until the triggers are installed, not listening meanwhile
+    connections.append(['deployments'])
+    listener, states = listener_of(['deployments', 'storage_whitelist'])
+    async def connect():
+        task = asyncio.create_task(listener.connect())
+        await asyncio.sleep(0.05)
+        assert states == []
+        assert all(c.closed and not c.listening for c in connections[1:])
+        connections[0].append('storage_whitelist')
+        await asyncio.wait_for(task, 1)
+    asyncio.run(connect())
+    assert states == [True]
+    assert connections[-1].listening
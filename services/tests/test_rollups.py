@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+from api.rollups import confidence_band, covers_rollup, meteodata_rollups, rollup_bounds, select_rollup
+
+utc = timezone.utc
+
+def test_covers_rollup():
+    assert covers_rollup(timedelta(hours=1))
+    assert covers_rollup(timedelta(hours=6))
+    assert covers_rollup(timedelta(days=7))
+    assert not covers_rollup(timedelta(minutes=30))
+    assert not covers_rollup(timedelta(minutes=90))
+    assert covers_rollup(timedelta(minutes=30), timedelta(minutes=10))
+
+def test_rollup_bounds_aligned():
+    time_from = datetime(2022, 8, 1, tzinfo=utc)
+    time_to = datetime(2022, 8, 31, 23, 59, 59, 999000, tzinfo=utc)
+    assert rollup_bounds(time_from, time_to) == (time_from, datetime(2022, 9, 1, tzinfo=utc))
+    assert rollup_bounds(time_from, None) == (time_from, None)
+    assert rollup_bounds(None, None) == (None, None)
+
+def test_rollup_bounds_end_on_boundary():
+    # the inclusive end would include the first instant of the next bucket
+    assert rollup_bounds(datetime(2022, 8, 1, tzinfo=utc), datetime(2022, 9, 1, tzinfo=utc)) is None
+
+def test_rollup_bounds_unaligned():
+    assert rollup_bounds(datetime(2022, 8, 1, 0, 30, tzinfo=utc), None) is None
+    assert rollup_bounds(None, datetime(2022, 8, 1, 0, 30, tzinfo=utc)) is None
+    assert rollup_bounds(None, datetime(2022, 8, 31, 23, 59, 59, tzinfo=utc)) is None
+
+def test_rollup_bounds_naive():
+    assert rollup_bounds(datetime(2022, 8, 1), datetime(2022, 8, 1, 23, 59, 59, 999000)) == (datetime(2022, 8, 1), datetime(2022, 8, 2))
+
+def test_rollup_bounds_width():
+    # days are aligned to midnight UTC
+    time_from = datetime(2022, 8, 1, tzinfo=utc)
+    assert rollup_bounds(time_from, None, timedelta(days=1)) == (time_from, None)
+    assert rollup_bounds(datetime(2022, 8, 1, 1, tzinfo=utc), None, timedelta(days=1)) is None
+
+def test_confidence_band():
+    assert confidence_band(0) == 0
+    assert confidence_band(0.5) == 50
+    assert confidence_band(0.07) == 7
+    assert confidence_band(1) == 100
+    assert confidence_band(0.505) is None
+
+def test_select_rollup_coarsest():
+    time_from = datetime(2022, 8, 1, tzinfo=utc)
+    time_to = datetime(2022, 8, 31, 23, 59, 59, 999000, tzinfo=utc)
+    end = datetime(2022, 9, 1, tzinfo=utc)
+    assert select_rollup(timedelta(days=1), time_from, time_to) == ('1d', (time_from, end))
+    assert select_rollup(timedelta(hours=2), time_from, time_to) == ('1h', (time_from, end))
+    assert select_rollup(timedelta(minutes=30), time_from, time_to) == ('10m', (time_from, end))
+
+def test_select_rollup_by_bounds():
+    # daily buckets of a range starting at 10:20 are composed of 10 minute buckets only
+    time_from = datetime(2022, 8, 1, 10, 20, tzinfo=utc)
+    assert select_rollup(timedelta(days=1), time_from, None) == ('10m', (time_from, None))
+
+def test_select_rollup_none():
+    assert select_rollup(timedelta(minutes=5), None, None) is None
+    assert select_rollup(timedelta(days=1), datetime(2022, 8, 1, 0, 5, tzinfo=utc), None) is None
+    assert select_rollup(timedelta(hours=1), None, None, meteodata_rollups) is None
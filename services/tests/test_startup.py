@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+tests = Path(__file__).resolve().parent
+
+# seconds for importing api.main in a fresh interpreter, about 1.3s locally.
+# loading pandas and numpy alone took longer than that
+import_time_budget = 4
+
+# imported where they are used, not by importing the app
+deferred_modules = ['pandas', 'numpy', 'PIL', 'astral', 'simplekml']
+
+# imports the app with any network access failing, reports the modules
+# loaded, the import time and the addresses that were connected to
+script = '''
+import json, socket, sys, time
+
+connections = []
+def blocked(name):
+    def connect(*args, **kwargs):
+        connections.append(f'{name} {args[1:] if name.startswith("socket.") else args}')
+        raise OSError('network access while importing')
+    return connect
+socket.socket.connect = blocked('socket.connect')
+socket.socket.connect_ex = blocked('socket.connect_ex')
+socket.getaddrinfo = blocked('getaddrinfo')
+socket.create_connection = blocked('create_connection')
+
+start = time.perf_counter()
+import api.main
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules), 'connections': connections}))
+'''
+
+def import_app() -> dict:
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([str(tests), str(tests.parent)])}
+    result = subprocess.run([sys.executable, '-c', script], cwd=tests.parent, env=env,
+        capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_import():
+    result = import_app()
+    assert result['connections'] == []
+    assert [m for m in deferred_modules if m in result['modules']] == []
+    assert result['elapsed'] < import_time_budget
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from api.storage import ObjectStorage, etag_matches, is_not_modified, not_modified_since, parse_range
+
+def test_parse_range():
+    assert parse_range('bytes=0-99') == 'bytes=0-99'
+    assert parse_range(' bytes=100- ') == 'bytes=100-'
+    assert parse_range('bytes=-500') == 'bytes=-500'
+    assert parse_range('bytes=5-5') == 'bytes=5-5'
+
+def test_parse_range_ignored():
+    assert parse_range(None) is None
+    assert parse_range('') is None
+    assert parse_range('bytes=-') is None
+    assert parse_range('bytes=100-99') is None
+    assert parse_range('bytes=0-99,200-299') is None
+    assert parse_range('items=0-99') is None
+
+def test_etag_matches():
+    assert etag_matches('"abc"', 'abc')
+    assert etag_matches('W/"abc"', 'abc')
+    assert etag_matches('"xyz", "abc"', 'abc')
+    assert etag_matches('*', 'abc')
+    assert not etag_matches('"xyz"', 'abc')
+    assert not etag_matches('"abcd"', 'abc')
+
+def test_not_modified_since():
+    last_modified = datetime(2022, 8, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    assert not_modified_since('Mon, 01 Aug 2022 12:00:00 GMT', last_modified)
+    assert not_modified_since('Tue, 02 Aug 2022 12:00:00 GMT', last_modified)
+    assert not not_modified_since('Mon, 01 Aug 2022 11:59:59 GMT', last_modified)
+    assert not not_modified_since('yesterday', last_modified)
+
+def test_not_modified_since_naive():
+    # zones of -0000 parse to naive dates
+    assert not_modified_since('Mon, 01 Aug 2022 12:00:00 -0000', datetime(2022, 8, 1, 12, tzinfo=timezone.utc))
+    assert not_modified_since('Mon, 01 Aug 2022 12:00:00 GMT', datetime(2022, 8, 1, 12))
+
+def test_is_not_modified():
+    stat = SimpleNamespace(etag='abc', last_modified=datetime(2022, 8, 1, 12, tzinfo=timezone.utc))
+    assert is_not_modified({'if-none-match': '"abc"'}, stat)
+    # If-None-Match takes precedence
+    assert not is_not_modified({'if-none-match': '"xyz"', 'if-modified-since': 'Tue, 02 Aug 2022 12:00:00 GMT'}, stat)
+    assert is_not_modified({'if-modified-since': 'Tue, 02 Aug 2022 12:00:00 GMT'}, stat)
+    assert not is_not_modified({}, stat)
+
+def test_presign_public_host(monkeypatch):
+    config = SimpleNamespace(host='minio:9000', bucket='bucket', access_key='access_key', secret_key='secret_key',
+        public_host='files.example.org')
+    backend = ObjectStorage('test', config)
+    regions = []
+    def get_region(bucket, region):
+        regions.append(bucket)
+        return 'eu-central-1'
+    monkeypatch.setattr(backend.client, '_get_region', get_region)
+    url = asyncio.run(backend.presign('a/b.webp'))
+    url = asyncio.run(backend.presign('a/c.webp'))
+    assert url.startswith('https://files.example.org/bucket/a/c.webp?')
+    assert 'eu-central-1' in url
+    # looked up once, on the internal host
+    assert regions == ['bucket']
+
+def test_presign_configured_region():
+    config = SimpleNamespace(host='minio:9000', bucket='bucket', access_key='access_key', secret_key='secret_key',
+        public_host='files.example.org', region='us-west-1')
+    url = asyncio.run(ObjectStorage('test', config).presign('a/b.webp'))
+    assert url.startswith('https://files.example.org/bucket/a/b.webp?')
+    assert 'us-west-1' in url
+
+def test_find_multipart_upload_pages(monkeypatch):
+    config = SimpleNamespace(host='minio:9000', bucket='bucket', access_key='access_key', secret_key='secret_key')
+    backend = ObjectStorage('test', config)
+    def upload(object_name, upload_id, hour):
+        return SimpleNamespace(object_name=object_name, upload_id=upload_id,
+            initiated_time=datetime(2022, 8, 1, hour, tzinfo=timezone.utc))
+    pages = {
+        (None, None): SimpleNamespace(is_truncated=True, next_key_marker='a.wav', next_upload_id_marker='1',
+            uploads=[upload('a.wav', '1', 10), upload('a.wav.bak', '2', 14)]),
+        ('a.wav', '1'): SimpleNamespace(is_truncated=False,
+            uploads=[upload('a.wav', '3', 12)]),
+    }
+    def list_uploads(bucket, prefix=None, key_marker=None, upload_id_marker=None):
+        return pages[(key_marker, upload_id_marker)]
+    monkeypatch.setattr(backend.client, '_list_multipart_uploads', list_uploads)
+    assert asyncio.run(backend.find_multipart_upload('a.wav')) == '3'
+    assert asyncio.run(backend.find_multipart_upload('b.wav')) is None
@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from minio.error import S3Error
+
+from api.models import MultipartUploadRequest
+from api.routers import minio
+
+class Storage:
+    '''
+    Object storage without objects, with the upload `upload_id` in progress
+    '''
+
+    def __init__(self, upload_id, checksums):
+        self.upload_id = upload_id
+        self.objects = dict(checksums)
+        self.aborted = []
+        self.created = []
+
+    def error(self, code):
+        return S3Error(code, code, None, None, None, None)
+
+    async def stat(self, object_name):
+        raise self.error('NoSuchKey')
+
+    async def find_multipart_upload(self, object_name):
+        return self.upload_id
+
+    async def create_multipart_upload(self, object_name, metadata):
+        self.created.append(metadata)
+        return 'new'
+
+    async def abort_multipart_upload(self, object_name, upload_id):
+        self.aborted.append(upload_id)
+
+    async def list_parts(self, object_name, upload_id):
+        return [SimpleNamespace(part_number=1, size=minio.multipart_part_size, etag='etag')]
+
+    async def put(self, object_name, data, length):
+        self.objects[object_name] = data.read()
+
+    async def get(self, object_name):
+        if object_name not in self.objects:
+            raise self.error('NoSuchKey')
+        content = self.objects[object_name]
+        async def read():
+            return content
+        return SimpleNamespace(read=read)
+
+    async def remove(self, object_name):
+        self.objects.pop(object_name, None)
+
+sha256 = 'a' * 64
+request = MultipartUploadRequest(object_name='a.wav', sha256=sha256, size=40 * 1024**2)
+
+@pytest.fixture
+def storage(monkeypatch):
+    def install(upload_id, checksums={}):
+        storage = Storage(upload_id, checksums)
+        monkeypatch.setattr(minio, 'storage', storage)
+        return storage
+    return install
+
+def test_resume_upload(storage):
+    backend = storage('old', {'uploads/old.sha256': sha256.encode()})
+    upload = asyncio.run(minio.post_multipart_upload(request))
+    assert upload.upload_id == 'old'
+    assert [p.part_number for p in upload.parts] == [1]
+    assert backend.aborted == []
+
+@pytest.mark.parametrize('checksums', [{'uploads/old.sha256': b'b' * 64}, {}])
+def test_restart_upload_of_other_content(storage, checksums):
+    backend = storage('old', checksums)
+    upload = asyncio.run(minio.post_multipart_upload(request))
+    assert upload.upload_id == 'new'
+    assert upload.parts == []
+    assert backend.aborted == ['old']
+    assert backend.created == [{'sha256': sha256}]
+    assert backend.objects == {'uploads/new.sha256': sha256.encode()}
@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta, timezone
+
+from api.routers.validators import compose_object_name
+
+def test_compose_object_name():
+    timestamp = datetime(2022, 8, 1, 9, 5, 30, tzinfo=timezone.utc)
+    assert compose_object_name('1234-5678', timestamp, '.wav') == \
+        '1234-5678/2022-08-01/09/1234-5678_2022-08-01T09-05-30Z.wav'
+
+def test_compose_object_name_in_utc():
+    timestamp = datetime(2022, 8, 1, 1, 5, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert compose_object_name('1234-5678', timestamp, '.jpg') == \
+        '1234-5678/2022-07-31/23/1234-5678_2022-07-31T23-05-30Z.jpg'
+
+def test_compose_object_name_naive():
+    assert compose_object_name('1234-5678', datetime(2022, 8, 1, 9, 5, 30), '.wav') == \
+        '1234-5678/2022-08-01/09/1234-5678_2022-08-01T09-05-30Z.wav'
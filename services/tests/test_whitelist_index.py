@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from api import indexes
+from api.indexes import NotifiedIndex, WhitelistIndex
+
+@pytest.fixture
+def whitelist(fake_database):
+    return fake_database(indexes, [{'object_name': name} for name in [
+        'walk/1/image_01.jpg',
+        'walk/1/image_02.jpg',
+        'tv/2022-08-01/clip.webp',
+    ]])
+
+def test_notified_index_is_abstract():
+    with pytest.raises(TypeError):
+        NotifiedIndex()
+
+def test_whitelist_contains(whitelist):
+    index = WhitelistIndex()
+    assert asyncio.run(index.contains('walk/1/image_01.jpg'))
+    assert not asyncio.run(index.contains('walk/1/image_03.jpg'))
+    assert not asyncio.run(index.contains('walk/1'))
+
+def test_whitelist_contains_prefix(whitelist):
+    index = WhitelistIndex()
+    assert asyncio.run(index.contains_prefix('walk/1/image_02'))
+    assert asyncio.run(index.contains_prefix('tv/2022-08-01/clip'))
+    assert asyncio.run(index.contains_prefix('tv/'))
+    assert not asyncio.run(index.contains_prefix('walk/1/image_03'))
+    assert not asyncio.run(index.contains_prefix('walk/2'))
+    assert not asyncio.run(index.contains_prefix('x'))
+    assert whitelist.queries == 1
+
+def test_whitelist_reload_failed(whitelist):
+    index = WhitelistIndex()
+    asyncio.run(index.contains('walk/1/image_01.jpg'))
+    index.invalidate()
+    async def fail(query, values=None):
+        raise ConnectionError()
+    whitelist.fetch_all = fail
+    with pytest.raises(ConnectionError):
+        asyncio.run(index.contains('walk/1/image_01.jpg'))
+    # stays stale, to be reloaded on the next lookup
+    assert index.stale